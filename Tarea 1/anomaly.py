@@ -0,0 +1,186 @@
+import json
+import logging
+import numpy as np
+from frame_generator import FRAME_PIXELS
+
+logger = logging.getLogger(__name__)
+
+# Subject the alerts of a sensor are published on
+ALERT_SUBJECT = "sensors.{}.alerts"
+
+# Floor of the variance of a pixel, in squared sensor units, so that a pixel that never changed does not alert on the smallest change
+MIN_VARIANCE = 1.0
+
+
+def check_detection(threshold, alpha, hot_value, cooldown):
+    """
+    Check the settings of an ``AnomalyDetector``.
+
+    Args:
+        threshold (float): Z-score above which a pixel is anomalous, or None.
+        alpha (float): Weight of every new frame in the moving statistics.
+        hot_value (int): Value at or above which a pixel is anomalous, or None.
+        cooldown (float): Minimum time in seconds between two alerts.
+
+    Raises:
+        ValueError: If no threshold is given or a setting is out of range.
+    """
+    if threshold is None and hot_value is None:
+        raise ValueError("either threshold or hot_value must be given")
+    if threshold is not None and threshold <= 0:
+        raise ValueError("threshold must be greater than 0")
+    if not 0 < alpha < 1:
+        raise ValueError("alpha must be between 0 and 1")
+    if cooldown < 0:
+        raise ValueError("cooldown must not be negative")
+
+
+class AnomalyDetector:
+    """
+    Incremental per-pixel anomaly detection on the frames of a sensor.
+
+    Every pixel keeps an exponentially weighted moving mean and variance.
+    Each frame is scored against the statistics of the frames before it, as a
+    per-pixel z-score, and then folded into them, with a handful of in-place
+    NumPy operations on preallocated arrays: memory is constant per pixel and
+    the cost is constant per frame. A pixel is anomalous when its z-score
+    exceeds ``threshold`` (once ``warmup`` frames have been seen), or when its
+    value reaches ``hot_value``.
+
+    A frame with anomalous pixels produces an alert holding only those
+    pixels, published at once on ``sensors.<id>.alerts``. Alerts closer than
+    ``cooldown`` seconds to the previous one are counted but not published,
+    so a lasting hot spot does not flood the subscribers.
+    """
+
+    def __init__(self, publish, sensor_id, threshold=None, alpha=0.05, hot_value=None, cooldown=1.0, warmup=None):
+        """
+        Initialize AnomalyDetector object.
+
+        Args:
+            publish (callable): Coroutine function taking a subject and a payload, such as ``NATSClient.publish``,
+                or None to only count the alerts.
+            sensor_id (int): Identifier of the sensor.
+            threshold (float, optional): Z-score above which a pixel is anomalous. Defaults to None (disabled).
+            alpha (float, optional): Weight of every new frame in the moving statistics. Defaults to 0.05.
+            hot_value (int, optional): Value at or above which a pixel is anomalous. Defaults to None (disabled).
+            cooldown (float, optional): Minimum time in seconds between two published alerts. Defaults to 1.0.
+            warmup (int, optional): Number of frames before z-scores are trusted. Defaults to ``1 / alpha``.
+        """
+        check_detection(threshold, alpha, hot_value, cooldown)
+        self.publish = publish
+        self.sensor_id = sensor_id
+        self.subject = ALERT_SUBJECT.format(sensor_id)
+        self.threshold = threshold
+        self.alpha = alpha
+        self.hot_value = hot_value
+        self.cooldown = cooldown
+        self.warmup = int(round(1 / alpha)) if warmup is None else warmup
+        self.mean = np.zeros(FRAME_PIXELS, dtype=np.float64)
+        self.variance = np.zeros(FRAME_PIXELS, dtype=np.float64)
+        self.diff = np.empty(FRAME_PIXELS, dtype=np.float64)
+        self.z = np.zeros(FRAME_PIXELS, dtype=np.float64)
+        self.scratch = np.empty(FRAME_PIXELS, dtype=np.float64)
+        self.flags = np.zeros(FRAME_PIXELS, dtype=bool)
+        self.hot = np.zeros(FRAME_PIXELS, dtype=bool)
+        self.count = 0
+        self.last_alert = None
+        self.frames_flagged = 0
+        self.alerts_published = 0
+        self.alerts_suppressed = 0
+        self.alerts_failed = 0
+        self.suppressed_since_alert = 0
+
+    def update(self, frame):
+        """
+        Score a frame against the moving statistics, then fold it into them.
+
+        Args:
+            frame (numpy.ndarray or bytes-like): The 64 frame values.
+
+        Returns:
+            numpy.ndarray: Boolean flags of the anomalous pixels, a view reused by the next call.
+        """
+        if not self.count:
+            # Start the statistics from the first frame, so that they need no time to converge
+            self.mean[:] = frame
+        np.subtract(frame, self.mean, out=self.diff)
+
+        # Z-score against the statistics of the previous frames
+        np.maximum(self.variance, MIN_VARIANCE, out=self.scratch)
+        np.sqrt(self.scratch, out=self.scratch)
+        np.divide(self.diff, self.scratch, out=self.z)
+
+        # mean += alpha * diff, then variance = (1 - alpha) * (variance + alpha * diff²)
+        np.multiply(self.diff, self.alpha, out=self.scratch)
+        np.add(self.mean, self.scratch, out=self.mean)
+        np.multiply(self.scratch, self.diff, out=self.scratch)
+        np.add(self.variance, self.scratch, out=self.variance)
+        np.multiply(self.variance, 1 - self.alpha, out=self.variance)
+        self.count += 1
+
+        self.flags.fill(False)
+        if self.threshold is not None and self.count > self.warmup:
+            np.abs(self.z, out=self.scratch)
+            np.greater(self.scratch, self.threshold, out=self.flags)
+        if self.hot_value is not None:
+            np.greater_equal(frame, self.hot_value, out=self.hot)
+            np.logical_or(self.flags, self.hot, out=self.flags)
+        return self.flags
+
+    async def add(self, reading_time, frame):
+        """
+        Check a frame, publishing an alert if it has anomalous pixels.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray): The 64 frame values.
+
+        Returns:
+            dict: The alert, or None if the frame has no anomalous pixel or the alert was suppressed.
+        """
+        flags = self.update(frame)
+        if not flags.any():
+            return None
+        self.frames_flagged += 1
+        if self.last_alert is not None and reading_time - self.last_alert < self.cooldown:
+            self.alerts_suppressed += 1
+            self.suppressed_since_alert += 1
+            return None
+
+        pixels = np.flatnonzero(flags)
+        alert = {
+            "sensor_id": self.sensor_id,
+            "reading_time": reading_time,
+            "pixels": pixels.tolist(),
+            "values": np.asarray(frame)[pixels].tolist(),
+            "z": np.round(self.z[pixels], 2).tolist(),
+            "suppressed": self.suppressed_since_alert,
+        }
+        self.last_alert = reading_time
+        self.suppressed_since_alert = 0
+        if self.publish is None:
+            return alert
+        try:
+            await self.publish(self.subject, json.dumps(alert).encode())
+        except Exception as e:
+            self.alerts_failed += 1
+            logger.warning("Error publishing alert of sensor %s: %s", self.sensor_id, e)
+            return alert
+        self.alerts_published += 1
+        return alert
+
+    def stats(self):
+        """
+        Get the detector counters.
+
+        Returns:
+            dict: Frames checked and flagged, and alerts published, suppressed by the cooldown and failed to publish.
+        """
+        return {
+            "frames_checked": self.count,
+            "frames_flagged": self.frames_flagged,
+            "alerts_published": self.alerts_published,
+            "alerts_suppressed": self.alerts_suppressed,
+            "alerts_failed": self.alerts_failed,
+        }
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import nats
+import numpy as np
+import database
+import logging_setup
+from cli import parse_period
+from local_broker import LocalBroker
+from metrics import LatencyHistogram
+from nats_client_dev import NATSClient
+from sensor_application import SensorApplication
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is not reported
+    resource = None
+
+# Results compared against the baseline, with whether a higher value is better
+COMPARED_RESULTS = {
+    "frames_per_second": True,
+    "jitter_p99": False,
+    "control_latency_p99": False,
+    "cpu_percent": False,
+}
+
+
+def parse_list(cast):
+    """
+    Build an argument parser for comma-separated lists.
+
+    Args:
+        cast (callable): Parser of a single item.
+
+    Returns:
+        callable: Function parsing a comma-separated string into a list of items.
+    """
+    def parse(value):
+        return [cast(item) for item in value.split(",") if item.strip()]
+    return parse
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident memory of the process so far.
+
+    The peak covers the whole life of the process, so it only measures one
+    scenario when the scenario runs in a process of its own, see ``run_isolated()``.
+
+    Returns:
+        float: Peak resident set size in MiB, or None if it cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def scenario_name(sensors, period, batch_size, storage_format):
+    """
+    Get the name identifying a scenario in the results and the baseline.
+    """
+    return f"sensors={sensors} rate={1 / period:g}Hz batch={batch_size} storage={storage_format}"
+
+
+async def run_scenario(sensors, period, batch_size, storage_format, duration, control_interval=0.01, seed=0):
+    """
+    Run the capture → store pipeline under one configuration and measure it.
+
+    The sensors capture mockup frames into a temporary database while a second
+    client sends ``sensors.<id>.latest`` requests through a ``LocalBroker``,
+    measuring the round trip of the control path under load.
+
+    Args:
+        sensors (int): Number of sensors capturing concurrently.
+        period (float): Period in seconds between two readings of a sensor.
+        batch_size (int): Maximum number of rows per transaction of the database writer.
+        storage_format (str): Storage format of the database, see ``database.STORAGE_FORMATS``, or ``framelog`` for the memory-mapped frame log.
+        duration (float): Capture time in seconds.
+        control_interval (float, optional): Time in seconds between two control requests. Defaults to 0.01.
+        seed (int, optional): Seed of the mockup data generators. Defaults to 0.
+
+    Returns:
+        dict: The measured results. ``peak_rss_mb`` is the peak of the whole process.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "benchmark.db")
+        if storage_format == "framelog":
+            db = database.open_database(database.FRAMELOG_SCHEME + os.path.join(tmp_dir, "framelog"))
+        else:
+            db = database.DatabaseManager(db_path, storage_format=storage_format)
+        db.connect()
+        db.start_writer(batch_size)
+        app = SensorApplication(db)
+        for sensor_id in range(1, sensors + 1):
+            app.add_sensor(sensor_id, "mockup", period, 0, 4095, seed=seed)
+
+        # Serve the control subjects through the local broker, as main.py does through a real server
+        broker = await LocalBroker().start()
+        client = NATSClient(broker.url, db, argparse.Namespace(sensor_type=None), asyncio.Event(), app)
+        await client.connect()
+        await client.subscribe_sensors()
+        requester = await nats.connect(broker.url)
+
+        control_latencies = []
+        control_timeouts = 0
+        sensor_ids = itertools.cycle(sorted(app.sensors))
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        await app.start_all()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            sent = time.perf_counter()
+            try:
+                await requester.request(f"sensors.{next(sensor_ids)}.latest", b"", timeout=1)
+                control_latencies.append(time.perf_counter() - sent)
+            except nats.errors.TimeoutError:
+                control_timeouts += 1
+            await asyncio.sleep(control_interval)
+        await app.stop_all()
+        capture_time = time.perf_counter() - wall_start
+
+        await requester.close()
+        await client.nc.close()
+        await broker.stop()
+        # Closing flushes the writer, so the time to store the queued frames is part of the CPU time
+        db.close()
+        cpu_time = time.process_time() - cpu_start
+        wall_time = time.perf_counter() - wall_start
+
+        if storage_format == "framelog":
+            frames_stored = sum(len(db.log.sensor(sensor_id)) for sensor_id in app.sensors)
+        else:
+            conn = sqlite3.connect(db_path)
+            if storage_format == "chunked":
+                frames_stored = conn.execute("SELECT COALESCE(SUM(frame_count), 0) FROM infrared_chunks").fetchone()[0]
+            else:
+                frames_stored = conn.execute("SELECT COUNT(*) FROM infrared_data").fetchone()[0]
+            conn.close()
+
+    jitter = LatencyHistogram()
+    for sensor in app.sensors.values():
+        jitter.merge(sensor.metrics.stages["jitter"])
+    frames_captured = sum(sensor.metrics.frames_captured for sensor in app.sensors.values())
+    return {
+        "frames_captured": frames_captured,
+        "frames_stored": frames_stored,
+        "frames_dropped": sum(sensor.metrics.frames_dropped for sensor in app.sensors.values()),
+        "frames_per_second": frames_captured / capture_time,
+        "target_frames_per_second": sensors / period,
+        "jitter_p50": jitter.percentile(50),
+        "jitter_p99": jitter.percentile(99),
+        "jitter_max": jitter.max,
+        "control_requests": len(control_latencies),
+        "control_timeouts": control_timeouts,
+        "control_latency_p50": float(np.percentile(control_latencies, 50)) if control_latencies else None,
+        "control_latency_p99": float(np.percentile(control_latencies, 99)) if control_latencies else None,
+        "cpu_seconds": cpu_time,
+        "cpu_percent": 100.0 * cpu_time / wall_time,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_scenario_process(*args, **kwargs):
+    """
+    Run a scenario on its own event loop, as the entry point of a scenario process.
+
+    Args:
+        *args: Positional arguments of ``run_scenario()``.
+        **kwargs: Keyword arguments of ``run_scenario()``.
+
+    Returns:
+        dict: The measured results.
+    """
+    logging_setup.configure_logging("ERROR", None)
+    try:
+        return asyncio.run(run_scenario(*args, **kwargs))
+    finally:
+        logging_setup.stop_logging()
+
+
+async def run_isolated(*args, **kwargs):
+    """
+    Run a scenario in a new process, so that its peak memory is not the one of the scenarios before it.
+
+    Args:
+        *args: Positional arguments of ``run_scenario()``.
+        **kwargs: Keyword arguments of ``run_scenario()``.
+
+    Returns:
+        dict: The measured results.
+    """
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(run_scenario_process, *args, **kwargs))
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compare benchmark results against a baseline.
+
+    Scenarios are matched by name; scenarios missing from either side are ignored.
+
+    Args:
+        results (dict): The current results, as written by ``main()``.
+        baseline (dict): The baseline results, in the same format.
+        tolerance (float): Relative change tolerated before a result counts as a regression.
+
+    Returns:
+        list: One dict per compared value with the ``scenario``, ``result``, ``baseline``,
+        ``current`` and relative ``change`` values, and whether it is a ``regression``.
+    """
+    baseline_scenarios = {scenario["name"]: scenario["results"] for scenario in baseline["scenarios"]}
+    comparisons = []
+    for scenario in results["scenarios"]:
+        previous = baseline_scenarios.get(scenario["name"])
+        if previous is None:
+            continue
+        for key, higher_is_better in COMPARED_RESULTS.items():
+            old, new = previous.get(key), scenario["results"].get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            comparisons.append({
+                "scenario": scenario["name"],
+                "result": key,
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regression": change < -tolerance if higher_is_better else change > tolerance,
+            })
+    return comparisons
+
+
+def parse_args(args):
+    """
+    Parse the benchmark command-line arguments.
+
+    Args:
+        args (list): Command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark of the capture and storage pipeline')
+    parser.add_argument('--sensors', type=parse_list(int), default=[1, 8], help='Comma-separated numbers of concurrent sensors')
+    parser.add_argument('--rates', type=parse_list(parse_period), default=[parse_period('100Hz'), parse_period('1000Hz')], help='Comma-separated reading frequencies (e.g. 100Hz,10ms)')
+    parser.add_argument('--batch-sizes', type=parse_list(int), default=[500], help='Comma-separated batch sizes of the database writer')
+    parser.add_argument('--storage-formats', type=parse_list(str), default=list(database.STORAGE_FORMATS) + ['framelog'], help='Comma-separated storage formats (rows, chunked, framelog)')
+    parser.add_argument('--duration', type=float, default=5.0, help='Capture time in seconds of every scenario')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the mockup data generators')
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help='JSON file the results are written to')
+    parser.add_argument('--baseline', type=str, help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative change tolerated before a result counts as a regression')
+    return parser.parse_args(args)
+
+
+async def main(argv):
+    """
+    Run every combination of the benchmark parameters and report the results.
+
+    Args:
+        argv (list): Command-line arguments.
+
+    Returns:
+        int: Exit status, 1 if a regression against the baseline was found.
+    """
+    args = parse_args(argv)
+    logging_setup.configure_logging("ERROR", None)
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "duration": args.duration,
+        "scenarios": [],
+    }
+    try:
+        for sensors, period, batch_size, storage_format in itertools.product(args.sensors, args.rates, args.batch_sizes, args.storage_formats):
+            name = scenario_name(sensors, period, batch_size, storage_format)
+            # Every scenario gets a fresh process, so its peak memory is its own
+            scenario = await run_isolated(sensors, period, batch_size, storage_format, args.duration, seed=args.seed)
+            results["scenarios"].append({
+                "name": name,
+                "params": {"sensors": sensors, "period": period, "batch_size": batch_size, "storage_format": storage_format},
+                "results": scenario,
+            })
+            print(f"{name:<50} {scenario['frames_per_second']:>9.1f} frames/s  "
+                  f"jitter p99 {scenario['jitter_p99'] * 1000:.2f}ms  "
+                  f"control p99 {(scenario['control_latency_p99'] or 0) * 1000:.2f}ms  "
+                  f"CPU {scenario['cpu_percent']:.0f}%")
+    finally:
+        logging_setup.stop_logging()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = [comparison for comparison in compare_results(results, baseline, args.tolerance) if comparison["regression"]]
+    for comparison in regressions:
+        print(f"REGRESSION {comparison['scenario']}: {comparison['result']} {comparison['baseline']:.6g} -> {comparison['current']:.6g} ({comparison['change']:+.1%})")
+    if not regressions:
+        print(f"No regression against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
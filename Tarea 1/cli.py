@@ -1,12 +1,229 @@
 import argparse #type: ignore
+from frame_codec import ENCODINGS, COMPRESSIONS
+from logging_setup import LOG_LEVELS
+from database import OVERFLOW_POLICIES, FRAMELOG_SCHEME
+
+# Shortest supported period between two sensor readings, in seconds
+MIN_READING_PERIOD = 0.001
+
+def parse_period(value):
+    """
+    Parse a reading frequency into a period in seconds.
+
+    Accepts a plain number of seconds (``2``, ``0.5``), or a value with one of
+    the ``s``, ``ms`` or ``Hz`` suffixes (``0.5s``, ``10ms``, ``100Hz``).
+
+    Args:
+        value (str): The value given on the command line.
+
+    Returns:
+        float: The period in seconds.
+    """
+    text = value.strip().lower()
+    try:
+        if text.endswith('hz'):
+            period = 1.0 / float(text[:-2])
+        elif text.endswith('ms'):
+            period = float(text[:-2]) / 1000.0
+        elif text.endswith('s'):
+            period = float(text[:-1])
+        else:
+            period = float(text)
+    except (ValueError, ZeroDivisionError):
+        raise argparse.ArgumentTypeError(f"invalid reading frequency: {value!r}")
+    if not period >= MIN_READING_PERIOD:
+        raise argparse.ArgumentTypeError(f"reading frequency must be a period of at least {MIN_READING_PERIOD}s (1000Hz)")
+    return period
+
+def parse_intervals(value):
+    """
+    Parse a list of rollup intervals.
+
+    Args:
+        value (str or list): Comma-separated seconds (``"60,3600"``) or a list of seconds. An empty string disables rollups.
+
+    Returns:
+        tuple: The intervals in seconds, as integers.
+    """
+    if isinstance(value, str):
+        value = [item for item in value.split(",") if item.strip()]
+    intervals = tuple(int(item) for item in value)
+    if any(interval <= 0 for interval in intervals):
+        raise ValueError("rollup intervals must be greater than 0")
+    return intervals
+
+# Seconds in every unit suffix accepted by parse_duration
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_duration(value):
+    """
+    Parse a duration into seconds.
+
+    Accepts a plain number of seconds (``3600``), or a value with one of the
+    ``s``, ``m``, ``h`` or ``d`` suffixes (``90m``, ``30d``).
+
+    Args:
+        value (str): The value given on the command line.
+
+    Returns:
+        float: The duration in seconds.
+    """
+    text = value.strip().lower()
+    try:
+        if text[-1:] in DURATION_UNITS:
+            return float(text[:-1]) * DURATION_UNITS[text[-1]]
+        return float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+
+def parse_count(value):
+    """
+    Parse a count that may be 0.
+
+    Args:
+        value (str): The value given on the command line.
+
+    Returns:
+        int: The count.
+    """
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid count: {value!r}")
+    if count < 0:
+        raise argparse.ArgumentTypeError(f"count must not be negative: {value!r}")
+    return count
+
+def sensor_options(args):
+    """
+    Get the options of every sensor given on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        dict: Keyword arguments of ``DataCapture``, the defaults of ``SensorApplication``.
+    """
+    return {
+        "rollup_intervals": args.rollup_intervals,
+        "anomaly_threshold": args.anomaly_threshold,
+        "anomaly_alpha": args.anomaly_alpha,
+        "anomaly_hot_value": args.anomaly_hot_value,
+        "anomaly_cooldown": args.anomaly_cooldown,
+        "deadband": args.deadband,
+        "heartbeat": args.heartbeat or None,
+    }
+
+def database_options(args):
+    """
+    Get the options of ``database.open_database()`` given on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        dict: Keyword arguments of ``open_database()``, besides the database URI.
+    """
+    return {
+        "segment_bytes": args.framelog_segment_mb * 1024 * 1024,
+        "segment_seconds": args.framelog_segment_seconds or None,
+        "storage_format": args.storage_format,
+        "chunk_frames": args.chunk_frames,
+        "chunk_encoding": args.chunk_encoding,
+        "chunk_compression": args.chunk_compression,
+        "chunk_max_age": args.chunk_max_age,
+        "partition": None if args.partition == 'none' else args.partition,
+        "retention": args.retention or None,
+    }
+
+def writer_options(args):
+    """
+    Get the options of ``DatabaseManager.start_writer()`` given on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        dict: Keyword arguments of ``start_writer()``.
+    """
+    return {
+        "batch_size": args.batch_size,
+        "max_delay": args.batch_max_delay,
+        "max_pending": args.writer_max_pending or None,
+        "overflow": args.writer_overflow,
+        "spill_path": args.spill_path,
+    }
+
+def loop_monitor_options(args):
+    """
+    Get the options of ``loop_monitor.LoopMonitor`` given on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+        dict: Keyword arguments of ``LoopMonitor``.
+    """
+    return {
+        "interval": args.loop_monitor_interval,
+        "block_threshold": args.block_threshold or None,
+    }
 
 def parse_args(args=None):
     parser = argparse.ArgumentParser(description='Infrared Sensor Reader')
-    parser.add_argument('--sensor-type', type=str, choices=['mockup', 'real'], required=True, help='Type of sensor to use')
-    parser.add_argument('--reading-frequency', type=int, required=True, help='Frequency of sensor readings')
+    parser.add_argument('--sensor-type', type=str, choices=['mockup', 'real'], help='Type of sensor to use (required unless --sensors-config is given)')
+    parser.add_argument('--reading-frequency', type=parse_period, help='Period between sensor readings in seconds, or with a unit suffix (e.g. 0.5, 10ms, 100Hz) (required with --sensor-type)')
     parser.add_argument('--min-value', type=int, help='Minimum value of generated data (only used with --sensor-type mockup)')
     parser.add_argument('--max-value', type=int, help='Maximum value of generated data (only used with --sensor-type mockup)')
-    parser.add_argument('--db-uri', type=str, required=True, help='URI of the SQL database')
+    parser.add_argument('--seed', type=int, help='Seed of the mockup data generator, for reproducible data (only used with --sensor-type mockup)')
+    parser.add_argument('--device', type=str, help='Device of the real sensor: a character device or serial port path, tcp://<host>:<port> or unix://<path> (required with --sensor-type real)')
+    parser.add_argument('--baudrate', type=int, help='Speed of the serial port of the real sensor (only used with a serial port --device)')
+    parser.add_argument('--sensor-id', type=int, default=0, help='Identifier of the sensor given by --sensor-type, stored with every reading')
+    parser.add_argument('--sensors-config', type=str, help='JSON file describing the sensors to run concurrently')
+    parser.add_argument('--workers', type=parse_count, default=0, help='Number of worker processes the sensors of --sensors-config are sharded across (0 to run them all in this process)')
+    parser.add_argument('--db-uri', type=str, required=True, help='URI of the SQL database, or framelog://<directory> for the memory-mapped frame log')
+    parser.add_argument('--batch-size', type=int, default=500, help='Maximum number of readings committed in a single transaction')
+    parser.add_argument('--batch-max-delay', type=float, default=0.5, help='Maximum time in seconds a reading waits before being committed')
+    parser.add_argument('--writer-max-pending', type=int, default=100000, help='Maximum number of readings waiting to be committed (0 for no limit)')
+    parser.add_argument('--writer-overflow', type=str, choices=OVERFLOW_POLICIES, default='block', help='What to do with new readings when --writer-max-pending readings are waiting (the drop and spill policies are opt-in)')
+    parser.add_argument('--spill-path', type=str, help='Overflow file of the spill policy (default: the database path followed by .spill)')
+    parser.add_argument('--storage-format', type=str, choices=['rows', 'chunked'], default='rows', help='Store every reading in its own row, or consecutive readings as compressed chunks')
+    parser.add_argument('--chunk-frames', type=int, default=256, help='Number of readings per chunk (only used with --storage-format chunked)')
+    parser.add_argument('--chunk-encoding', type=str, choices=ENCODINGS, default='delta', help='Transform applied to each reading against the previous one (only used with --storage-format chunked)')
+    parser.add_argument('--chunk-compression', type=str, choices=COMPRESSIONS, default='zlib', help='Compressor of the chunks (only used with --storage-format chunked)')
+    parser.add_argument('--chunk-max-age', type=float, default=60.0, help='Maximum time in seconds a reading waits in memory before its chunk is stored (only used with --storage-format chunked)')
+    parser.add_argument('--partition', type=str, choices=['none', 'hour', 'day'], default='none', help='Store the readings in one database file per hour or per day')
+    parser.add_argument('--retention', type=parse_duration, default=0, help='Time partitions are kept after they end, e.g. 30d or 12h, 0 to keep them forever (only used with --partition)')
+    parser.add_argument('--framelog-segment-mb', type=int, default=64, help='Size in MiB of every frame log segment file (only used with a framelog:// database)')
+    parser.add_argument('--framelog-segment-seconds', type=float, default=3600.0, help='Maximum time in seconds a frame log segment is written to before starting a new one, 0 to roll by size only (only used with a framelog:// database)')
+    parser.add_argument('--rollup-intervals', type=parse_intervals, default=(60, 3600), help='Comma-separated sizes in seconds of the time buckets summarized at ingest (empty to disable)')
+    parser.add_argument('--query-chunk-bytes', type=int, default=64 * 1024, help='Maximum size in bytes of each reply chunk sent by the query service')
+    parser.add_argument('--stream', action='store_true', help='Publish every reading live on sensors.<id>.frames')
+    parser.add_argument('--stream-batch-size', type=int, default=1, help='Maximum number of readings per live message (only used with --stream)')
+    parser.add_argument('--stream-linger', type=float, default=0.005, help='Maximum time in seconds a reading waits for its live message to fill (only used with --stream)')
+    parser.add_argument('--anomaly-threshold', type=float, help='Per-pixel z-score against the moving statistics above which a reading raises an alert on sensors.<id>.alerts')
+    parser.add_argument('--anomaly-hot-value', type=int, help='Pixel value at or above which a reading raises an alert on sensors.<id>.alerts')
+    parser.add_argument('--anomaly-alpha', type=float, default=0.05, help='Weight of every new reading in the moving per-pixel mean and variance')
+    parser.add_argument('--anomaly-cooldown', type=float, default=1.0, help='Minimum time in seconds between two alerts of a sensor')
+    parser.add_argument('--deadband', type=parse_count, help='Only store a reading when some pixel changed by more than this since the last stored reading, counting the skipped ones (rows storage format only)')
+    parser.add_argument('--heartbeat', type=parse_duration, default=60.0, help='Maximum time in seconds between two stored readings with --deadband (0 for no limit)')
+    parser.add_argument('--node-id', type=str, help='Name of this capture node: every reading is also forwarded to the collector, until it acknowledges it')
+    parser.add_argument('--forward-batch-size', type=int, default=100, help='Maximum number of readings per batch forwarded to the collector (only used with --node-id)')
+    parser.add_argument('--forward-linger', type=float, default=0.05, help='Maximum time in seconds a reading waits for its forwarded batch to fill (only used with --node-id)')
+    parser.add_argument('--ack-timeout', type=float, default=5.0, help='Time in seconds after which a batch the collector did not acknowledge is sent again (only used with --node-id)')
+    parser.add_argument('--max-unacked', type=int, default=1000, help='Maximum number of batches per sensor waiting for the acknowledgement of the collector, the oldest are dropped beyond it (only used with --node-id)')
+    parser.add_argument('--collector', action='store_true', help='Run as the collector, storing the readings forwarded by the capture nodes instead of capturing')
+    parser.add_argument('--collector-batch-frames', type=int, default=20000, help='Maximum number of forwarded readings per transaction of the collector')
+    parser.add_argument('--collector-max-delay', type=float, default=0.2, help='Maximum time in seconds a forwarded reading waits before the collector commits it')
+    parser.add_argument('--collector-gap-timeout', type=float, default=10.0, help='Time in seconds the collector waits for missing readings to be sent again before giving up on them')
+    parser.add_argument('--metrics-interval', type=float, default=10.0, help='Time in seconds between two metrics snapshots published on sensors.<id>.metrics (0 to disable)')
+    parser.add_argument('--loop-monitor-interval', type=float, default=0.1, help='Time in seconds between two measures of the scheduling delay of the event loop (0 to disable)')
+    parser.add_argument('--block-threshold', type=float, help='Time in seconds the event loop may be held before the stack holding it is logged (default: 0.1 in debug mode, 0 to disable)')
+    parser.add_argument('--log-level', type=str.upper, choices=LOG_LEVELS, default='INFO', help='Minimum level of the messages logged')
+    parser.add_argument('--log-file', type=str, default='app.log', help='Path of the log file (empty to only log to the console)')
+    parser.add_argument('--log-max-bytes', type=int, default=10 * 1024 * 1024, help='Size in bytes at which the log file is rotated (0 to never rotate)')
+    parser.add_argument('--log-backup-count', type=int, default=5, help='Number of rotated log files kept')
+    parser.add_argument('--log-sample-every', type=int, default=100, help='Only log one in this many per-reading debug messages')
 
     # Add a check to ensure that --min-value and --max-value are provided when --sensor-type is mockup
     def check_mockup_args(args):
@@ -15,4 +232,24 @@ def parse_args(args=None):
                 parser.error('--min-value and --max-value are required when --sensor-type is mockup')
         return args
 
-    return parser.parse_args(args)
\ No newline at end of file
+    parsed = parser.parse_args(args)
+    if parsed.collector:
+        if parsed.sensors_config is not None or parsed.sensor_type is not None or parsed.workers or parsed.node_id:
+            parser.error('--collector cannot be combined with --sensors-config, --sensor-type, --workers or --node-id')
+        if parsed.storage_format != 'rows' or parsed.db_uri.startswith(FRAMELOG_SCHEME):
+            parser.error('--collector requires --storage-format rows and a SQLite database')
+        return parsed
+    if parsed.sensors_config is None:
+        if parsed.sensor_type is None or parsed.reading_frequency is None:
+            parser.error('--sensor-type and --reading-frequency are required unless --sensors-config is given')
+    elif parsed.sensor_type is not None and parsed.reading_frequency is None:
+        parser.error('--reading-frequency is required with --sensor-type')
+    if parsed.sensor_type == 'real' and not parsed.device:
+        parser.error('--device is required with --sensor-type real')
+    if parsed.workers and (parsed.sensors_config is None or parsed.sensor_type is not None):
+        parser.error('--workers requires --sensors-config and cannot be combined with --sensor-type')
+    if parsed.deadband is not None and (parsed.storage_format != 'rows' or parsed.db_uri.startswith(FRAMELOG_SCHEME)):
+        parser.error('--deadband requires --storage-format rows and a SQLite database')
+    if parsed.node_id is not None and parsed.workers:
+        parser.error('--node-id cannot be combined with --workers')
+    return parsed
\ No newline at end of file
@@ -0,0 +1,757 @@
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import re
+import secrets
+import sqlite3
+import struct
+import time
+import cli
+import database
+from frame_stream import FramePublisher, decode_frames
+from nats_client_dev import NATSClient
+
+logger = logging.getLogger(__name__)
+
+# Subject the frames of a sensor of a capture node are forwarded on
+FORWARD_SUBJECT = "collector.{}.{}.frames"
+
+# Header of a forwarded batch, before the frames: epoch of the forwarder and sequence number of the oldest frame it waits an acknowledgement for
+FORWARD_HEADER = struct.Struct('<QQ')
+
+# Number of previous epochs of a stream whose late batches are recognized and dropped
+RETIRED_EPOCHS = 8
+
+# Subject a capture node receives the acknowledgements of the collector on
+ACK_SUBJECT = "collector.{}.acks"
+
+# Subject of the time-range queries on the central database, answered like ``sensors.query``
+COLLECTOR_QUERY_SUBJECT = "collector.query"
+
+# Subject of the requests for the streams known to the collector and its counters
+COLLECTOR_STREAMS_SUBJECT = "collector.streams"
+
+# Valid names of capture nodes, a single subject token
+NODE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Table mapping every (node, sensor) stream to the sensor identifier of its readings in the central database
+STREAMS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS collector_streams (
+        central_id INTEGER PRIMARY KEY,
+        node TEXT NOT NULL,
+        sensor_id INTEGER NOT NULL,
+        next_seq INTEGER NOT NULL,
+        epoch INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (node, sensor_id)
+    )
+"""
+
+# Query used to record the sequence number up to which a stream is stored, in the transaction of its readings
+UPSERT_STREAM_QUERY = """
+    INSERT INTO collector_streams (central_id, node, sensor_id, next_seq, epoch) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (central_id) DO UPDATE SET next_seq = excluded.next_seq, epoch = excluded.epoch
+"""
+
+
+def check_node_id(node_id):
+    """
+    Check the name of a capture node.
+
+    Args:
+        node_id (str): The name.
+
+    Raises:
+        ValueError: If the name is not a single subject token of letters, digits, ``_`` and ``-``.
+    """
+    if not NODE_ID_PATTERN.match(node_id):
+        raise ValueError(f"Invalid node id {node_id!r}, expected letters, digits, '_' and '-'")
+
+
+def frame_blobs(frames):
+    """
+    Split a batch of frames into the blobs of its rows.
+
+    The batch is copied out of the message once, and every blob is a slice
+    of that copy, so no frame is converted on its own.
+
+    Args:
+        frames (numpy.ndarray): Frames of shape (n, 64), as decoded from the wire.
+
+    Returns:
+        list: One memoryview of the bytes of each frame.
+    """
+    size = frames.itemsize * frames.shape[1]
+    buffer = memoryview(frames.tobytes())
+    return [buffer[start:start + size] for start in range(0, len(buffer), size)]
+
+
+class FrameForwarder(FramePublisher):
+    """
+    Forwards the frames of a sensor to the collector, until it acknowledges them.
+
+    Frames are batched like live frames, and every batch is kept until the
+    collector acknowledges it. Batches not acknowledged within
+    ``ack_timeout`` seconds, because they or their acknowledgement were lost
+    or the collector was unreachable, are sent again, so a disconnection only
+    delays them. At most ``max_unacked`` batches are kept, dropping the
+    oldest ones beyond that. Every batch is sent after ``FORWARD_HEADER``,
+    with the epoch of the forwarder and the sequence number of the oldest
+    frame not acknowledged yet, so the collector knows where the frames of
+    the sensor resume. The epoch is drawn at random for every forwarder and
+    sequence numbers start at 0, so a restarted node starts a new epoch: the
+    collector tells its frames from the ones it stored before the restart
+    whatever the clocks of the node.
+    """
+
+    def __init__(self, publish, node_id, sensor_id, batch_size=100, linger=0.05, ack_timeout=5.0, max_unacked=1000):
+        """
+        Initialize FrameForwarder object.
+
+        Args:
+            publish (callable): Coroutine function taking a subject, a payload and a reply subject, such as ``NATSClient.publish``.
+            node_id (str): Name of the capture node.
+            sensor_id (int): Identifier of the sensor.
+            batch_size (int, optional): Maximum number of frames per batch. Defaults to 100.
+            linger (float, optional): Maximum time in seconds a frame waits for its batch to fill. Defaults to 0.05.
+            ack_timeout (float, optional): Time in seconds after which a batch not acknowledged is sent again. Defaults to 5.0.
+            max_unacked (int, optional): Maximum number of batches waiting for their acknowledgement. Defaults to 1000.
+        """
+        super().__init__(publish, sensor_id, batch_size, linger)
+        self.subject = FORWARD_SUBJECT.format(node_id, sensor_id)
+        self.ack_subject = ACK_SUBJECT.format(node_id)
+        self.ack_timeout = ack_timeout
+        self.max_unacked = max_unacked
+        self.epoch = secrets.randbits(63)
+        self.next_seq = 0
+        self.unacked = collections.OrderedDict()
+        self.frames_acked = 0
+        self.frames_resent = 0
+        self.frames_unacked_dropped = 0
+
+    async def send(self, seq, count, payload):
+        """
+        Keep an encoded batch until it is acknowledged, then send it.
+
+        Args:
+            seq (int): Sequence number of the first frame of the batch.
+            count (int): Number of frames in the batch.
+            payload (bytes): The encoded batch.
+        """
+        if len(self.unacked) >= self.max_unacked:
+            _, (dropped, _, _) = self.unacked.popitem(last=False)
+            self.frames_unacked_dropped += dropped
+        self.unacked[seq] = (count, payload, time.monotonic())
+        await self._send(payload)
+        self.frames_published += count
+
+    async def _send(self, payload):
+        """
+        Send a batch to the collector, asking for the acknowledgement on the subject of the node.
+
+        Args:
+            payload (bytes): The encoded batch.
+
+        Returns:
+            bool: False if the batch could not be sent.
+        """
+        header = FORWARD_HEADER.pack(self.epoch, next(iter(self.unacked)))
+        try:
+            await self.publish(self.subject, header + payload, self.ack_subject)
+        except Exception as e:
+            self.messages_failed += 1
+            logger.warning("Error forwarding frames of sensor %s: %s", self.sensor_id, e)
+            return False
+        self.messages_published += 1
+        return True
+
+    def ack(self, next_seq):
+        """
+        Forget the batches the collector stored.
+
+        Args:
+            next_seq (int): Sequence number up to which the frames of the sensor are stored, excluded.
+        """
+        while self.unacked:
+            seq, (count, _, _) = next(iter(self.unacked.items()))
+            if seq + count > next_seq:
+                break
+            del self.unacked[seq]
+            self.frames_acked += count
+
+    async def resend(self):
+        """
+        Send again the batches waiting longer than ``ack_timeout`` for their acknowledgement, oldest first.
+        """
+        now = time.monotonic()
+        for seq, (count, payload, sent) in list(self.unacked.items()):
+            if now - sent < self.ack_timeout or seq not in self.unacked:
+                continue
+            self.unacked[seq] = (count, payload, now)
+            if not await self._send(payload):
+                break
+            self.frames_resent += count
+
+    def stats(self):
+        """
+        Get the forwarder counters.
+
+        Returns:
+            dict: The publisher counters, and the frames acknowledged, resent, waiting for their
+            acknowledgement and dropped while waiting.
+        """
+        stats = super().stats()
+        stats.update({
+            "frames_acked": self.frames_acked,
+            "frames_resent": self.frames_resent,
+            "frames_unacked": sum(count for count, _, _ in self.unacked.values()),
+            "frames_unacked_dropped": self.frames_unacked_dropped,
+        })
+        return stats
+
+
+class CollectorLink:
+    """
+    Link of a capture node to the collector, shared by the forwarders of its sensors.
+
+    Acknowledgements for every sensor of the node arrive on
+    ``collector.<node>.acks``, and are handed to the forwarder of the sensor.
+    """
+
+    def __init__(self, publish, node_id, batch_size=100, linger=0.05, ack_timeout=5.0, max_unacked=1000):
+        """
+        Initialize CollectorLink object.
+
+        Args:
+            publish (callable): Coroutine function taking a subject, a payload and a reply subject, such as ``NATSClient.publish``.
+            node_id (str): Name of the capture node.
+            batch_size (int, optional): Maximum number of frames per batch. Defaults to 100.
+            linger (float, optional): Maximum time in seconds a frame waits for its batch to fill. Defaults to 0.05.
+            ack_timeout (float, optional): Time in seconds after which a batch not acknowledged is sent again. Defaults to 5.0.
+            max_unacked (int, optional): Maximum number of batches per sensor waiting for their acknowledgement. Defaults to 1000.
+
+        Raises:
+            ValueError: If the node id or a setting is invalid.
+        """
+        check_node_id(node_id)
+        if ack_timeout <= 0:
+            raise ValueError("ack_timeout must be greater than 0")
+        if max_unacked < 1:
+            raise ValueError("max_unacked must be at least 1")
+        self.publish = publish
+        self.node_id = node_id
+        self.ack_subject = ACK_SUBJECT.format(node_id)
+        self.options = {"batch_size": batch_size, "linger": linger, "ack_timeout": ack_timeout, "max_unacked": max_unacked}
+        self.forwarders = {}
+
+    def forwarder(self, sensor_id):
+        """
+        Create the forwarder of a sensor of the node.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            FrameForwarder: The forwarder, whose acknowledgements this link receives.
+        """
+        forwarder = self.forwarders[sensor_id] = FrameForwarder(self.publish, self.node_id, sensor_id, **self.options)
+        return forwarder
+
+    async def ack_handler(self, msg):
+        """
+        Handle an acknowledgement of the collector.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object, a JSON object with ``sensor_id``, ``epoch`` and ``next_seq``.
+        """
+        try:
+            ack = json.loads(msg.data)
+            forwarder = self.forwarders[int(ack["sensor_id"])]
+            # Acknowledgements of the frames of a previous run of the node do not apply to this one
+            if int(ack["epoch"]) == forwarder.epoch:
+                forwarder.ack(int(ack["next_seq"]))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Invalid collector acknowledgement %r: %s", msg.data, e)
+
+    async def resend_loop(self):
+        """
+        Periodically send again the batches that were not acknowledged in time.
+        """
+        interval = self.options["ack_timeout"] / 2
+        while True:
+            await asyncio.sleep(interval)
+            for forwarder in list(self.forwarders.values()):
+                await forwarder.resend()
+
+    async def drain(self, timeout):
+        """
+        Wait until every forwarded frame is acknowledged, sending again the batches that were not.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait.
+
+        Returns:
+            bool: True if every frame was acknowledged.
+        """
+        deadline = time.monotonic() + timeout
+        while any(forwarder.unacked for forwarder in self.forwarders.values()):
+            if time.monotonic() >= deadline:
+                return False
+            for forwarder in list(self.forwarders.values()):
+                await forwarder.resend()
+            await asyncio.sleep(0.01)
+        return True
+
+
+class Stream:
+    """
+    State of the frames of one sensor of one capture node, on the collector.
+    """
+
+    def __init__(self, central_id, node, sensor_id, next_seq, epoch):
+        """
+        Initialize Stream object.
+
+        Args:
+            central_id (int): Sensor identifier of the readings of the stream in the central database.
+            node (str): Name of the capture node.
+            sensor_id (int): Identifier of the sensor on the node.
+            next_seq (int): Sequence number of the next frame to store.
+            epoch (int): Epoch of the forwarder of the sensor, see ``FrameForwarder``.
+        """
+        self.central_id = central_id
+        self.node = node
+        self.sensor_id = sensor_id
+        self.next_seq = next_seq
+        self.committed_seq = next_seq
+        self.epoch = epoch
+        self.retired = collections.deque(maxlen=RETIRED_EPOCHS)
+        self.held = {}
+        self.held_since = None
+        self.replies = set()
+        self.frames_stored = 0
+        self.frames_duplicated = 0
+        self.frames_lost = 0
+        self.frames_stale = 0
+
+    def restart(self, epoch, next_seq):
+        """
+        Start a new epoch of the stream, after a restart of its node.
+
+        Batches held for the previous epoch will never be completed, so they are counted as lost.
+
+        Args:
+            epoch (int): The new epoch.
+            next_seq (int): Sequence number of the next frame to store, in the new epoch.
+        """
+        self.frames_lost += sum(len(batch["reading_time"]) for batch in self.held.values())
+        self.held.clear()
+        self.held_since = None
+        self.retired.append(self.epoch)
+        self.epoch = epoch
+        self.next_seq = next_seq
+
+    def stats(self):
+        """
+        Get the state of the stream.
+
+        Returns:
+            dict: Identifiers, stored sequence number and counters of the stream.
+        """
+        return {
+            "node": self.node,
+            "sensor_id": self.sensor_id,
+            "central_id": self.central_id,
+            "epoch": self.epoch,
+            "next_seq": self.committed_seq,
+            "frames_stored": self.frames_stored,
+            "frames_duplicated": self.frames_duplicated,
+            "frames_lost": self.frames_lost,
+            "frames_stale": self.frames_stale,
+            "batches_held": len(self.held),
+        }
+
+
+class CollectorStore:
+    """
+    Ingestion of the frames forwarded by many capture nodes into a central database.
+
+    Batches are put in order per (node, sensor) stream by sequence number,
+    within the epoch of the forwarder of the sensor: a batch of a new epoch
+    means the node restarted, and the stream starts again from it, while
+    late batches of the previous epochs are dropped. Frames stored already
+    are dropped as duplicates, and a batch arriving ahead of a missing one
+    is held until the missing one is resent, or until it is given up after
+    ``gap_timeout`` seconds and counted as lost. The frames of every sensor
+    of every node are stored under a central sensor identifier, from the
+    ``collector_streams`` table, and inserted with the sequence number of
+    their stream in large transactions of up to ``batch_frames`` frames, or
+    after ``max_delay`` seconds. Once a transaction is committed, the nodes
+    get the sequence number up to which each stream is stored, so
+    acknowledged frames are never lost.
+    """
+
+    def __init__(self, db, publish, batch_frames=20000, max_delay=0.2, gap_timeout=10.0, max_held=1000):
+        """
+        Initialize CollectorStore object.
+
+        Args:
+            db (DatabaseManager): The connected central database, with the ``rows`` storage format.
+            publish (callable): Coroutine function taking a subject and a payload, used to send the acknowledgements.
+            batch_frames (int, optional): Maximum number of frames per transaction. Defaults to 20000.
+            max_delay (float, optional): Maximum time in seconds a frame waits before being committed. Defaults to 0.2.
+            gap_timeout (float, optional): Time in seconds a batch is held for a missing one. Defaults to 10.0.
+            max_held (int, optional): Maximum number of batches held per stream. Defaults to 1000.
+
+        Raises:
+            ValueError: If the database does not store readings as rows.
+        """
+        if db.storage_format != "rows" or isinstance(db, database.FrameLogDatabase):
+            raise ValueError("The collector requires a SQLite database with the rows storage format")
+        database.check_batch_settings(batch_frames, max_delay)
+        self.db = db
+        self.publish = publish
+        self.batch_frames = batch_frames
+        self.max_delay = max_delay
+        self.gap_timeout = gap_timeout
+        self.max_held = max_held
+        self.conn = None
+        self.pending = collections.defaultdict(list)
+        self.pending_frames = 0
+        self.pending_since = None
+        self.dirty = set()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.batches_received = 0
+        self.batches_rejected = 0
+        self.transactions = 0
+
+        # Streams seen by a previous run resume after the frames they stored
+        db.execute(STREAMS_SCHEMA)
+        db.migrate_table("collector_streams", {"epoch": "INTEGER NOT NULL DEFAULT 0"})
+        self.streams = {}
+        for central_id, node, sensor_id, next_seq, epoch in db.conn.execute("SELECT central_id, node, sensor_id, next_seq, epoch FROM collector_streams"):
+            self.streams[(node, sensor_id)] = Stream(central_id, node, sensor_id, next_seq, epoch)
+        self.next_central_id = max((stream.central_id for stream in self.streams.values()), default=0) + 1
+
+    def receive(self, node, payload, reply):
+        """
+        Take a batch of frames forwarded by a capture node.
+
+        Args:
+            node (str): Name of the capture node.
+            payload (bytes): ``FORWARD_HEADER``, then the batch encoded with ``frame_stream.encode_frames()``.
+            reply (str): Subject to acknowledge the batch on, or empty.
+        """
+        epoch, first_unacked = FORWARD_HEADER.unpack_from(payload)
+        batch = decode_frames(memoryview(payload)[FORWARD_HEADER.size:])
+        sensor_id, seq, count = batch["sensor_id"], batch["seq"], len(batch["reading_time"])
+        self.batches_received += 1
+        if self.pending_frames >= 4 * self.batch_frames:
+            # The database fell behind: the node sends the batch again later
+            self.batches_rejected += 1
+            return
+        stream = self.streams.get((node, sensor_id))
+        if stream is None:
+            # A new stream starts at the oldest frame the node still has
+            stream = self.streams[(node, sensor_id)] = Stream(self.next_central_id, node, sensor_id, first_unacked, epoch)
+            self.next_central_id += 1
+            logger.info("New stream from sensor %s of node %s stored as sensor %s", sensor_id, node, stream.central_id)
+        elif epoch in stream.retired:
+            # A late batch of a previous run of the node, whose sequence numbers no longer apply
+            stream.frames_stale += count
+            return
+        elif epoch != stream.epoch:
+            # The node restarted: its sequence numbers start again
+            logger.info("Sensor %s of node %s restarted at frame %s", sensor_id, node, first_unacked)
+            stream.restart(epoch, first_unacked)
+        elif first_unacked > stream.next_seq:
+            # The node dropped frames it could not keep (and counted them): resume where it is
+            logger.info("Sensor %s of node %s resumed at frame %s", sensor_id, node, first_unacked)
+            stream.next_seq = first_unacked
+            self._release_held(stream)
+        if reply:
+            stream.replies.add(reply)
+        self.dirty.add(stream)
+
+        if seq + count <= stream.next_seq:
+            stream.frames_duplicated += count
+        elif seq > stream.next_seq:
+            # A batch before this one is missing: hold this one until it is resent
+            if seq not in stream.held:
+                stream.held[seq] = batch
+                if stream.held_since is None:
+                    stream.held_since = time.monotonic()
+            if len(stream.held) > self.max_held:
+                self._skip_gap(stream)
+        else:
+            self._accept(stream, batch)
+            self._release_held(stream)
+        self.wakeup.set()
+
+    def _accept(self, stream, batch):
+        """
+        Queue the frames of a batch not stored yet, the batch starting at or before the next expected frame.
+        """
+        offset = stream.next_seq - batch["seq"]
+        reading_times, frames = batch["reading_time"][offset:], frame_blobs(batch["data"][offset:])
+        if offset > 0:
+            stream.frames_duplicated += offset
+        if self.db.partitions is None:
+            query = database.INSERT_FRAME_QUERY
+            self.pending[query].extend(zip(
+                itertools.repeat(stream.central_id), reading_times.tolist(), itertools.repeat(None), frames, itertools.repeat(0)
+            ))
+        else:
+            for reading_time, frame in zip(reading_times.tolist(), frames):
+                query = self.db.partition_query(database.INSERT_FRAME_QUERY, reading_time)
+                self.pending[query].append((stream.central_id, reading_time, None, frame, 0))
+        stream.next_seq += len(reading_times)
+        stream.frames_stored += len(reading_times)
+        self.pending_frames += len(reading_times)
+        if self.pending_since is None:
+            self.pending_since = time.monotonic()
+
+    def _release_held(self, stream):
+        """
+        Queue the held batches of a stream that are next in order.
+        """
+        while stream.held:
+            seq = min(stream.held)
+            if seq > stream.next_seq:
+                break
+            batch = stream.held.pop(seq)
+            if seq + len(batch["reading_time"]) <= stream.next_seq:
+                stream.frames_duplicated += len(batch["reading_time"])
+            else:
+                self._accept(stream, batch)
+        stream.held_since = time.monotonic() if stream.held else None
+
+    def _skip_gap(self, stream):
+        """
+        Give up on the frames missing before the first held batch of a stream.
+        """
+        seq = min(stream.held)
+        logger.warning("Frames %s to %s of sensor %s of node %s were lost", stream.next_seq, seq - 1, stream.sensor_id, stream.node)
+        stream.frames_lost += seq - stream.next_seq
+        stream.next_seq = seq
+        self._release_held(stream)
+
+    def check_gaps(self):
+        """
+        Give up on the missing frames of the streams holding batches for longer than ``gap_timeout``.
+        """
+        now = time.monotonic()
+        for stream in self.streams.values():
+            if stream.held_since is not None and now - stream.held_since >= self.gap_timeout:
+                self._skip_gap(stream)
+                self.dirty.add(stream)
+
+    def is_due(self):
+        """
+        Check whether the queued frames should be committed.
+
+        Returns:
+            bool: True if a full transaction is queued, or if frames or acknowledgements waited ``max_delay``.
+        """
+        if self.pending_frames >= self.batch_frames:
+            return True
+        return self.pending_since is not None and time.monotonic() - self.pending_since >= self.max_delay
+
+    async def flush(self):
+        """
+        Commit the queued frames in one transaction, then acknowledge the streams they belong to.
+        """
+        pending, self.pending = self.pending, collections.defaultdict(list)
+        dirty, self.dirty = self.dirty, set()
+        frames, self.pending_frames, self.pending_since = self.pending_frames, 0, None
+        streams = [(stream, stream.epoch, stream.next_seq) for stream in dirty]
+        if frames or streams:
+            updates = [(stream.central_id, stream.node, stream.sensor_id, next_seq, epoch) for stream, epoch, next_seq in streams]
+            try:
+                await asyncio.to_thread(self._commit, pending, updates)
+            except sqlite3.Error as e:
+                # Queue the frames again ahead of the newer ones, the nodes are acknowledged once they are stored
+                logger.error("Error committing %d frames: %s", frames, e)
+                for query, rows in pending.items():
+                    self.pending[query][:0] = rows
+                self.pending_frames += frames
+                self.pending_since = time.monotonic()
+                self.dirty |= dirty
+                return
+            self.transactions += 1
+        for stream, epoch, next_seq in streams:
+            if epoch != stream.epoch:
+                # The node restarted meanwhile, the stream is acknowledged again in its new epoch
+                continue
+            stream.committed_seq = next_seq
+            replies, stream.replies = stream.replies, set()
+            ack = json.dumps({"sensor_id": stream.sensor_id, "epoch": epoch, "next_seq": next_seq}).encode()
+            for reply in replies:
+                try:
+                    await self.publish(reply, ack)
+                except Exception as e:
+                    logger.warning("Error acknowledging frames of node %s: %s", stream.node, e)
+
+    def _commit(self, pending, updates):
+        """
+        Insert queued frames and the stream positions in one transaction, on a worker thread.
+
+        Args:
+            pending (dict): Rows of ``INSERT_FRAME_QUERY`` grouped by statement, one per partition.
+            updates (list): Rows of ``UPSERT_STREAM_QUERY``.
+        """
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db.db_uri, check_same_thread=False)
+            database.configure_connection(self.conn)
+        if self.db.partitions is not None:
+            self.db.prepare_partitions(self.conn, pending.keys())
+        with self.conn:
+            for query, rows in pending.items():
+                self.conn.executemany(query, rows)
+            self.conn.executemany(UPSERT_STREAM_QUERY, updates)
+
+    async def run(self):
+        """
+        Commit the queued frames whenever a transaction is due, until ``stop()`` is called.
+
+        What is still queued when stopping is committed before returning.
+        """
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self.check_gaps()
+            if self.is_due() or (self.dirty and not self.pending_frames):
+                await self.flush()
+        await self.flush()
+
+    def stop(self):
+        """
+        Make ``run()`` commit what is queued and return.
+        """
+        self.stopping = True
+        self.wakeup.set()
+
+    def stats(self):
+        """
+        Get the collector counters.
+
+        Returns:
+            dict: Batches received and rejected while the database was behind, transactions, frames waiting
+            to be committed, and the state of every stream.
+        """
+        return {
+            "batches_received": self.batches_received,
+            "batches_rejected": self.batches_rejected,
+            "transactions": self.transactions,
+            "pending_frames": self.pending_frames,
+            "streams": [stream.stats() for stream in self.streams.values()],
+        }
+
+    def close(self):
+        """
+        Close the connection of the transactions.
+        """
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class CollectorClient(NATSClient):
+    """
+    NATS client of the collector process.
+
+    It receives the frames forwarded on ``collector.<node>.<sensor>.frames``,
+    answers ``collector.query`` on the central database, in the format of
+    ``sensors.query`` with the central sensor identifiers, and
+    ``collector.streams`` with the known streams and the counters.
+    """
+
+    def __init__(self, server, db, args, exit_event, store):
+        """
+        Initialize CollectorClient object.
+
+        Args:
+            server (str): The NATS server URL.
+            db (DatabaseManager): The central database.
+            args (argparse.Namespace): Parsed command-line arguments containing configurations.
+            exit_event (asyncio.Event): Event set to signal the collector to shut down.
+            store (CollectorStore): The ingestion of the forwarded frames.
+        """
+        super().__init__(server, db, args, exit_event)
+        self.store = store
+
+    async def frames_handler(self, msg):
+        """
+        Take the batch of frames of a ``collector.<node>.<sensor>.frames`` message.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        node = msg.subject.split(".")[1]
+        try:
+            self.store.receive(node, msg.data, msg.reply)
+        except (ValueError, struct.error) as e:
+            logger.warning("Invalid frames from node %s: %s", node, e)
+
+    async def streams_handler(self, msg):
+        """
+        Answer a request for the known streams and the collector counters.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        if msg.reply:
+            await self.nc.publish(msg.reply, json.dumps(self.store.stats()).encode())
+
+    async def message_handler(self, msg):
+        """
+        Handle the ``test.*`` subjects: the collector has no sensors, so only ``test.shutdown`` applies.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        if msg.subject == "test.shutdown":
+            logger.info("Shutting down...")
+            self.exit_event.set()
+
+
+async def run_collector(args, server="nats://localhost:4222"):
+    """
+    Store the frames forwarded by the capture nodes in the database of ``--db-uri``, until shut down.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments containing configurations.
+        server (str, optional): The NATS server URL. Defaults to the local server.
+    """
+    db = database.open_database(args.db_uri, **cli.database_options(args))
+    db.connect()
+    exit_event = asyncio.Event()
+    client = CollectorClient(server, db, args, exit_event, None)
+    try:
+        client.store = CollectorStore(db, client.publish, args.collector_batch_frames, args.collector_max_delay, args.collector_gap_timeout)
+        await client.connect()
+    except Exception as e:
+        logger.error(f"Error starting the collector: {e}")
+        db.close()
+        return
+
+    task = asyncio.create_task(client.store.run())
+    try:
+        await client.subscribe("test.*", cb=client.message_handler)
+        await client.subscribe(FORWARD_SUBJECT.format("*", "*"), cb=client.frames_handler)
+        await client.subscribe(COLLECTOR_QUERY_SUBJECT, cb=client.query_handler)
+        await client.subscribe(COLLECTOR_STREAMS_SUBJECT, cb=client.streams_handler)
+        logger.info("Collector ready")
+        await exit_event.wait()
+    finally:
+        # Store what was received, so the nodes do not need to send it again
+        client.store.stop()
+        await task
+        client.store.close()
+        await asyncio.wait_for(client.nc.close(), timeout=5)
+        db.close()
@@ -1,104 +1,407 @@
 import asyncio
 import time
-import struct #type: ignore
-import random #type: ignore
 import logging #type: ignore
+from scheduler import TickScheduler
+from frame_generator import MockupFrameGenerator
+from ring_buffer import FrameRingBuffer
+from rollup import RollupAggregator
+from logging_setup import LogSampler
+from metrics import SensorMetrics
+from frame_stream import FramePublisher, check_batching
+from anomaly import AnomalyDetector
+from deadband import DeadbandFilter
+from sensor_drivers import open_driver, FrameClock
 
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+# Default number of recent frames kept in memory per sensor
+DEFAULT_BUFFER_CAPACITY = 1024
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Time in seconds before reconnecting to a real sensor whose connection was lost
+RECONNECT_DELAY = 1.0
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+logger = logging.getLogger(__name__)
 
 class DataCapture:
-    def __init__(self, db, reading_frequency, sensor_type, min_value=None, max_value=None):
+    def __init__(self, db, reading_frequency, sensor_type, min_value=None, max_value=None, sensor_id=0, seed=None, buffer_capacity=DEFAULT_BUFFER_CAPACITY, rollup_intervals=(), publish=None, stream_batch_size=1, stream_linger=0.005, stream_max_payload=None, device=None, baudrate=None, ring_buffer=None, anomaly_threshold=None, anomaly_alpha=0.05, anomaly_hot_value=None, anomaly_cooldown=1.0, publish_alerts=None, deadband=None, heartbeat=60.0, forward=None):
         """
         Initialize DataCapture object.
 
         Args:
             db (DatabaseManager): The object to handle database operations.
-            reading_frequency (int): The frequency in seconds to capture sensor data.
+            reading_frequency (float): The period in seconds between two sensor readings.
             sensor_type (str): Type of sensor to use, either 'mockup' or 'real'.
             min_value (int, optional): Minimum value of generated data if sensor_type is 'mockup'. Defaults to None.
             max_value (int, optional): Maximum value of generated data if sensor_type is 'mockup'. Defaults to None.
+            sensor_id (int, optional): Identifier of the sensor, stored with every reading. Defaults to 0.
+            seed (int, optional): Seed of the mockup data generator, combined with sensor_id so that every sensor gets its own reproducible stream. Defaults to None.
+            buffer_capacity (int, optional): Number of recent frames kept in memory. Defaults to 1024.
+            rollup_intervals (iterable of int, optional): Sizes in seconds of the time buckets summarized into the rollup table. Defaults to none.
+            publish (callable, optional): Coroutine function taking a subject and a payload, used to publish every frame
+                live on ``sensors.<id>.frames``. Defaults to None (frames are only stored).
+            stream_batch_size (int, optional): Maximum number of frames per live message. Defaults to 1.
+            stream_linger (float, optional): Maximum time in seconds a frame waits for its live message to fill. Defaults to 0.005.
+            stream_max_payload (int, optional): Largest payload in bytes accepted by the broker, which live messages
+                must fit in. Defaults to None (not checked).
+            device (str, optional): Device of a real sensor, see ``sensor_drivers.open_driver()``. Defaults to None.
+            baudrate (int, optional): Speed of the serial port of a real sensor. Defaults to None (unchanged).
+            ring_buffer (FrameRingBuffer, optional): Buffer of the recent frames, such as a ``SharedFrameRingBuffer``
+                read by another process. Defaults to a new one of ``buffer_capacity`` frames.
+            anomaly_threshold (float, optional): Per-pixel z-score above which a frame raises an alert. Defaults to None (disabled).
+            anomaly_alpha (float, optional): Weight of every new frame in the moving per-pixel statistics. Defaults to 0.05.
+            anomaly_hot_value (int, optional): Pixel value at or above which a frame raises an alert. Defaults to None (disabled).
+            anomaly_cooldown (float, optional): Minimum time in seconds between two published alerts. Defaults to 1.0.
+            publish_alerts (callable, optional): Coroutine function taking a subject and a payload, used to publish
+                alerts on ``sensors.<id>.alerts``. Defaults to None (alerts are only counted).
+            deadband (int, optional): Largest change of a pixel since the last stored reading for which a reading
+                is not stored, only counted. Defaults to None (every reading is stored).
+            heartbeat (float, optional): Maximum time in seconds between two stored readings with a deadband. Defaults to 60.0.
+            forward (collector.CollectorLink, optional): Link of the capture node to a collector, every frame is
+                forwarded to until it is acknowledged. Defaults to None (frames are only stored locally).
+
+        Raises:
+            ValueError: If a deadband is given but the database does not record skipped readings.
         """
         self.db = db
+        self.sensor_id = sensor_id
         self.reading_frequency = reading_frequency
         self.sensor_type = sensor_type
         self.min_value = min_value
         self.max_value = max_value
+        self.seed = seed
+        self.generator = None
+        self.ring_buffer = ring_buffer if ring_buffer is not None else FrameRingBuffer(buffer_capacity)
+        self.rollups = [RollupAggregator(sensor_id, interval) for interval in rollup_intervals]
+        self.publisher = FramePublisher(publish, sensor_id, stream_batch_size, stream_linger, stream_max_payload) if publish is not None else None
+        self.forwarder = forward.forwarder(sensor_id) if forward is not None else None
+        self.detector = None
+        if anomaly_threshold is not None or anomaly_hot_value is not None:
+            self.detector = AnomalyDetector(publish_alerts, sensor_id, anomaly_threshold, anomaly_alpha, anomaly_hot_value, anomaly_cooldown)
+        self.deadband = None
+        if deadband is not None:
+            if not db.stores_runs():
+                raise ValueError("A deadband requires the rows storage format")
+            self.deadband = DeadbandFilter(deadband, heartbeat)
+        self.device = device
+        self.baudrate = baudrate
+        self.driver = None
         self.capture_task = None
+        self.capture_running = False
+        self.scheduler = None
+        self.metrics = SensorMetrics()
+        self.pending_config = {}
         logger.debug("DataCapture object initialized")
     
+    def get_generator(self):
+        """
+        Get the mockup data generator, creating it on first use.
+
+        Returns:
+            MockupFrameGenerator: The generator of this sensor.
+
+        Raises:
+            ValueError: If the min and max values are not a valid range.
+        """
+        if self.generator is None:
+            seed = None if self.seed is None else [self.seed, self.sensor_id]
+            self.generator = MockupFrameGenerator(self.min_value, self.max_value, seed)
+        return self.generator
+
+    def read_frame(self):
+        """
+        Read a frame from a polled sensor.
+
+        Returns:
+            numpy.ndarray: Contiguous ``uint16`` array of 64 values, or None if the sensor is not polled.
+        """
+        if self.sensor_type == 'mockup':
+            return self.get_generator().frame()
+        else:
+            logger.warning("Only mockup sensors are polled, real sensors push their frames through their driver")
+            return None
+
     def read_data(self):
         """
         Generate mockup sensor data.
         Returns a list of 64 random integers between specified min and max values.
         """
+        frame = self.read_frame()
+        if frame is not None:
+            return frame.tolist()
+
+
+    def config(self):
+        """
+        Get the settings that can be changed with ``configure()``.
+
+        Returns:
+            dict: The reading frequency, the value range and the live streaming batching (None when not streaming).
+        """
+        return {
+            "reading_frequency": self.reading_frequency,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "stream_batch_size": self.publisher.batch_size if self.publisher else None,
+            "stream_linger": self.publisher.linger if self.publisher else None,
+        }
+
+    async def configure(self, **settings):
+        """
+        Change settings of the sensor without restarting the capture.
+
+        The settings are checked at once, but a running capture loop only
+        applies them at the start of its next tick, between two frames, so the
+        frame being processed is not affected and frames keep their order.
+
+        Args:
+            **settings: New values of any of the ``config()`` settings.
+
+        Returns:
+            dict: The settings in effect from the next tick on.
+
+        Raises:
+            ValueError: If a setting is unknown or invalid.
+        """
+        unknown = set(settings) - set(self.config())
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        config = {**self.config(), **self.pending_config, **settings}
+        if config["reading_frequency"] <= 0:
+            raise ValueError("reading_frequency must be greater than 0")
         if self.sensor_type == 'mockup':
-            logger.debug("Generating mockup sensor data")
-            return [random.randint(self.min_value, self.max_value) for _ in range(64)]
-        else:
-            logger.warning("Non-mockup sensors not yet supported")
-            pass
+            MockupFrameGenerator(config["min_value"], config["max_value"])
+        if "stream_batch_size" in settings or "stream_linger" in settings:
+            if self.publisher is None:
+                raise ValueError("Live streaming is not enabled")
+            check_batching(config["stream_batch_size"], config["stream_linger"], self.publisher.max_payload)
+
+        self.pending_config.update(settings)
+        if not self.is_running():
+            await self.apply_config()
+        return config
 
+    async def apply_config(self):
+        """
+        Apply the settings staged by ``configure()``.
+        """
+        settings, self.pending_config = self.pending_config, {}
+        if "reading_frequency" in settings:
+            # The ticks of a deadband run must be evenly spaced
+            await self.break_deadband_run()
+            self.reading_frequency = settings["reading_frequency"]
+            if self.scheduler:
+                self.scheduler.set_period(self.reading_frequency)
+        if "min_value" in settings or "max_value" in settings:
+            self.min_value = settings.get("min_value", self.min_value)
+            self.max_value = settings.get("max_value", self.max_value)
+            if self.generator is not None:
+                self.generator.set_range(self.min_value, self.max_value)
+        if "stream_batch_size" in settings or "stream_linger" in settings:
+            await self.publisher.reconfigure(
+                settings.get("stream_batch_size", self.publisher.batch_size),
+                settings.get("stream_linger", self.publisher.linger)
+            )
+        logger.info("Sensor %s reconfigured: %s", self.sensor_id, settings)
 
     async def capture_loop(self):
         """
         Asynchronous loop to continuously capture sensor data at specified intervals
         and store the captured data in the SQLite database.
+
+        Readings are paced by a deadline-based scheduler, so the processing time of
+        each reading does not add up into drift. The scheduled time of every reading
+        is stored next to the actual reading time.
+
+        Real sensors are not polled: they push frames at their own rate, which
+        ``device_loop()`` stores instead.
         """
-        global capture_running
-        capture_running = True
-        
+        if self.sensor_type == 'real':
+            return await self.device_loop()
+        self.capture_running = True
+        self.scheduler = TickScheduler(self.reading_frequency)
+        self.scheduler.start()
+        # Per-frame debug messages are sampled, and skipped entirely unless DEBUG is enabled
+        log_sampler = LogSampler()
+        metrics = self.metrics
+        clock = time.perf_counter
+        missed_ticks = 0
+
         # Loop until capture_running is set to False
-        while capture_running:
-            # Read data from the sensor (mockup or real)
-            data = self.read_data()
-            logger.debug("Read data from sensor")
-            
-            # Pack the data as a binary BLOB for storage
-            packed_data = struct.pack('64H', *data)
-            logger.debug("Packed data as binary BLOB")
-            
-            # Insert the packed data along with the current timestamp into the database
-            self.db.execute(
-                "INSERT INTO infrared_data (reading_time, data) VALUES (?, ?)",
-                (time.time(), packed_data)
-            )
-            logger.debug("Inserted data into database")
-            
-            # Wait for the specified reading frequency before capturing the next data
-            await asyncio.sleep(self.reading_frequency)
-            logger.debug("Waiting for next reading")
+        while self.capture_running:
+            # Wait for the next tick of the schedule
+            tick, scheduled_time = await self.scheduler.wait_next()
+            if self.pending_config:
+                # Settings changed by configure() take effect from this tick on
+                await self.apply_config()
+            metrics.record("jitter", self.scheduler.last_lateness)
+            if self.scheduler.missed_ticks != missed_ticks:
+                # Ticks skipped by the scheduler are frames that were never captured
+                metrics.frames_dropped += self.scheduler.missed_ticks - missed_ticks
+                missed_ticks = self.scheduler.missed_ticks
+                await self.break_deadband_run()
+
+            # Read data from the sensor
+            started = clock()
+            frame = self.read_frame()
+            read = clock()
+            metrics.record("read", read - started)
+            if frame is None:
+                metrics.frames_dropped += 1
+                continue
+
+            reading_time = time.time()
+            await self.store_frame(reading_time, frame, scheduled_time, read)
+
+            if logger.isEnabledFor(logging.DEBUG) and log_sampler.due():
+                logger.debug("Sensor %s tick %d (scheduled at %f) read and queued for storage", self.sensor_id, tick, scheduled_time)
+
+    async def device_loop(self):
+        """
+        Asynchronous loop storing the frames a real sensor pushes at its own rate.
+
+        Frames are read through the driver of the sensor as they arrive, a
+        burst at a time, and stored like the frames of polled sensors, without
+        a scheduled time. Every frame gets its own reading time, derived from
+        its sequence number and the reading frequency by a ``FrameClock``.
+        Frames lost on the way, seen as gaps in the sequence numbers, are
+        counted as dropped, and close the deadband run. When the connection to
+        the sensor is lost it is reopened after ``RECONNECT_DELAY`` seconds.
+        """
+        self.capture_running = True
+        driver = self.driver = open_driver(self.device, self.baudrate)
+        frame_clock = FrameClock()
+        log_sampler = LogSampler()
+        clock = time.perf_counter
+        next_index = None
+        try:
+            while self.capture_running:
+                try:
+                    if driver.reader is None:
+                        await driver.open()
+                        logger.info("Sensor %s connected to %s", self.sensor_id, self.device)
+                        # The frames missed while disconnected are unknown, so the next ones start afresh
+                        frame_clock.reset()
+                        next_index = None
+                    frames_lost = driver.parser.frames_lost
+                    frames = await driver.read_frames()
+                    arrival = time.time()
+                except (OSError, EOFError) as e:
+                    logger.warning("Sensor %s lost %s (%s), reconnecting in %ss", self.sensor_id, self.device, e, RECONNECT_DELAY)
+                    driver.close()
+                    await asyncio.sleep(RECONNECT_DELAY)
+                    continue
+                if self.pending_config:
+                    await self.apply_config()
+                self.metrics.frames_dropped += driver.parser.frames_lost - frames_lost
+
+                # The frames of a burst are spaced by the reading frequency, back from its arrival
+                indexes = driver.parser.indexes
+                reading_times = frame_clock.times(indexes, arrival, self.reading_frequency)
+                for index, reading_time, frame in zip(indexes.tolist(), reading_times.tolist(), frames):
+                    if index != next_index:
+                        # A deadband run must not span lost frames
+                        await self.break_deadband_run()
+                    next_index = index + 1
+                    await self.store_frame(reading_time, frame, None, clock())
+
+                if logger.isEnabledFor(logging.DEBUG) and log_sampler.due():
+                    logger.debug("Sensor %s received %d frame(s) and queued them for storage", self.sensor_id, len(frames))
+        finally:
+            driver.close()
+
+    async def store_frame(self, reading_time, frame, scheduled_time, read):
+        """
+        Keep, publish and store one frame.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray): Contiguous ``uint16`` array of 64 values.
+            scheduled_time (float): Time the reading was scheduled for as a Unix timestamp, or None.
+            read (float): ``time.perf_counter()`` value when the frame was read, start of the ``pack`` stage.
+        """
+        metrics = self.metrics
+        clock = time.perf_counter
+
+        # Keep the frame in memory for live readers
+        self.ring_buffer.append(reading_time, frame)
+
+        # The uint16 array already has the '64H' layout, so its buffer is stored as is
+        packed_data = memoryview(frame)
+        packed = clock()
+        metrics.record("pack", packed - read)
+
+        # Send the frame to live consumers and to the collector before storing it
+        if self.publisher is not None:
+            await self.publisher.add(reading_time, frame)
+        if self.forwarder is not None:
+            await self.forwarder.add(reading_time, frame)
+        if self.publisher is not None or self.forwarder is not None:
+            published = clock()
+            metrics.record("publish", published - packed)
+            packed = published
+
+        # Hold back while the storage queue is full, if it is configured to apply backpressure
+        if self.db.needs_backpressure():
+            await self.db.wait_for_space()
+
+        # Only store the readings that changed, counting the skipped ones in the next stored reading
+        skipped = self.deadband.check(reading_time, frame, scheduled_time) if self.deadband is not None else 0
+        if skipped is not None:
+            # Queue the packed data along with the actual and scheduled timestamps for storage
+            if self.db.insert_frame(reading_time, packed_data, scheduled_time, self.sensor_id, skipped):
+                metrics.bytes_written += packed_data.nbytes
+            else:
+                metrics.frames_dropped += 1
+
+        # Update the running summaries, storing the buckets this frame closes
+        for rollup in self.rollups:
+            closed = rollup.add(reading_time, frame)
+            if closed is not None:
+                if self.db.needs_backpressure():
+                    await self.db.wait_for_space()
+                self.db.insert_rollup(closed)
+
+        # Check the frame against the moving statistics of its pixels, alerting at once
+        if self.detector is not None:
+            await self.detector.add(reading_time, frame)
+        metrics.record("enqueue", clock() - packed)
+        metrics.frames_captured += 1
 
 
     async def start_capture(self):
         """
         Start the data capture process by creating an asynchronous capture loop task.
         """
+        if self.is_running():
+            logger.info("Data capture already running for sensor %s", self.sensor_id)
+            return
+        if self.sensor_type == 'mockup':
+            # Validate the value range before the loop starts rather than on the first tick
+            self.get_generator()
+        elif self.sensor_type == 'real' and not self.device:
+            raise ValueError(f"Real sensor {self.sensor_id} has no device")
+        if self.deadband is not None:
+            # The readings skipped before the restart were stored by stop_capture(): the first new reading starts a new run
+            self.deadband.reset()
         logger.info("Starting data capture")
         logger.info(f"Sensor type: {self.sensor_type}")
         self.capture_task = asyncio.create_task(self.capture_loop())
 
 
+    def is_running(self):
+        """
+        Check whether the capture loop task is running.
+
+        Returns:
+            bool: True if the capture loop task exists and has not finished.
+        """
+        return self.capture_task is not None and not self.capture_task.done()
+
+
     async def stop_capture(self):
         """
         Stop the data capture process by canceling the capture loop task.
 
-        This function sets the ``capture_running`` flag to ``False`` and
-        cancels the capture loop task. If the capture loop task is already
+        This function cancels the capture loop task and sets the
+        ``capture_running`` flag to ``False``. If the capture loop task is already
         running, it will be cancelled and the task will be set to ``None``.
         """
         logger.info("Stopping data capture")
@@ -115,4 +418,50 @@ class DataCapture:
         # Set the capture task to None
         self.capture_task = None
         # Set the capture_running flag to False
-        capture_running = False
\ No newline at end of file
+        self.capture_running = False
+        self.flush_rollups()
+        self.flush_deadband()
+        self.db.flush_chunks(self.sensor_id)
+        if self.publisher is not None:
+            await self.publisher.flush()
+        if self.forwarder is not None:
+            await self.forwarder.flush()
+        if self.scheduler:
+            logger.info("Capture schedule stats: %s", self.scheduler.stats())
+
+
+    def flush_rollups(self):
+        """
+        Store the rollup buckets still open, so that stopping the capture does not lose them.
+        """
+        for rollup in self.rollups:
+            row = rollup.flush()
+            if row is not None:
+                self.db.insert_rollup(row)
+
+    async def break_deadband_run(self):
+        """
+        Close the current deadband run at a gap in the schedule, so that the next reading is stored and starts a new run.
+
+        Skipped readings are placed back at evenly spaced ticks, so a run must not span missed ticks or a change of period.
+        """
+        if self.deadband is None:
+            return
+        if self.db.needs_backpressure():
+            await self.db.wait_for_space()
+        self.flush_deadband()
+        self.deadband.reset()
+
+    def flush_deadband(self):
+        """
+        Store the last reading skipped by the deadband, so that stopping the capture does not lose where its run ended.
+        """
+        if self.deadband is None:
+            return
+        pending = self.deadband.flush()
+        if pending is not None:
+            reading_time, frame, skipped, scheduled_time = pending
+            if self.db.insert_frame(reading_time, memoryview(frame), scheduled_time, self.sensor_id, skipped):
+                self.metrics.bytes_written += frame.nbytes
+            else:
+                self.metrics.frames_dropped += 1
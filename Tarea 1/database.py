@@ -1,37 +1,713 @@
-from logging.handlers import RotatingFileHandler
 import sqlite3
+import asyncio
+import collections
+import inspect
 import logging
+import marshal
+import os
+import struct
+import threading
+import time
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+from rollup import merge_rollup_rows
+from frame_codec import ChunkBuilder, decode_chunk
+from metrics import LatencyHistogram
+from framelog import FrameLog
+from partitions import PartitionScheme, SCHEMA_PREFIX
+from deadband import expand_runs
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.DEBUG)
+# Query used to store a single sensor reading
+INSERT_FRAME_QUERY = "INSERT INTO infrared_data (sensor_id, reading_time, scheduled_time, data, skipped) VALUES (?, ?, ?, ?, ?)"
 
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
+# Columns added after the first release, created on existing databases when connecting
+INFRARED_DATA_MIGRATIONS = {
+    "scheduled_time": "REAL",
+    "sensor_id": "INTEGER NOT NULL DEFAULT 0",
+    "skipped": "INTEGER NOT NULL DEFAULT 0",
+}
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Tables of the readings and their indexes, created in the main database and in every partition.
+# The first statement creates infrared_data, whose missing columns are added before indexing them.
+FRAME_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.infrared_data (
+        id INTEGER PRIMARY KEY,
+        sensor_id INTEGER NOT NULL DEFAULT 0,
+        reading_time REAL,
+        scheduled_time REAL,
+        data BLOB,
+        skipped INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Index used by time-range queries on a single sensor
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_infrared_data_sensor_time ON infrared_data (sensor_id, reading_time)",
+    # Compressed chunks of consecutive readings
+    """
+    CREATE TABLE IF NOT EXISTS {schema}.infrared_chunks (
+        id INTEGER PRIMARY KEY,
+        sensor_id INTEGER NOT NULL,
+        start_time REAL NOT NULL,
+        end_time REAL NOT NULL,
+        frame_count INTEGER NOT NULL,
+        codec TEXT NOT NULL,
+        data BLOB
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_infrared_chunks_sensor_end ON infrared_chunks (sensor_id, end_time)",
+)
+
+# Query used to page through the readings of a sensor, resuming after the last (reading_time, id) seen
+SELECT_FRAMES_QUERY = """
+    SELECT id, reading_time, data FROM infrared_data
+    WHERE sensor_id = ? AND reading_time < ? AND (reading_time, id) > (?, ?)
+    ORDER BY reading_time, id
+    LIMIT ?
+"""
+
+# Query used to page through the readings of a sensor with the number of readings skipped before each of them
+SELECT_RUNS_QUERY = """
+    SELECT id, reading_time, data, skipped, scheduled_time FROM infrared_data
+    WHERE sensor_id = ? AND reading_time < ? AND (reading_time, id) > (?, ?)
+    ORDER BY reading_time, id
+    LIMIT ?
+"""
+
+# Query used to find the last reading of a sensor stored before a time
+SELECT_PREVIOUS_FRAME_QUERY = """
+    SELECT reading_time, data, scheduled_time FROM infrared_data
+    WHERE sensor_id = ? AND reading_time < ?
+    ORDER BY reading_time DESC, id DESC
+    LIMIT 1
+"""
+
+# Query used to find the first reading of a sensor stored at or after a time
+SELECT_NEXT_FRAME_QUERY = """
+    SELECT reading_time, data, skipped, scheduled_time FROM infrared_data
+    WHERE sensor_id = ? AND reading_time >= ?
+    ORDER BY reading_time, id
+    LIMIT 1
+"""
+
+# Query used to store a chunk of consecutive frames of a sensor
+INSERT_CHUNK_QUERY = """
+    INSERT INTO infrared_chunks (sensor_id, start_time, end_time, frame_count, codec, data)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# Query used to page through the chunks of a sensor ending at or after a time, resuming after the last (end_time, id) seen
+SELECT_CHUNKS_QUERY = """
+    SELECT id, start_time, end_time, frame_count, codec, data FROM infrared_chunks
+    WHERE sensor_id = ? AND (end_time, id) > (?, ?)
+    ORDER BY end_time, id
+    LIMIT ?
+"""
+
+# Storage formats of the readings: one row per frame, or compressed chunks of consecutive frames
+STORAGE_FORMATS = ("rows", "chunked")
+
+# Query used to store a closed rollup bucket
+INSERT_ROLLUP_QUERY = """
+    INSERT INTO infrared_rollup (sensor_id, bucket_seconds, bucket_start, count, min, max, sum, sum_squares)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Query used to page through the rollup rows of a sensor ending before a time, resuming after the last (bucket_start, rowid) seen
+SELECT_ROLLUPS_QUERY = """
+    SELECT rowid, bucket_start, count, min, max, sum, sum_squares FROM infrared_rollup
+    WHERE sensor_id = ? AND bucket_seconds = ? AND (bucket_start, rowid) > (?, ?) AND bucket_start < ?
+    ORDER BY bucket_start, rowid
+    LIMIT ?
+"""
+
+# Scheme of the database URIs of the memory-mapped frame log backend
+FRAMELOG_SCHEME = "framelog://"
+
+# Name of the SQLite database holding everything but the readings in a frame log directory
+FRAMELOG_SQLITE_NAME = "index.db"
+
+# Policies of the writer queue when it is full: wait for room, drop the oldest or the newest row, or spill to a file
+OVERFLOW_POLICIES = ("block", "drop-oldest", "drop-newest", "spill")
+
+# Number of times a batch is retried while the database is locked, before it is requeued
+WRITE_RETRIES = 5
+
+# Time in seconds before the first retry of a batch on a locked database, doubled on every retry
+WRITE_RETRY_DELAY = 0.05
+
+# Length prefix of every record of a spill file
+SPILL_RECORD = struct.Struct('<I')
+
+# Sentinel pushed into the writer queue to ask the writer thread to exit
+_STOP = object()
+
+
+def configure_connection(conn):
+    """
+    Apply the connection settings shared by every SQLite connection.
+
+    WAL mode lets readers run while the writer thread commits, and
+    ``synchronous=NORMAL`` only syncs on checkpoints, which is safe in WAL mode.
+
+    Args:
+        conn (sqlite3.Connection): The connection to configure.
+    """
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+def check_batch_settings(batch_size=None, max_delay=None):
+    """
+    Check the batching settings of a ``BatchWriter``.
+
+    Args:
+        batch_size (int, optional): Maximum number of rows per transaction. Defaults to None (not checked).
+        max_delay (float, optional): Maximum time in seconds a row waits before being committed. Defaults to None (not checked).
+
+    Raises:
+        ValueError: If the batch size is below 1 or the delay is not positive.
+    """
+    if batch_size is not None and batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if max_delay is not None and max_delay <= 0:
+        raise ValueError("max_delay must be greater than 0")
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
 
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
+def check_writer_options(batch_size=500, max_delay=0.5, max_pending=None, overflow="block", spill_path=None):
+    """
+    Check the settings of a ``BatchWriter``, as given to ``DatabaseManager.start_writer()``.
+
+    Args:
+        batch_size (int, optional): Maximum number of rows per transaction. Defaults to 500.
+        max_delay (float, optional): Maximum time in seconds a row waits before being committed. Defaults to 0.5.
+        max_pending (int, optional): Maximum number of rows waiting in the queue. Defaults to None (unbounded).
+        overflow (str, optional): What to do with new rows when the queue is full. Defaults to ``block``.
+        spill_path (str, optional): Path of the spill file of the ``spill`` policy, not checked. Defaults to None.
+
+    Raises:
+        ValueError: If a setting is out of range.
+    """
+    check_batch_settings(batch_size, max_delay)
+    if max_pending is not None and max_pending < 1:
+        raise ValueError("max_pending must be at least 1")
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"Unknown overflow policy {overflow!r}")
+
+
+def is_busy_error(error):
+    """
+    Check whether a SQLite error is transient lock contention, such as a checkpoint holding the database.
+
+    Args:
+        error (sqlite3.Error): The error raised by SQLite.
+
+    Returns:
+        bool: True if the database or one of its tables was locked.
+    """
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+class SpillFile:
+    """
+    Append-only overflow file of rows waiting to be written.
+
+    Every record holds the SQL statement and the parameters of one row,
+    serialized with ``marshal`` behind a length prefix. Records are appended
+    from the event loop and read back, oldest first, by the writer thread. The
+    file is truncated once every record has been read. Records left over by a
+    previous run, whose writer could not write them before exiting, are read
+    back as well.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize SpillFile object.
+
+        Args:
+            path (str): Path of the spill file, created if needed.
+        """
+        self.path = path
+        self.file = open(path, "a+b")
+        self.lock = threading.Lock()
+        self.read_offset = 0
+        self.pending = 0
+        # Count the records left over by a previous run
+        self.file.seek(0)
+        while True:
+            header = self.file.read(SPILL_RECORD.size)
+            if len(header) < SPILL_RECORD.size:
+                break
+            size, = SPILL_RECORD.unpack(header)
+            if len(self.file.read(size)) < size:
+                break
+            self.pending += 1
+        if self.pending:
+            logger.info("Found %d spilled rows to replay in %s", self.pending, path)
+
+    def append(self, query, params):
+        """
+        Append a row to the file.
+
+        Args:
+            query (str): SQL statement of the row.
+            params (tuple): Parameters of the statement.
+        """
+        record = marshal.dumps((query, params))
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            self.file.write(SPILL_RECORD.pack(len(record)) + record)
+            self.file.flush()
+            self.pending += 1
+
+    def read(self, max_rows):
+        """
+        Read the oldest rows not read yet.
+
+        Args:
+            max_rows (int): Maximum number of rows returned.
+
+        Returns:
+            list: ``(query, params)`` tuples.
+        """
+        rows = []
+        with self.lock:
+            self.file.seek(self.read_offset)
+            while len(rows) < max_rows and self.pending:
+                size, = SPILL_RECORD.unpack(self.file.read(SPILL_RECORD.size))
+                rows.append(marshal.loads(self.file.read(size)))
+                self.pending -= 1
+            self.read_offset = self.file.tell()
+            if not self.pending:
+                # Every record was read: start over with an empty file
+                self.file.truncate(0)
+                self.read_offset = 0
+        return rows
+
+    def close(self):
+        """
+        Close the file, removing it if no rows are left to replay.
+        """
+        self.file.close()
+        if not self.pending:
+            os.remove(self.path)
+
+
+class BatchWriter:
+    """
+    Background writer that group-commits queued rows into the database.
+
+    Rows are handed over from the event loop with ``submit()``, which never
+    blocks. A dedicated thread owning its own SQLite connection drains the
+    queue and writes each batch with ``executemany`` inside a single
+    transaction. A batch is flushed when it reaches ``batch_size`` rows or when
+    its oldest row has waited ``max_delay`` seconds, whichever comes first.
+
+    A batch that fails because the database is locked (a checkpoint, another
+    writer) is retried ``WRITE_RETRIES`` times with a growing delay. If it still
+    fails, its rows go back to the head of the queue, or to the spill file with
+    the ``spill`` policy, to be written once the lock is released. Rows of a
+    batch that fails for any other reason are dropped.
+
+    The queue can be bounded to ``max_pending`` rows, so that a stalled
+    database costs bounded memory. When it is full, the ``overflow`` policy
+    decides what happens to a new row:
+        - ``block``: the row is queued anyway, and ``is_full()`` tells producers
+          that can wait, such as the capture loop, to hold back until
+          ``wait_for_space()`` returns. The capture loop waits before every row
+          it submits, so the queue only goes past ``max_pending`` by the rows
+          stored when a capture stops (its open rollup buckets, chunk and
+          deadband run), which cannot wait, and by batches put back after a
+          lock.
+        - ``drop-oldest``: the oldest queued row is discarded to make room.
+        - ``drop-newest``: the new row is discarded.
+        - ``spill``: the row is appended to a ``SpillFile``, which is replayed
+          into the database once the queue has been drained. Rows queued
+          while the spill file was being written, which are newer, may be
+          committed before the spilled ones: rows are not inserted in time
+          order, but queries read them by ``reading_time``.
+    """
+
+    def __init__(self, db_uri, batch_size=500, max_delay=0.5, max_pending=None, overflow="block", spill_path=None, prepare=None):
+        """
+        Initialize BatchWriter object.
+
+        Args:
+            db_uri (str): URI of the SQL database.
+            batch_size (int, optional): Maximum number of rows per transaction. Defaults to 500.
+            max_delay (float, optional): Maximum time in seconds a row waits before being committed. Defaults to 0.5.
+            max_pending (int, optional): Maximum number of rows waiting in the queue. Defaults to None (unbounded).
+            overflow (str, optional): What to do with new rows when the queue is full, one of ``OVERFLOW_POLICIES``. Defaults to ``block``.
+            spill_path (str, optional): Path of the spill file of the ``spill`` policy. Defaults to the database path followed by ``.spill``.
+            prepare (callable, optional): Called on the writer thread with the connection and the SQL statements
+                of every batch before writing it, outside of any transaction. Defaults to None.
+        """
+        check_writer_options(batch_size, max_delay, max_pending, overflow)
+        self.db_uri = db_uri
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.prepare = prepare
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        # Futures of the producers waiting for room, resolved on their loop as the writer thread drains the queue
+        self.waiters = collections.deque()
+        self.loop = None
+        self.stopping = False
+        self.thread = None
+        self.spill = None
+        if overflow == "spill":
+            self.spill = SpillFile(spill_path or db_uri + ".spill")
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+        self.rows_dropped = 0
+        self.rows_spilled = 0
+        self.rows_replayed = 0
+        self.high_water_mark = 0
+        self.commit_latency = LatencyHistogram()
+
+    def start(self):
+        """
+        Start the writer thread.
+        """
+        if self.thread is not None:
+            return
+        logger.info("Starting database writer (batch size %d, max delay %.3fs)", self.batch_size, self.max_delay)
+        self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self.thread.start()
+
+    def configure(self, batch_size=None, max_delay=None):
+        """
+        Change the batching settings of the running writer, from its next batch on.
+
+        Args:
+            batch_size (int, optional): Maximum number of rows per transaction. Defaults to None (unchanged).
+            max_delay (float, optional): Maximum time in seconds a row waits before being committed. Defaults to None (unchanged).
+        """
+        check_batch_settings(batch_size, max_delay)
+        # Plain attribute writes, read by the writer thread every time it takes a row
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if max_delay is not None:
+            self.max_delay = max_delay
+        logger.info("Database writer reconfigured (batch size %d, max delay %.3fs)", self.batch_size, self.max_delay)
+
+    def submit(self, query, params):
+        """
+        Queue a row to be written by the writer thread.
+
+        This call never blocks, so it is safe to use from the event loop.
+
+        Args:
+            query (str): SQL statement to execute for the row.
+            params (tuple or callable): Parameters of the statement, or a function returning them, called on the writer thread.
+
+        Returns:
+            bool: False if the row was dropped because the queue is full, True otherwise.
+        """
+        with self.condition:
+            if self.max_pending is not None and len(self.queue) >= self.max_pending and self.overflow != "block":
+                if self.overflow == "drop-newest":
+                    self.rows_dropped += 1
+                    return False
+                if self.overflow == "drop-oldest":
+                    self.queue.popleft()
+                    self.rows_dropped += 1
+                else:
+                    try:
+                        # Rows built on the writer thread are built now, as the spill file only holds plain values
+                        self.spill.append(query, params() if callable(params) else params)
+                    except Exception as e:
+                        self.rows_failed += 1
+                        logger.error("Error spilling row: %s", e)
+                        return False
+                    self.rows_spilled += 1
+                    return True
+            self.queue.append((query, params))
+            if len(self.queue) > self.high_water_mark:
+                self.high_water_mark = len(self.queue)
+            self.condition.notify()
+        return True
+
+    def is_full(self):
+        """
+        Check whether producers should hold back new rows.
+
+        Returns:
+            bool: True if the queue is full and the overflow policy is ``block``.
+        """
+        return self.overflow == "block" and self.max_pending is not None and len(self.queue) >= self.max_pending
+
+    async def wait_for_space(self):
+        """
+        Wait, without blocking the event loop, until the queue has room again.
+
+        The waiting producers are woken one at a time, in order, by the writer
+        thread as it takes rows off the queue, so no producer polls the queue.
+        """
+        while True:
+            with self.condition:
+                if not self.is_full():
+                    return
+                self.loop = asyncio.get_running_loop()
+                waiter = self.loop.create_future()
+                self.waiters.append(waiter)
+            await waiter
+
+    def _wake_waiter(self):
+        """
+        Wake the oldest producer still waiting for room, on its event loop.
+        """
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _get(self, timeout):
+        """
+        Take the next row off the queue, on the writer thread.
+
+        When the queue is empty, rows waiting in the spill file are moved back
+        into the queue first, so spilled rows are written after the rows queued
+        before the queue emptied, even when those are newer.
+
+        Args:
+            timeout (float): Maximum time in seconds to wait for a row, or None to wait forever.
+
+        Returns:
+            tuple: The ``(query, params)`` row or ``_STOP``, or None if no row arrived in time.
+        """
+        with self.condition:
+            if not self.queue and self.spill is not None and self.spill.pending:
+                rows = self.spill.read(min(self.batch_size, self.max_pending or self.batch_size))
+                self.rows_replayed += len(rows)
+                self.queue.extend(rows)
+            if not self.queue:
+                self.condition.wait(timeout)
+                if not self.queue:
+                    return None
+            item = self.queue.popleft()
+            if self.waiters and not self.is_full():
+                self.loop.call_soon_threadsafe(self._wake_waiter)
+            return item
+
+    def stop(self, timeout=None):
+        """
+        Flush every queued row and stop the writer thread.
+
+        Args:
+            timeout (float, optional): Maximum time in seconds to wait for the thread. Defaults to None (wait forever).
+        """
+        if self.thread is None:
+            return
+        logger.info("Stopping database writer")
+        with self.condition:
+            self.stopping = True
+            self.queue.append(_STOP)
+            self.condition.notify()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning("Database writer did not stop within %s seconds", timeout)
+        self.thread = None
+        self.stopping = False
+        if self.spill is not None:
+            if self.spill.pending:
+                logger.warning("%d spilled rows left in %s, replayed on the next start", self.spill.pending, self.spill.path)
+            self.spill.close()
+
+    def stats(self):
+        """
+        Get the writer counters.
+
+        Returns:
+            dict: Number of rows waiting in the queue and its high-water mark, rows written, failed,
+            dropped, spilled and replayed, batches written, and the snapshot of the batch commit latency histogram.
+        """
+        return {
+            "queue_depth": len(self.queue),
+            "high_water_mark": self.high_water_mark,
+            "max_pending": self.max_pending,
+            "overflow": self.overflow,
+            "rows_written": self.rows_written,
+            "rows_failed": self.rows_failed,
+            "rows_dropped": self.rows_dropped,
+            "rows_spilled": self.rows_spilled,
+            "rows_replayed": self.rows_replayed,
+            "spill_pending": self.spill.pending if self.spill is not None else 0,
+            "batches_written": self.batches_written,
+            "commit": self.commit_latency.snapshot(),
+        }
+
+    def _run(self):
+        """
+        Writer thread main loop.
+        """
+        conn = sqlite3.connect(self.db_uri)
+        configure_connection(conn)
+        pending = {}
+        pending_rows = 0
+        deadline = None
+        try:
+            while True:
+                # Wait for the next row, but never past the age limit of the current batch
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                item = self._get(timeout)
+
+                if item is _STOP:
+                    break
+
+                if item is not None:
+                    query, params = item
+                    if callable(params):
+                        # Rows that are costly to build (such as compressed chunks) are built here, off the event loop
+                        try:
+                            params = params()
+                        except Exception as e:
+                            self.rows_failed += 1
+                            logger.error("Error building row for writing: %s", e)
+                            continue
+                    pending.setdefault(query, []).append(params)
+                    pending_rows += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.max_delay
+                    if pending_rows < self.batch_size and time.monotonic() < deadline:
+                        continue
+
+                self._flush(conn, pending, pending_rows)
+                pending = {}
+                pending_rows = 0
+                deadline = None
+        finally:
+            self._flush(conn, pending, pending_rows)
+            # Write the rows still waiting in the spill file before exiting
+            while self.spill is not None and self.spill.pending:
+                rows = self.spill.read(self.batch_size)
+                self.rows_replayed += len(rows)
+                spilled = {}
+                for query, params in rows:
+                    spilled.setdefault(query, []).append(params)
+                if not self._flush(conn, spilled, len(rows)):
+                    # Still locked: the rows were spilled again, for the next start
+                    break
+            conn.close()
+
+    def _flush(self, conn, pending, pending_rows):
+        """
+        Write a batch of rows inside a single transaction.
+
+        The batch is retried while the database is locked. If it is still
+        locked, the rows are requeued (see ``_requeue()``), and if the batch
+        fails for another reason they are counted as dropped.
+
+        Args:
+            conn (sqlite3.Connection): The writer thread connection.
+            pending (dict): Rows to write, grouped by SQL statement.
+            pending_rows (int): Total number of rows in ``pending``.
+
+        Returns:
+            bool: True if the rows were written.
+        """
+        if not pending_rows:
+            return True
+        started = time.perf_counter()
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(WRITE_RETRIES + 1):
+            try:
+                if self.prepare is not None:
+                    self.prepare(conn, pending.keys())
+                with conn:
+                    for query, rows in pending.items():
+                        conn.executemany(query, rows)
+                break
+            except sqlite3.Error as e:
+                if not is_busy_error(e):
+                    self.rows_dropped += pending_rows
+                    logger.error("Error writing batch of %d rows, dropped: %s", pending_rows, e)
+                    return False
+                if attempt == WRITE_RETRIES:
+                    logger.warning("Database still locked after %d retries: %s", WRITE_RETRIES, e)
+                    self._requeue(pending, pending_rows)
+                    return False
+                logger.debug("Database locked, retrying batch of %d rows in %.3fs", pending_rows, delay)
+                time.sleep(delay)
+                delay *= 2
+        self.commit_latency.record(time.perf_counter() - started)
+        self.rows_written += pending_rows
+        self.batches_written += 1
+        logger.debug("Committed batch of %d rows", pending_rows)
+        return True
+
+    def _requeue(self, pending, pending_rows):
+        """
+        Put back the rows of a batch the database was too busy to write.
+
+        The rows go to the spill file with the ``spill`` policy, and back to
+        the head of the queue otherwise, to be retried first. Once the writer
+        is stopping, rows that cannot be spilled are dropped instead, so a
+        database that stays locked cannot hold up the stop.
+
+        Args:
+            pending (dict): Rows to put back, grouped by SQL statement.
+            pending_rows (int): Total number of rows in ``pending``.
+        """
+        rows = [(query, params) for query, params_list in pending.items() for params in params_list]
+        if self.spill is not None:
+            try:
+                while rows:
+                    self.spill.append(*rows[0])
+                    self.rows_spilled += 1
+                    rows.pop(0)
+                return
+            except Exception as e:
+                logger.error("Error spilling batch of %d rows: %s", len(rows), e)
+        with self.condition:
+            if self.stopping:
+                self.rows_dropped += len(rows)
+                logger.error("Database writer stopping, dropped batch of %d rows", len(rows))
+                return
+            self.queue.extendleft(reversed(rows))
+            if len(self.queue) > self.high_water_mark:
+                self.high_water_mark = len(self.queue)
+
 
 class DatabaseManager:
     """
     Class to manage database operations.
     """
 
-    def __init__(self, db_uri):
+    def __init__(self, db_uri, storage_format="rows", chunk_frames=256, chunk_encoding="delta", chunk_compression="zlib", chunk_max_age=60.0,
+                 partition=None, retention=None):
         """
         Initialize DatabaseManager object.
 
         Args:
             db_uri (str): URI of the SQL database.
+            storage_format (str, optional): ``rows`` to store every reading in its own row of ``infrared_data``,
+                or ``chunked`` to store consecutive readings as compressed chunks in ``infrared_chunks``. Defaults to ``rows``.
+            chunk_frames (int, optional): Number of readings per chunk. Defaults to 256.
+            chunk_encoding (str, optional): Transform applied against the previous reading, see ``frame_codec.ENCODINGS``. Defaults to ``delta``.
+            chunk_compression (str, optional): Compressor of the chunks, see ``frame_codec.COMPRESSIONS``. Defaults to ``zlib``.
+            chunk_max_age (float, optional): Maximum time in seconds a reading waits in memory before its chunk is stored. Defaults to 60.
+            partition (str, optional): Store the readings in one database file per ``hour`` or ``day``, see ``PartitionScheme``. Defaults to None (in the main database).
+            retention (float, optional): Time in seconds partitions are kept after they end. Defaults to None (forever).
         """
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"Unknown storage format {storage_format!r}")
         self.db_uri = db_uri
+        self.writer = None
+        self.storage_format = storage_format
+        self.chunk_options = {
+            "capacity": chunk_frames,
+            "encoding": chunk_encoding,
+            "compression": chunk_compression,
+            "max_age": chunk_max_age,
+        }
+        self.chunk_builders = {}
+        self.partitions = PartitionScheme(db_uri, partition, retention) if partition else None
 
     def connect(self):
         """
@@ -42,16 +718,55 @@ class DatabaseManager:
         """
         logger.info("Connecting to database at URI: %s", self.db_uri)
         self.conn = sqlite3.connect(self.db_uri)
+        configure_connection(self.conn)
         self.cursor = self.conn.cursor()
 
-        # Create table to store infrared sensor data
+        # Create the tables to store infrared sensor data, upgrading the ones created by older versions
+        self.cursor.execute(FRAME_SCHEMA[0].format(schema="main"))
+        self.migrate_table("infrared_data", INFRARED_DATA_MIGRATIONS)
+        for statement in FRAME_SCHEMA[1:]:
+            self.cursor.execute(statement.format(schema="main"))
+
+        # Create table to store per-pixel summaries of every sensor over time buckets
         self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS infrared_data (
+            CREATE TABLE IF NOT EXISTS infrared_rollup (
                 id INTEGER PRIMARY KEY,
-                reading_time REAL,
-                data BLOB
+                sensor_id INTEGER NOT NULL,
+                bucket_seconds INTEGER NOT NULL,
+                bucket_start REAL NOT NULL,
+                count INTEGER NOT NULL,
+                min BLOB,
+                max BLOB,
+                sum BLOB,
+                sum_squares BLOB
             );
         """)
+        self.cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_infrared_rollup_sensor_bucket
+            ON infrared_rollup (sensor_id, bucket_seconds, bucket_start);
+        """)
+        self.conn.commit()
+
+        if self.partitions is not None:
+            self.partitions.expire()
+
+    def migrate_table(self, table, columns, conn=None, schema="main"):
+        """
+        Add any missing columns to a table created by an older version.
+
+        Args:
+            table (str): Name of the table.
+            columns (dict): Column names mapped to their SQL type.
+            conn (sqlite3.Connection, optional): Connection to migrate through. Defaults to the main connection.
+            schema (str, optional): Schema of the table, such as an attached partition. Defaults to ``main``.
+        """
+        cursor = self.cursor if conn is None else conn.cursor()
+        cursor.execute(f"PRAGMA {schema}.table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column, column_type in columns.items():
+            if column not in existing:
+                logger.info("Adding column %s to table %s.%s", column, schema, table)
+                cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column} {column_type}")
 
     def execute(self, query, params=None):
         """
@@ -62,6 +777,8 @@ class DatabaseManager:
             params (tuple, optional): Parameters to pass to the query. Defaults to None.
         """
         logger.debug("Executing SQL query: %s", query)
+        if self.partitions is not None:
+            self.prepare_partitions(self.conn, (query,))
         # Execute database query
         if params is not None:
             self.cursor.execute(query, params)
@@ -70,9 +787,604 @@ class DatabaseManager:
         self.conn.commit()
         logger.debug("Query executed successfully")
 
+    def start_writer(self, batch_size=500, max_delay=0.5, max_pending=None, overflow="block", spill_path=None):
+        """
+        Start the background writer used by ``insert_frame()``.
+
+        Must be called after ``connect()`` so that the schema already exists.
+
+        Args:
+            batch_size (int, optional): Maximum number of rows per transaction. Defaults to 500.
+            max_delay (float, optional): Maximum time in seconds a row waits before being committed. Defaults to 0.5.
+            max_pending (int, optional): Maximum number of rows waiting to be written. Defaults to None (unbounded).
+            overflow (str, optional): What to do with new rows when ``max_pending`` rows are waiting, see ``BatchWriter``. Defaults to ``block``.
+            spill_path (str, optional): Path of the spill file of the ``spill`` policy. Defaults to the database path followed by ``.spill``.
+        """
+        prepare = self.prepare_partitions if self.partitions is not None else None
+        self.writer = BatchWriter(self.db_uri, batch_size, max_delay, max_pending, overflow, spill_path, prepare)
+        self.writer.start()
+
+    def needs_backpressure(self):
+        """
+        Check whether producers should wait before storing more readings.
+
+        Returns:
+            bool: True if the writer queue is full and its overflow policy is ``block``.
+        """
+        return self.writer is not None and self.writer.is_full()
+
+    def prepare_partitions(self, conn, queries):
+        """
+        Attach the partitions written by some statements to a connection, and detach the older ones.
+
+        A partition is created with its tables the first time it is attached,
+        and starting a new partition drops the expired ones. Runs outside of
+        any transaction: on the writer thread before every batch, or before a
+        synchronous write.
+
+        Args:
+            conn (sqlite3.Connection): The connection about to run the statements.
+            queries (iterable): The SQL statements, qualified with ``PartitionScheme.query()``.
+        """
+        needed = set()
+        for query in queries:
+            needed |= self.partitions.referenced_keys(query)
+        if not needed:
+            return
+        attached = {
+            self.partitions.parse_name(schema[len(SCHEMA_PREFIX):]): schema
+            for _, schema, _ in conn.execute("PRAGMA database_list")
+            if schema.startswith(SCHEMA_PREFIX)
+        }
+        # Partitions older than the ones written to will not be written to again
+        for key, schema in attached.items():
+            if key not in needed and key < max(needed):
+                conn.execute(f"DETACH DATABASE {schema}")
+        created = False
+        for key in needed - attached.keys():
+            schema = self.partitions.schema(key)
+            created = created or not os.path.exists(self.partitions.path(key))
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (self.partitions.path(key),))
+            conn.execute(f"PRAGMA {schema}.journal_mode=WAL")
+            conn.execute(f"PRAGMA {schema}.synchronous=NORMAL")
+            conn.execute(FRAME_SCHEMA[0].format(schema=schema))
+            self.migrate_table("infrared_data", INFRARED_DATA_MIGRATIONS, conn, schema)
+            for statement in FRAME_SCHEMA[1:]:
+                conn.execute(statement.format(schema=schema))
+        if created:
+            self.partitions.expire()
+
+    def partition_query(self, query, reading_time):
+        """
+        Get the statement writing a row to the partition of a time.
+
+        Args:
+            query (str): SQL statement on ``infrared_data`` or ``infrared_chunks``.
+            reading_time (float): Time of the row as a Unix timestamp.
+
+        Returns:
+            str: The statement, unchanged if the database is not partitioned.
+        """
+        if self.partitions is None:
+            return query
+        return self.partitions.query(query, self.partitions.key(reading_time))
+
+    async def wait_for_space(self):
+        """
+        Wait, without blocking the event loop, until the writer queue has room again.
+        """
+        if self.writer is not None:
+            await self.writer.wait_for_space()
+
+    def stores_runs(self):
+        """
+        Check whether readings are stored with the number of readings skipped before them.
+
+        Returns:
+            bool: True with the ``rows`` storage format, the only one with a ``skipped`` column.
+        """
+        return self.storage_format == "rows"
+
+    def insert_frame(self, reading_time, data, scheduled_time=None, sensor_id=0, skipped=0):
+        """
+        Store a sensor reading.
+
+        When the background writer is running the row is queued and committed
+        in a later batch, otherwise it is written synchronously.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes): The packed sensor data.
+            scheduled_time (float, optional): Time the reading was scheduled for as a Unix timestamp. Defaults to None.
+            sensor_id (int, optional): Identifier of the sensor that took the reading. Defaults to 0.
+            skipped (int, optional): Number of readings skipped by a ``DeadbandFilter`` before this one,
+                see ``stores_runs()``. Defaults to 0.
+
+        With the ``chunked`` storage format the reading is added to the chunk
+        being built for its sensor, which is stored once it is full or old enough.
+
+        Returns:
+            bool: False if the reading (or the chunk it completed) was dropped because the writer queue is full.
+        """
+        if self.storage_format == "chunked":
+            builder = self.chunk_builders.get(sensor_id)
+            if builder is None:
+                builder = self.chunk_builders[sensor_id] = ChunkBuilder(sensor_id, **self.chunk_options)
+            stored = True
+            if builder.exceeds_span(reading_time):
+                # Range queries across partitions only look back chunk_max_age for the start of a chunk
+                stored = self._store_chunk(builder)
+            if builder.append(reading_time, data, scheduled_time):
+                return self._store_chunk(builder) and stored
+            return stored
+
+        query = self.partition_query(INSERT_FRAME_QUERY, reading_time)
+        params = (sensor_id, reading_time, scheduled_time, data, skipped)
+        if self.writer is not None:
+            return self.writer.submit(query, params)
+        self.execute(query, params)
+        return True
+
+    def _store_chunk(self, builder):
+        """
+        Store the readings collected by a chunk builder.
+
+        Args:
+            builder (ChunkBuilder): The builder of the chunk.
+
+        Returns:
+            bool: False if the chunk was dropped because the writer queue is full.
+        """
+        if not builder.count:
+            return True
+        # A chunk is stored in the partition of its first reading
+        query = self.partition_query(INSERT_CHUNK_QUERY, float(builder.reading_times[0]))
+        job = builder.take()
+        if self.writer is not None:
+            # The chunk is encoded and compressed on the writer thread
+            return self.writer.submit(query, job)
+        self.execute(query, job())
+        return True
+
+    def flush_chunks(self, sensor_id=None):
+        """
+        Store the readings waiting in partially filled chunks.
+
+        Args:
+            sensor_id (int, optional): Only flush the chunk of this sensor. Defaults to None (every sensor).
+        """
+        if sensor_id is not None:
+            builders = [self.chunk_builders[sensor_id]] if sensor_id in self.chunk_builders else []
+        else:
+            builders = list(self.chunk_builders.values())
+        for builder in builders:
+            self._store_chunk(builder)
+
+    def insert_rollup(self, row):
+        """
+        Store a closed rollup bucket.
+
+        Args:
+            row (tuple): The row returned by ``RollupAggregator.add()`` or ``RollupAggregator.flush()``.
+        """
+        if self.writer is not None:
+            self.writer.submit(INSERT_ROLLUP_QUERY, row)
+        else:
+            self.execute(INSERT_ROLLUP_QUERY, row)
+
+    def iter_rollups(self, sensor_id, bucket_seconds, start_time, end_time, chunk_size=1000):
+        """
+        Iterate over the rollup summaries of a sensor in a time range, in chunks.
+
+        Every chunk holds complete buckets: the rows of a bucket stored more
+        than once are merged together by ``merge_rollup_rows()``. Rows are
+        paged by ``(bucket_start, rowid)``, and the rows of the last bucket of
+        a page are held back until the bucket is known to be complete, even
+        when it spans several pages. Like ``iter_frames()``, the iterator uses
+        its own connection.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            bucket_seconds (int): Size of the buckets in seconds.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            chunk_size (int, optional): Maximum number of stored rows read per page. Defaults to 1000.
+
+        Yields:
+            dict: The merged summaries, see ``merge_rollup_rows()``.
+        """
+        chunk_size = max(chunk_size, 16)
+        conn = sqlite3.connect(self.db_uri, check_same_thread=False)
+        try:
+            # Row ids are positive, so the first page starts with the rows of start_time itself
+            lower, last_id = start_time, 0
+            carried = []
+            while True:
+                page = conn.execute(SELECT_ROLLUPS_QUERY, (sensor_id, bucket_seconds, lower, last_id, end_time, chunk_size)).fetchall()
+                if page:
+                    last_id, lower = page[-1][0], page[-1][1]
+                rows = carried + [row[1:] for row in page]
+                if len(page) < chunk_size:
+                    # Last page: every bucket is complete
+                    if rows:
+                        yield merge_rollup_rows(rows)
+                    break
+                # The last bucket may continue on the next page, so its rows are carried over
+                split = len(rows)
+                while split and rows[split - 1][0] == lower:
+                    split -= 1
+                carried = rows[split:]
+                if split:
+                    yield merge_rollup_rows(rows[:split])
+        finally:
+            conn.close()
+
+    def iter_frames(self, sensor_id, start_time, end_time, stride=1, limit=None, chunk_size=1000):
+        """
+        Iterate over the readings of a sensor in a time range, in chunks.
+
+        The readings are paged with the ``(sensor_id, reading_time)`` index,
+        resuming every page after the last row seen, so memory use is bounded
+        by ``chunk_size`` whatever the size of the range. The iterator uses its
+        own connection, which may be driven from any thread (for example with
+        ``asyncio.to_thread``) but only from one thread at a time.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            stride (int, optional): Only return every ``stride``-th reading. Defaults to 1.
+            limit (int, optional): Maximum number of readings returned. Defaults to None (no limit).
+            chunk_size (int, optional): Maximum number of readings per chunk. Defaults to 1000.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+        """
+        conn = sqlite3.connect(self.db_uri, check_same_thread=False)
+        try:
+            pages = self._iter_pages(conn, sensor_id, start_time, end_time, chunk_size * stride)
+
+            position = 0
+            returned = 0
+            for reading_times, frames in pages:
+                # Keep every stride-th reading, counting from the first reading of the range
+                offset = -position % stride
+                position += len(reading_times)
+                reading_times, frames = reading_times[offset::stride], frames[offset::stride]
+                if limit is not None:
+                    reading_times, frames = reading_times[:limit - returned], frames[:limit - returned]
+                returned += len(reading_times)
+
+                for i in range(0, len(reading_times), chunk_size):
+                    yield reading_times[i:i + chunk_size], frames[i:i + chunk_size]
+                if limit is not None and returned >= limit:
+                    break
+        finally:
+            conn.close()
+
+    def _iter_pages(self, conn, sensor_id, start_time, end_time, page_size):
+        """
+        Iterate over the readings of a sensor in a time range, a page at a time, in the storage format of the database.
+
+        Args:
+            conn (sqlite3.Connection): Connection used by the iterator.
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Number of readings per page.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+        """
+        if self.partitions is not None:
+            return self._iter_partition_pages(sensor_id, start_time, end_time, page_size)
+        if self.storage_format == "chunked":
+            return self._iter_chunk_pages(conn, sensor_id, start_time, end_time, page_size)
+        return self._iter_row_pages(conn, sensor_id, start_time, end_time, page_size)
+
+    def _iter_partition_pages(self, sensor_id, start_time, end_time, page_size):
+        """
+        Iterate over the readings of a sensor in the partitions overlapping a time range, a page at a time.
+
+        Every partition is read with its own connection, opened in turn.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Number of readings per page.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+        """
+        # A chunk is stored in the partition of its first reading, so the previous partition may hold the start of the range
+        margin = self.chunk_options["max_age"] if self.storage_format == "chunked" else 0
+        for key in self.partitions.between(start_time - margin, end_time):
+            conn = sqlite3.connect(self.partitions.path(key), check_same_thread=False)
+            try:
+                if self.storage_format == "chunked":
+                    yield from self._iter_chunk_pages(conn, sensor_id, start_time, end_time, page_size)
+                else:
+                    yield from self._iter_row_pages(conn, sensor_id, start_time, end_time, page_size)
+            finally:
+                conn.close()
+
+    def _iter_row_pages(self, conn, sensor_id, start_time, end_time, page_size):
+        """
+        Iterate over the readings of a sensor stored one per row, a page at a time.
+
+        Args:
+            conn (sqlite3.Connection): Connection to read from.
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Number of rows read per query.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+        """
+        last_time, last_id = start_time, -1
+        while True:
+            rows = conn.execute(SELECT_FRAMES_QUERY, (sensor_id, end_time, last_time, last_id, page_size)).fetchall()
+            if not rows:
+                break
+            last_id, last_time = rows[-1][0], rows[-1][1]
+            reading_times = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+            frames = np.frombuffer(b"".join(row[2] for row in rows), dtype=FRAME_DTYPE).reshape(len(rows), FRAME_PIXELS)
+            yield reading_times, frames
+
+    def _iter_chunk_pages(self, conn, sensor_id, start_time, end_time, page_size):
+        """
+        Iterate over the readings of a sensor stored in chunks, a chunk at a time.
+
+        Chunks ending before the range are skipped through the index, and the
+        iteration stops at the first chunk starting after it, so only the
+        chunks overlapping the range are decoded.
+
+        Args:
+            conn (sqlite3.Connection): Connection to read from.
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Approximate number of readings read per query.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+        """
+        chunks_per_page = max(1, page_size // self.chunk_options["capacity"])
+        last_end, last_id = start_time, -1
+        while True:
+            chunks = conn.execute(SELECT_CHUNKS_QUERY, (sensor_id, last_end, last_id, chunks_per_page)).fetchall()
+            if not chunks:
+                break
+            for chunk_id, chunk_start, chunk_end, frame_count, codec, data in chunks:
+                if chunk_start >= end_time:
+                    return
+                reading_times, _, frames = decode_chunk(codec, data, frame_count)
+                mask = (reading_times >= start_time) & (reading_times < end_time)
+                yield reading_times[mask], frames[mask]
+            last_id, last_end = chunks[-1][0], chunks[-1][2]
+
+    def iter_runs(self, sensor_id, start_time, end_time, chunk_size=1000):
+        """
+        Iterate over the readings of a sensor in a time range, with the readings skipped by a deadband rebuilt.
+
+        Every stored reading is followed by the readings skipped after it, as
+        counted by the next stored reading, at the scheduled times of the ticks
+        they were taken at, see ``deadband.expand_runs()``. The stored readings
+        just before and after the range are looked up too, so the runs crossing
+        its bounds are rebuilt as well.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            chunk_size (int, optional): Maximum number of stored readings per chunk. Defaults to 1000.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64).
+
+        Raises:
+            ValueError: If the storage format does not record skipped readings.
+        """
+        if not self.stores_runs():
+            raise ValueError("Skipped readings are only recorded with the rows storage format")
+        if self.partitions is None:
+            paths = before = after = [self.db_uri]
+        else:
+            existing = self.partitions.existing()
+            paths = [self.partitions.path(key) for key in self.partitions.between(start_time, end_time)]
+            before = [self.partitions.path(key) for key in reversed(existing) if key <= self.partitions.key(start_time)]
+            after = [self.partitions.path(key) for key in existing if key >= self.partitions.key(end_time)]
+
+        # The readings skipped at the start of the range repeat the last reading stored before it
+        row = self._find_row(before, SELECT_PREVIOUS_FRAME_QUERY, (sensor_id, start_time))
+        previous = None if row is None else (row[0], np.frombuffer(row[1], dtype=FRAME_DTYPE), row[2])
+
+        for path in paths:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            try:
+                last_time, last_id = start_time, -1
+                while True:
+                    rows = conn.execute(SELECT_RUNS_QUERY, (sensor_id, end_time, last_time, last_id, chunk_size)).fetchall()
+                    if not rows:
+                        break
+                    last_id, last_time = rows[-1][0], rows[-1][1]
+                    reading_times = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+                    frames = np.frombuffer(b"".join(row[2] for row in rows), dtype=FRAME_DTYPE).reshape(len(rows), FRAME_PIXELS)
+                    skipped = np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows))
+                    scheduled_times = np.array([row[4] for row in rows], dtype=np.float64)
+                    times, expanded = expand_runs(reading_times, frames, skipped, scheduled_times, previous)
+                    previous = (reading_times[-1], frames[-1], scheduled_times[-1])
+                    keep = times >= start_time
+                    yield times[keep], expanded[keep]
+            finally:
+                conn.close()
+
+        # The readings skipped at the end of the range are counted by the first reading stored after it
+        row = self._find_row(after, SELECT_NEXT_FRAME_QUERY, (sensor_id, end_time))
+        if row is not None and row[2] and previous is not None:
+            times, expanded = expand_runs([row[0]], np.frombuffer(row[1], dtype=FRAME_DTYPE), [row[2]], [row[3]], previous)
+            keep = (times >= start_time) & (times < end_time)
+            yield times[keep], expanded[keep]
+
+    def _find_row(self, paths, query, params):
+        """
+        Run a query returning at most one row on databases in turn, until one returns it.
+
+        Args:
+            paths (list): Paths of the databases, in the order they are searched.
+            query (str): SQL query.
+            params (tuple): Parameters of the query.
+
+        Returns:
+            tuple: The first row found, or None.
+        """
+        for path in paths:
+            conn = sqlite3.connect(path, check_same_thread=False)
+            try:
+                row = conn.execute(query, params).fetchone()
+            finally:
+                conn.close()
+            if row is not None:
+                return row
+        return None
+
     def close(self):
         """
         Close database connection.
+
+        Any readings waiting in partial chunks or queued in the background
+        writer are flushed first.
         """
+        self.flush_chunks()
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
         logger.info("Closing database connection")
-        self.conn.close()
\ No newline at end of file
+        self.conn.close()
+
+
+class FrameLogDatabase(DatabaseManager):
+    """
+    Database storing the readings in a memory-mapped ``FrameLog``.
+
+    Readings are appended to the frame log directly from the event loop,
+    which costs a copy into the mapped file, and range queries are answered
+    with views of the mapped segments. Everything else, such as the rollup
+    buckets, is kept in a SQLite database inside the frame log directory and
+    goes through the background writer as usual.
+    """
+
+    def __init__(self, path, segment_bytes=64 * 1024 * 1024, segment_seconds=None):
+        """
+        Initialize FrameLogDatabase object.
+
+        Args:
+            path (str): Directory of the frame log, created if needed.
+            segment_bytes (int, optional): Size in bytes of every segment file. Defaults to 64 MiB.
+            segment_seconds (float, optional): Maximum age in seconds of the segment written to. Defaults to None (roll by size only).
+        """
+        os.makedirs(path, exist_ok=True)
+        super().__init__(os.path.join(path, FRAMELOG_SQLITE_NAME))
+        self.path = path
+        self.log = FrameLog(path, segment_bytes, segment_seconds)
+
+    def stores_runs(self):
+        """
+        Check whether readings are stored with the number of readings skipped before them.
+
+        Returns:
+            bool: Always False, frame log records have no room for it.
+        """
+        return False
+
+    def insert_frame(self, reading_time, data, scheduled_time=None, sensor_id=0, skipped=0):
+        """
+        Append a sensor reading to the frame log.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes): The packed sensor data.
+            scheduled_time (float, optional): Time the reading was scheduled for as a Unix timestamp. Defaults to None.
+            sensor_id (int, optional): Identifier of the sensor that took the reading. Defaults to 0.
+            skipped (int, optional): Unused, see ``stores_runs()``.
+
+        Returns:
+            bool: Always True, the frame log never drops readings.
+        """
+        self.log.append(sensor_id, reading_time, data, scheduled_time)
+        return True
+
+    def _iter_pages(self, conn, sensor_id, start_time, end_time, page_size):
+        """
+        Iterate over the readings of a sensor in a time range, as views of the frame log.
+
+        Args:
+            conn (sqlite3.Connection): Unused, the readings are not in SQLite.
+            sensor_id (int): Identifier of the sensor.
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Number of readings per page.
+
+        Yields:
+            tuple: Array of timestamps and array of readings of shape (count, 64), both views of the mapped file.
+        """
+        for records in self.log.sensor(sensor_id).iter_range(start_time, end_time, page_size):
+            yield records["reading_time"], records["data"]
+
+    def close(self):
+        """
+        Write the frame log back to disk and close the database connection.
+        """
+        self.log.flush()
+        super().close()
+
+
+def check_database_options(db_uri, segment_bytes=None, segment_seconds=None, **options):
+    """
+    Check that a database URI supports the options of ``open_database()`` given for it.
+
+    The frame log stores every reading in its own record, without partitions,
+    so it only accepts the default value of every option of ``DatabaseManager``.
+
+    Args:
+        db_uri (str): URI of the database.
+        segment_bytes (int, optional): Size in bytes of the frame log segments, ignored for SQLite databases.
+        segment_seconds (float, optional): Maximum age in seconds of the frame log segment written to, ignored for SQLite databases.
+        **options: Options of ``DatabaseManager``, such as ``storage_format``.
+
+    Raises:
+        ValueError: If a frame log URI is given options it does not support.
+    """
+    if not db_uri.startswith(FRAMELOG_SCHEME):
+        return
+    defaults = inspect.signature(DatabaseManager.__init__).parameters
+    unsupported = sorted(name for name, value in options.items() if name not in defaults or value != defaults[name].default)
+    if unsupported:
+        raise ValueError(f"The frame log does not support the {', '.join(unsupported)} option(s)")
+
+
+def open_database(db_uri, segment_bytes=64 * 1024 * 1024, segment_seconds=None, **options):
+    """
+    Create the database manager of a database URI.
+
+    URIs starting with ``framelog://`` select the memory-mapped frame log
+    backend in the directory that follows; any other URI is a SQLite database.
+
+    Args:
+        db_uri (str): URI of the database.
+        segment_bytes (int, optional): Size in bytes of the frame log segments. Defaults to 64 MiB.
+        segment_seconds (float, optional): Maximum age in seconds of the frame log segment written to. Defaults to None.
+        **options: Options of ``DatabaseManager``, such as ``storage_format``, for SQLite databases.
+
+    Returns:
+        DatabaseManager: The database manager, not connected yet.
+
+    Raises:
+        ValueError: If a frame log URI is given options it does not support, see ``check_database_options()``.
+    """
+    check_database_options(db_uri, **options)
+    if db_uri.startswith(FRAMELOG_SCHEME):
+        return FrameLogDatabase(db_uri[len(FRAMELOG_SCHEME):], segment_bytes, segment_seconds)
+    return DatabaseManager(db_uri, **options)
@@ -0,0 +1,203 @@
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+
+def check_deadband(deadband, heartbeat):
+    """
+    Check the settings of a ``DeadbandFilter``.
+
+    Args:
+        deadband (int): Largest change of a pixel, in sensor units, that does not make a reading stored.
+        heartbeat (float): Maximum time in seconds between two stored readings, or None.
+
+    Raises:
+        ValueError: If a setting is out of range.
+    """
+    if deadband < 0:
+        raise ValueError("deadband must not be negative")
+    if heartbeat is not None and heartbeat <= 0:
+        raise ValueError("heartbeat must be greater than 0")
+
+
+class DeadbandFilter:
+    """
+    Change-only storage of the readings of a sensor.
+
+    Every reading is compared with the last stored one, pixel by pixel, with
+    a couple of in-place NumPy operations on preallocated arrays. It is only
+    stored when some pixel moved by more than ``deadband``, or when
+    ``heartbeat`` seconds have passed since the last stored reading; the
+    readings in between are skipped. The next stored reading carries the
+    number of readings skipped before it, so the series can be rebuilt with
+    ``expand_runs()``: every skipped reading is within ``deadband`` of the
+    stored reading before it, and identical to it with a deadband of 0.
+
+    A run of skipped readings must not span a gap in the schedule of the
+    sensor, or its readings could not be placed back in time: the capture
+    closes the run with ``flush()`` and starts the next one with ``reset()``
+    when it starts, misses ticks or changes its period.
+    """
+
+    def __init__(self, deadband, heartbeat=None):
+        """
+        Initialize DeadbandFilter object.
+
+        Args:
+            deadband (int): Largest change of a pixel, in sensor units, that does not make a reading stored.
+            heartbeat (float, optional): Maximum time in seconds between two stored readings. Defaults to None (no limit).
+        """
+        check_deadband(deadband, heartbeat)
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        self.reference = np.empty(FRAME_PIXELS, dtype=FRAME_DTYPE)
+        self.diff = np.empty(FRAME_PIXELS, dtype=np.int32)
+        self.reference_time = None
+        self.skipped = 0
+        self.last_skipped_time = None
+        self.last_skipped_scheduled_time = None
+        self.last_skipped = np.empty(FRAME_PIXELS, dtype=FRAME_DTYPE)
+        self.frames_stored = 0
+        self.frames_skipped = 0
+
+    def reset(self):
+        """
+        Forget the reference reading, so that the next reading is stored and starts a new run.
+
+        The current run must have been closed with ``flush()`` first.
+        """
+        self.reference_time = None
+        self.skipped = 0
+        self.last_skipped_time = None
+        self.last_skipped_scheduled_time = None
+
+    def check(self, reading_time, frame, scheduled_time=None):
+        """
+        Decide whether a reading is stored, remembering it as the new reference if it is.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray): The 64 frame values.
+            scheduled_time (float, optional): Time the reading was scheduled for as a Unix timestamp,
+                kept for ``flush()``. Defaults to None.
+
+        Returns:
+            int: Number of readings skipped since the last stored one, to store with this reading,
+            or None if this reading is skipped.
+        """
+        if self.reference_time is not None and (self.heartbeat is None or reading_time - self.reference_time < self.heartbeat):
+            # Largest change of any pixel since the stored reading, without uint16 wrap-around
+            np.subtract(frame, self.reference, out=self.diff, dtype=np.int32)
+            np.abs(self.diff, out=self.diff)
+            if self.diff.max() <= self.deadband:
+                self.skipped += 1
+                self.frames_skipped += 1
+                self.last_skipped_time = reading_time
+                self.last_skipped_scheduled_time = scheduled_time
+                self.last_skipped[:] = frame
+                return None
+        return self._store(reading_time, frame)
+
+    def _store(self, reading_time, frame):
+        """
+        Make a reading the reference of the next ones.
+
+        Returns:
+            int: Number of readings skipped before it.
+        """
+        skipped, self.skipped = self.skipped, 0
+        self.reference[:] = frame
+        self.reference_time = reading_time
+        self.last_skipped_time = None
+        self.last_skipped_scheduled_time = None
+        self.frames_stored += 1
+        return skipped
+
+    def flush(self):
+        """
+        Close the current run, so that stopping the capture does not lose where it ended.
+
+        Returns:
+            tuple: Time, values, skipped count and scheduled time (or None) of the last skipped reading,
+            to store, or None if the last reading was stored.
+        """
+        if self.last_skipped_time is None:
+            return None
+        # The last skipped reading is stored, so it is no longer counted as skipped
+        self.skipped -= 1
+        self.frames_skipped -= 1
+        reading_time = self.last_skipped_time
+        scheduled_time = self.last_skipped_scheduled_time
+        frame = self.last_skipped.copy()
+        return reading_time, frame, self._store(reading_time, frame), scheduled_time
+
+    def stats(self):
+        """
+        Get the filter counters.
+
+        Returns:
+            dict: Readings stored and skipped.
+        """
+        return {
+            "frames_stored": self.frames_stored,
+            "frames_skipped": self.frames_skipped,
+        }
+
+
+def expand_runs(reading_times, frames, skipped, scheduled_times=None, previous=None):
+    """
+    Rebuild the readings skipped by a ``DeadbandFilter`` from the stored ones.
+
+    The readings skipped before a stored reading repeat the stored reading
+    before it. Runs never span a gap in the schedule of the sensor, so the
+    skipped readings were taken at evenly spaced ticks between the two stored
+    readings: they get these scheduled times, exactly, when both stored
+    readings have a scheduled time, and times spread evenly between their
+    reading times otherwise. Their values are exact with a deadband of 0;
+    otherwise every skipped reading is only known to be within the deadband
+    of the one repeated.
+
+    Args:
+        reading_times (numpy.ndarray): Times of the stored readings, in order.
+        frames (numpy.ndarray): Stored readings, of shape (count, 64).
+        skipped (numpy.ndarray): Number of readings skipped before every stored reading.
+        scheduled_times (numpy.ndarray, optional): Scheduled times of the stored readings, NaN (or None) where
+            unknown. Defaults to None (unknown).
+        previous (tuple, optional): Time, values and optionally scheduled time of the stored reading before the
+            first one. Defaults to None (the readings skipped before the first one are not rebuilt).
+
+    Returns:
+        tuple: Array of timestamps and array of readings of shape (count, 64), skipped readings included.
+    """
+    reading_times = np.asarray(reading_times, dtype=np.float64)
+    frames = np.asarray(frames, dtype=FRAME_DTYPE).reshape(-1, FRAME_PIXELS)
+    skipped = np.asarray(skipped, dtype=np.int64).copy()
+    if scheduled_times is None:
+        scheduled_times = np.full(len(reading_times), np.nan)
+    scheduled_times = np.asarray(scheduled_times, dtype=np.float64)
+    if previous is not None:
+        reading_times = np.concatenate(([previous[0]], reading_times))
+        frames = np.concatenate((np.asarray(previous[1], dtype=FRAME_DTYPE).reshape(1, FRAME_PIXELS), frames))
+        skipped = np.concatenate(([0], skipped))
+        previous_scheduled = previous[2] if len(previous) > 2 and previous[2] is not None else np.nan
+        scheduled_times = np.concatenate(([previous_scheduled], scheduled_times))
+    elif len(skipped):
+        skipped[0] = 0
+    if not skipped.any():
+        return (reading_times[1:], frames[1:]) if previous is not None else (reading_times, frames)
+
+    # Every stored reading but the last stands for itself and the readings skipped after it
+    repeats = np.ones(len(reading_times), dtype=np.int64)
+    repeats[:-1] += skipped[1:]
+    owners = np.repeat(np.arange(len(reading_times)), repeats)
+    steps = np.arange(len(owners)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    gaps = np.diff(reading_times, append=reading_times[-1])
+    times = reading_times[owners] + steps * gaps[owners] / repeats[owners]
+    # Skipped readings of scheduled sensors were taken at the ticks between the two stored readings
+    scheduled_gaps = np.diff(scheduled_times, append=scheduled_times[-1])
+    on_schedule = (steps > 0) & ~np.isnan(scheduled_gaps[owners])
+    times[on_schedule] = (scheduled_times[owners] + steps * scheduled_gaps[owners] / repeats[owners])[on_schedule]
+    expanded = frames[owners]
+    if previous is not None:
+        # The previous reading was only needed for the readings skipped after it
+        times, expanded = times[1:], expanded[1:]
+    return times, expanded
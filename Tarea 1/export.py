@@ -0,0 +1,308 @@
+import argparse
+import os
+import struct
+import sys
+import time
+import numpy as np
+import database
+import logging_setup
+from cli import parse_count
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Optional, only needed to export to Parquet
+    pyarrow = None
+
+# Export formats, chosen from the extension of the output file unless given
+EXPORT_FORMATS = {".npy": "npy", ".parquet": "parquet", ".csv": "csv"}
+
+# Record of a reading in .npy exports: the time of the reading and its 64 values
+EXPORT_DTYPE = np.dtype([("reading_time", "<f8"), ("data", "<u2", (FRAME_PIXELS,))])
+
+# Size in bytes of the .npy header, reserved before the number of readings is known
+NPY_HEADER_SIZE = 128
+
+# Default number of readings read, converted and written at a time
+DEFAULT_CHUNK_SIZE = 10000
+
+# Minimum time in seconds between two progress reports of the command line
+PROGRESS_INTERVAL = 1.0
+
+
+def npy_header(count):
+    """
+    Build the header of a .npy file of ``EXPORT_DTYPE`` records.
+
+    The header is padded to ``NPY_HEADER_SIZE`` bytes whatever the number of
+    records, so it can be written over the reserved space once the export is
+    complete.
+
+    Args:
+        count (int): Number of records in the file.
+
+    Returns:
+        bytes: The header, magic string included.
+    """
+    fields = {"descr": np.lib.format.dtype_to_descr(EXPORT_DTYPE), "fortran_order": False, "shape": (count,)}
+    prefix = b"\x93NUMPY\x01\x00"
+    length = NPY_HEADER_SIZE - len(prefix) - 2
+    return prefix + struct.pack("<H", length) + repr(fields).ljust(length - 1).encode("latin1") + b"\n"
+
+
+class NpyExporter:
+    """
+    Writes readings to a .npy file of ``EXPORT_DTYPE`` records, which ``numpy.load(path, mmap_mode="r")`` maps without reading it.
+    """
+
+    def __init__(self, path, chunk_size):
+        """
+        Initialize NpyExporter object.
+
+        Args:
+            path (str): Path of the output file.
+            chunk_size (int): Maximum number of readings per chunk.
+        """
+        self.file = open(path, "wb")
+        self.file.write(npy_header(0))
+        self.records = np.empty(chunk_size, dtype=EXPORT_DTYPE)
+        self.count = 0
+
+    def write(self, reading_times, frames):
+        """
+        Append a chunk of readings.
+
+        Args:
+            reading_times (numpy.ndarray): Times of the readings.
+            frames (numpy.ndarray): Readings of shape (count, 64).
+        """
+        records = self.records[:len(reading_times)]
+        records["reading_time"] = reading_times
+        records["data"] = frames
+        self.file.write(records.data)
+        self.count += len(records)
+
+    def close(self):
+        """
+        Write the final header and close the file.
+        """
+        self.file.seek(0)
+        self.file.write(npy_header(self.count))
+        self.file.close()
+
+
+class ParquetExporter:
+    """
+    Writes readings to a Parquet file, one row group per chunk, with a
+    ``reading_time`` column and a ``data`` column of fixed-size lists of 64
+    values.
+    """
+
+    def __init__(self, path, chunk_size):
+        """
+        Initialize ParquetExporter object.
+
+        Args:
+            path (str): Path of the output file.
+            chunk_size (int): Maximum number of readings per chunk.
+
+        Raises:
+            ImportError: If pyarrow is not installed.
+        """
+        if pyarrow is None:
+            raise ImportError("Exporting to Parquet requires pyarrow")
+        self.schema = pyarrow.schema([
+            ("reading_time", pyarrow.float64()),
+            ("data", pyarrow.list_(pyarrow.uint16(), FRAME_PIXELS)),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, reading_times, frames):
+        """
+        Append a chunk of readings as a row group.
+
+        Args:
+            reading_times (numpy.ndarray): Times of the readings.
+            frames (numpy.ndarray): Readings of shape (count, 64).
+        """
+        values = pyarrow.array(np.ascontiguousarray(frames, dtype=FRAME_DTYPE).ravel())
+        table = pyarrow.Table.from_arrays([
+            pyarrow.array(reading_times, type=pyarrow.float64()),
+            pyarrow.FixedSizeListArray.from_arrays(values, FRAME_PIXELS),
+        ], schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        """
+        Write the file footer and close the file.
+        """
+        self.writer.close()
+
+
+class CsvExporter:
+    """
+    Writes readings to a CSV file with a header line, one line per reading:
+    its time, then its 64 values.
+    """
+
+    def __init__(self, path, chunk_size):
+        """
+        Initialize CsvExporter object.
+
+        Args:
+            path (str): Path of the output file.
+            chunk_size (int): Maximum number of readings per chunk.
+        """
+        self.file = open(path, "w", newline="")
+        self.file.write(",".join(["reading_time"] + [f"pixel_{pixel}" for pixel in range(FRAME_PIXELS)]) + "\n")
+        self.line = "%.6f" + ",%d" * FRAME_PIXELS + "\n"
+        # Python objects, which are formatted much faster than NumPy scalars
+        self.rows = np.empty((chunk_size, FRAME_PIXELS + 1), dtype=object)
+
+    def write(self, reading_times, frames):
+        """
+        Append a chunk of readings.
+
+        Args:
+            reading_times (numpy.ndarray): Times of the readings.
+            frames (numpy.ndarray): Readings of shape (count, 64).
+        """
+        rows = self.rows[:len(reading_times)]
+        rows[:, 0] = reading_times
+        rows[:, 1:] = frames
+        # One format operation per chunk rather than per line
+        self.file.write((self.line * len(rows)) % tuple(rows.ravel()))
+
+    def close(self):
+        """
+        Close the file.
+        """
+        self.file.close()
+
+
+# Exporter of every export format
+EXPORTERS = {"npy": NpyExporter, "parquet": ParquetExporter, "csv": CsvExporter}
+
+
+def export_frames(db, sensor_id, start_time, end_time, path, export_format=None, chunk_size=DEFAULT_CHUNK_SIZE, rebuild_skipped=False, progress=None):
+    """
+    Export the readings of a sensor in a time range to a file.
+
+    The readings are read, converted and written a chunk at a time, with the
+    keyset pagination of ``DatabaseManager.iter_frames()``, so memory use is
+    bounded by ``chunk_size`` whatever the size of the export.
+
+    Args:
+        db (DatabaseManager): The database to export from.
+        sensor_id (int): Identifier of the sensor.
+        start_time (float): Start of the range as a Unix timestamp, included.
+        end_time (float): End of the range as a Unix timestamp, excluded.
+        path (str): Path of the output file.
+        export_format (str, optional): One of ``EXPORTERS``. Defaults to the format of the file extension.
+        chunk_size (int, optional): Maximum number of readings per chunk. Defaults to 10000.
+        rebuild_skipped (bool, optional): Whether to rebuild the readings skipped by a deadband,
+            see ``DatabaseManager.iter_runs()``. Defaults to False.
+        progress (callable, optional): Called after every chunk with the number of readings exported so far
+            and the time of the last one. Defaults to None.
+
+    Returns:
+        int: Number of readings exported.
+
+    Raises:
+        ValueError: If the export format is unknown.
+        ImportError: If the export format needs a package that is not installed.
+    """
+    if export_format is None:
+        export_format = EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if export_format not in EXPORTERS:
+        raise ValueError(f"Unknown export format for {path}, expected one of {', '.join(EXPORTERS)}")
+    exporter = EXPORTERS[export_format](path, chunk_size)
+
+    if rebuild_skipped:
+        chunks = db.iter_runs(sensor_id, start_time, end_time, chunk_size)
+    else:
+        chunks = db.iter_frames(sensor_id, start_time, end_time, chunk_size=chunk_size)
+    exported = 0
+    try:
+        for reading_times, frames in chunks:
+            # Rebuilt runs may be longer than a chunk
+            for i in range(0, len(reading_times), chunk_size):
+                exporter.write(reading_times[i:i + chunk_size], frames[i:i + chunk_size])
+            exported += len(reading_times)
+            if progress is not None and len(reading_times):
+                progress(exported, float(reading_times[-1]))
+    finally:
+        exporter.close()
+    return exported
+
+
+def parse_args(args):
+    """
+    Parse the export command-line arguments.
+
+    Args:
+        args (list): Command-line arguments.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Export the stored readings of a sensor to NumPy, Parquet or CSV')
+    parser.add_argument('--db-uri', type=str, required=True, help='URI of the SQL database, or framelog://<directory> for the memory-mapped frame log')
+    parser.add_argument('--storage-format', type=str, choices=database.STORAGE_FORMATS, default='rows', help='Storage format of the readings')
+    parser.add_argument('--partition', type=str, choices=['none', 'hour', 'day'], default='none', help='Time partitioning of the readings')
+    parser.add_argument('--sensor-id', type=int, default=0, help='Identifier of the sensor')
+    parser.add_argument('--start', type=float, default=0.0, help='Start of the time range as a Unix timestamp, included')
+    parser.add_argument('--end', type=float, help='End of the time range as a Unix timestamp, excluded (default: now)')
+    parser.add_argument('--output', type=str, required=True, help='Output file, .npy, .parquet or .csv')
+    parser.add_argument('--format', type=str, choices=list(EXPORTERS), help='Export format (default: from the extension of --output)')
+    parser.add_argument('--chunk-size', type=parse_count, default=DEFAULT_CHUNK_SIZE, help='Number of readings read and written at a time')
+    parser.add_argument('--rebuild-skipped', action='store_true', help='Rebuild the readings skipped by --deadband')
+    parsed = parser.parse_args(args)
+    if not parsed.chunk_size:
+        parser.error('--chunk-size must be at least 1')
+    return parsed
+
+
+def main(argv):
+    """
+    Export the readings given on the command line, reporting the progress on the standard error.
+
+    Args:
+        argv (list): Command-line arguments.
+
+    Returns:
+        int: Exit status, 1 if the export failed.
+    """
+    args = parse_args(argv)
+    end_time = time.time() if args.end is None else args.end
+    logging_setup.configure_logging("ERROR", None)
+    db = database.open_database(args.db_uri, storage_format=args.storage_format, partition=None if args.partition == 'none' else args.partition)
+    started = time.monotonic()
+    last_report = started
+
+    def report(exported, reading_time):
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        done = (reading_time - args.start) / (end_time - args.start) if end_time > args.start else 1.0
+        print(f"{exported} readings exported ({done:.0%} of the range, {exported / (now - started):.0f} readings/s)", file=sys.stderr)
+
+    db.connect()
+    try:
+        exported = export_frames(db, args.sensor_id, args.start, end_time, args.output, args.format, args.chunk_size, args.rebuild_skipped, report)
+    except (ValueError, ImportError, OSError) as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+        logging_setup.stop_logging()
+    print(f"{exported} readings of sensor {args.sensor_id} exported to {args.output} in {time.monotonic() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
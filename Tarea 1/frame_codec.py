@@ -0,0 +1,249 @@
+import lzma
+import time
+import zlib
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+# Transforms applied to every frame (and timestamp) against the previous one before compression
+ENCODINGS = ("delta", "xor", "none")
+
+# Compressors applied to the transformed chunk
+COMPRESSIONS = ("zlib", "lzma", "none")
+
+_COMPRESSORS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+    "none": (bytes, bytes),
+}
+
+
+# Signed integer type of each unsigned integer size, used to zigzag deltas
+_SIGNED = {2: np.int16, 8: np.int64}
+
+
+def _encode_series(values, encoding):
+    """
+    Transform a series of unsigned integer rows against the previous row.
+
+    Args:
+        values (numpy.ndarray): Array of shape (count, ...) with the oldest row first.
+        encoding (str): One of ``ENCODINGS``.
+
+    Returns:
+        numpy.ndarray: The transformed array. Delta arithmetic wraps around, so it is exactly reversible.
+        Deltas are zigzag encoded (0, -1, 1, -2, ... become 0, 1, 2, 3, ...).
+    """
+    encoded = values.copy()
+    if encoding == "delta":
+        np.subtract(values[1:], values[:-1], out=encoded[1:])
+        # Zigzag the deltas so that small negative steps also have zero high bytes
+        signed = encoded[1:].view(_SIGNED[values.dtype.itemsize])
+        bits = values.dtype.itemsize * 8 - 1
+        encoded[1:] = ((signed << 1) ^ (signed >> bits)).view(values.dtype)
+    elif encoding == "xor":
+        np.bitwise_xor(values[1:], values[:-1], out=encoded[1:])
+    return encoded
+
+
+def _decode_series(values, encoding):
+    """
+    Reverse ``_encode_series()``.
+
+    Args:
+        values (numpy.ndarray): The transformed array.
+        encoding (str): One of ``ENCODINGS``.
+
+    Returns:
+        numpy.ndarray: The original array.
+    """
+    if encoding == "delta":
+        deltas = values.copy()
+        zigzag = values[1:]
+        deltas[1:] = (zigzag >> 1) ^ (-(zigzag & 1).view(_SIGNED[values.dtype.itemsize])).view(values.dtype)
+        return np.cumsum(deltas, axis=0, dtype=values.dtype)
+    if encoding == "xor":
+        return np.bitwise_xor.accumulate(values, axis=0)
+    return values
+
+
+def _shuffle(values):
+    """
+    Group the bytes of an array by significance (all first bytes, then all second bytes, ...).
+
+    Small deltas have mostly zero high bytes, which compress much better once grouped.
+
+    Args:
+        values (numpy.ndarray): Contiguous array of unsigned integers.
+
+    Returns:
+        bytes: The shuffled bytes.
+    """
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, values.itemsize).T).tobytes()
+
+
+def _unshuffle(data, dtype, count):
+    """
+    Reverse ``_shuffle()``.
+
+    Args:
+        data (bytes-like): The shuffled bytes.
+        dtype (numpy.dtype): Data type of the values.
+        count (int): Number of values.
+
+    Returns:
+        numpy.ndarray: One-dimensional array of the values.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8, count=count * itemsize).reshape(itemsize, count)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(count)
+
+
+def encode_chunk(reading_times, scheduled_times, frames, encoding="delta", compression="zlib"):
+    """
+    Encode consecutive frames of a sensor into one compressed chunk.
+
+    The frames are stored column by column, so that the values of each pixel
+    over time are contiguous, after being encoded against the previous frame.
+    The timestamps get the same treatment on their 64-bit representation.
+
+    Args:
+        reading_times (numpy.ndarray): Timestamps of the readings, ``float64``.
+        scheduled_times (numpy.ndarray): Scheduled timestamps of the readings, ``float64`` (NaN when unknown).
+        frames (numpy.ndarray): Readings as a ``uint16`` array of shape (count, 64).
+        encoding (str, optional): One of ``ENCODINGS``. Defaults to ``delta``.
+        compression (str, optional): One of ``COMPRESSIONS``. Defaults to ``zlib``.
+
+    Returns:
+        tuple: The codec label to store with the chunk (``"<encoding>+<compression>"``) and the payload bytes.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding {encoding!r}")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}")
+    times = np.stack((reading_times, scheduled_times), axis=1).astype(np.float64).view(np.uint64)
+    pixels = _encode_series(np.asarray(frames, dtype=FRAME_DTYPE), encoding)
+    payload = _shuffle(_encode_series(times, encoding)) + _shuffle(np.ascontiguousarray(pixels.T))
+    return f"{encoding}+{compression}", _COMPRESSORS[compression][0](payload)
+
+
+def decode_chunk(codec, payload, count):
+    """
+    Decode a chunk created by ``encode_chunk()``.
+
+    Args:
+        codec (str): The codec label stored with the chunk.
+        payload (bytes-like): The payload stored with the chunk.
+        count (int): Number of frames in the chunk.
+
+    Returns:
+        tuple: ``reading_times`` and ``scheduled_times`` (``float64``, shape (count,)) and ``frames`` (``uint16``, shape (count, 64)).
+    """
+    encoding, compression = codec.split("+")
+    data = memoryview(_COMPRESSORS[compression][1](payload))
+    times_size = count * 2 * 8
+    times = _unshuffle(data[:times_size], np.uint64, count * 2).reshape(count, 2)
+    times = _decode_series(times, encoding).view(np.float64)
+    pixels = _unshuffle(data[times_size:], FRAME_DTYPE, count * FRAME_PIXELS).reshape(FRAME_PIXELS, count)
+    frames = np.ascontiguousarray(_decode_series(pixels.T, encoding))
+    return times[:, 0].copy(), times[:, 1].copy(), frames
+
+
+class ChunkBuilder:
+    """
+    Accumulates the frames of one sensor until they are stored as a chunk.
+
+    Frames are copied into preallocated arrays. Once ``capacity`` frames are
+    collected, or the oldest one has waited ``max_age`` seconds, ``take()``
+    hands the filled arrays over to a job that encodes the chunk; the job is
+    meant to run on the database writer thread, off the event loop. A chunk
+    never spans more than ``max_age`` seconds of reading times either: a
+    frame too far from the first one of the chunk, such as the first frame
+    after a pause of the sensor, must go to a new chunk, see ``exceeds_span()``.
+    """
+
+    def __init__(self, sensor_id, capacity=256, encoding="delta", compression="zlib", max_age=60.0):
+        """
+        Initialize ChunkBuilder object.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            capacity (int, optional): Number of frames per chunk. Defaults to 256.
+            encoding (str, optional): One of ``ENCODINGS``. Defaults to ``delta``.
+            compression (str, optional): One of ``COMPRESSIONS``. Defaults to ``zlib``.
+            max_age (float, optional): Maximum time in seconds a frame waits before its chunk is stored. Defaults to 60.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding!r}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression!r}")
+        self.sensor_id = sensor_id
+        self.capacity = capacity
+        self.encoding = encoding
+        self.compression = compression
+        self.max_age = max_age
+        self.count = 0
+        self.started = None
+        self._allocate()
+
+    def _allocate(self):
+        """
+        Allocate the arrays of a new chunk.
+        """
+        self.reading_times = np.empty(self.capacity, dtype=np.float64)
+        self.scheduled_times = np.empty(self.capacity, dtype=np.float64)
+        self.frames = np.empty((self.capacity, FRAME_PIXELS), dtype=FRAME_DTYPE)
+
+    def exceeds_span(self, reading_time):
+        """
+        Check whether a frame is too far from the first frame of the chunk to be added to it.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+
+        Returns:
+            bool: True if the chunk would span more than ``max_age`` seconds with the frame, and must be taken first.
+        """
+        return self.count > 0 and reading_time - self.reading_times[0] > self.max_age
+
+    def append(self, reading_time, data, scheduled_time=None):
+        """
+        Add a frame to the chunk.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes-like): The packed sensor data, 64 ``uint16`` values.
+            scheduled_time (float, optional): Time the reading was scheduled for. Defaults to None.
+
+        Returns:
+            bool: True if the chunk is ready to be stored.
+        """
+        if not self.count:
+            self.started = time.monotonic()
+        self.reading_times[self.count] = reading_time
+        self.scheduled_times[self.count] = np.nan if scheduled_time is None else scheduled_time
+        self.frames[self.count] = np.frombuffer(data, dtype=FRAME_DTYPE)
+        self.count += 1
+        return self.count >= self.capacity or time.monotonic() - self.started >= self.max_age
+
+    def take(self):
+        """
+        Hand the collected frames over to an encoding job and start a new chunk.
+
+        Returns:
+            callable: A job returning the ``infrared_chunks`` row of the chunk, or None if the chunk is empty.
+        """
+        if not self.count:
+            return None
+        count = self.count
+        reading_times, scheduled_times, frames = self.reading_times, self.scheduled_times, self.frames
+        self._allocate()
+        self.count = 0
+        sensor_id, encoding, compression = self.sensor_id, self.encoding, self.compression
+
+        def encode_row():
+            codec, payload = encode_chunk(reading_times[:count], scheduled_times[:count], frames[:count], encoding, compression)
+            return (sensor_id, float(reading_times[0]), float(reading_times[count - 1]), count, codec, payload)
+
+        return encode_row
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Number of pixels in a frame of the infrared sensor
+FRAME_PIXELS = 64
+
+# Data type of a pixel value, matching the '64H' layout stored in the database
+FRAME_DTYPE = np.uint16
+
+
+class MockupFrameGenerator:
+    """
+    Vectorized generator of mockup sensor frames.
+
+    Frames are drawn as whole ``uint16`` arrays from a NumPy random generator,
+    so producing one frame or a batch of frames costs a single call with no
+    per-pixel Python work. Values are uniformly distributed between
+    ``min_value`` and ``max_value``, both included.
+    """
+
+    def __init__(self, min_value, max_value, seed=None):
+        """
+        Initialize MockupFrameGenerator object.
+
+        Args:
+            min_value (int): Minimum value of generated data.
+            max_value (int): Maximum value of generated data.
+            seed (int or sequence of int, optional): Seed of the random generator, for reproducible frames. Defaults to None.
+
+        Raises:
+            ValueError: If the range is missing, inverted or outside the range of a ``uint16``.
+        """
+        self.set_range(min_value, max_value)
+        self.rng = np.random.default_rng(seed)
+
+    def set_range(self, min_value, max_value):
+        """
+        Change the range of the generated values, keeping the random stream.
+
+        Args:
+            min_value (int): Minimum value of generated data.
+            max_value (int): Maximum value of generated data.
+
+        Raises:
+            ValueError: If the range is missing, inverted or outside the range of a ``uint16``.
+        """
+        if min_value is None or max_value is None:
+            raise ValueError("min_value and max_value are required for mockup sensors")
+        if min_value > max_value:
+            raise ValueError(f"min_value ({min_value}) must not be greater than max_value ({max_value})")
+        limits = np.iinfo(FRAME_DTYPE)
+        if min_value < limits.min or max_value > limits.max:
+            raise ValueError(f"Mockup values must be between {limits.min} and {limits.max}")
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def frame(self):
+        """
+        Generate a single frame.
+
+        Returns:
+            numpy.ndarray: Contiguous ``uint16`` array of shape (64,).
+        """
+        return self.rng.integers(self.min_value, self.max_value, size=FRAME_PIXELS, dtype=FRAME_DTYPE, endpoint=True)
+
+    def frames(self, count):
+        """
+        Generate a batch of frames.
+
+        Args:
+            count (int): Number of frames to generate.
+
+        Returns:
+            numpy.ndarray: Contiguous ``uint16`` array of shape (count, 64).
+        """
+        return self.rng.integers(self.min_value, self.max_value, size=(count, FRAME_PIXELS), dtype=FRAME_DTYPE, endpoint=True)
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import struct
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+logger = logging.getLogger(__name__)
+
+# Header of a live frame message: sensor identifier, sequence number of the first frame, number of frames
+STREAM_HEADER = struct.Struct('<IQH')
+
+# Largest number of frames in a live message, counted by the uint16 of the header
+MAX_BATCH_FRAMES = 0xFFFF
+
+# Types of the timestamps and of the frame values in a message body, little-endian like the header
+WIRE_TIME_DTYPE = np.dtype('<f8')
+WIRE_FRAME_DTYPE = np.dtype('<u2')
+
+# Subject the frames of a sensor are published on
+STREAM_SUBJECT = "sensors.{}.frames"
+
+
+def encode_frames(sensor_id, seq, reading_times, frames):
+    """
+    Encode a batch of frames as a live frame message.
+
+    The message holds the header, then the timestamp of every frame as
+    ``float64``, then every frame as 64 ``uint16`` values, all little-endian
+    whatever the byte order of the host. Frames of a sensor are numbered consecutively from 0 since the
+    sensor was created, so consumers can detect lost messages.
+
+    Args:
+        sensor_id (int): Identifier of the sensor.
+        seq (int): Sequence number of the first frame.
+        reading_times (numpy.ndarray): Timestamps of the frames.
+        frames (numpy.ndarray): Frames as an array of shape (count, 64).
+
+    Returns:
+        bytes: The encoded payload.
+    """
+    return b"".join((
+        STREAM_HEADER.pack(sensor_id, seq, len(reading_times)),
+        np.ascontiguousarray(reading_times, dtype=WIRE_TIME_DTYPE).tobytes(),
+        np.ascontiguousarray(frames, dtype=WIRE_FRAME_DTYPE).tobytes(),
+    ))
+
+
+def message_size(count):
+    """
+    Get the size of a live frame message.
+
+    Args:
+        count (int): Number of frames in the message.
+
+    Returns:
+        int: Size of the payload in bytes.
+    """
+    return STREAM_HEADER.size + count * (WIRE_TIME_DTYPE.itemsize + FRAME_PIXELS * WIRE_FRAME_DTYPE.itemsize)
+
+
+def decode_frames(payload):
+    """
+    Decode a live frame message, for consumers of ``sensors.<id>.frames``.
+
+    Args:
+        payload (bytes): The message payload.
+
+    Returns:
+        dict: ``sensor_id``, ``seq`` (sequence number of the first frame), ``reading_time`` (numpy array)
+        and ``data`` (numpy array of shape (count, 64)). The arrays are views of the payload, in the
+        native types on little-endian hosts.
+    """
+    sensor_id, seq, count = STREAM_HEADER.unpack_from(payload)
+    body = memoryview(payload)[STREAM_HEADER.size:]
+    reading_times = np.frombuffer(body, dtype=WIRE_TIME_DTYPE, count=count)
+    frames = np.frombuffer(
+        body, dtype=WIRE_FRAME_DTYPE, count=count * FRAME_PIXELS, offset=count * WIRE_TIME_DTYPE.itemsize
+    ).reshape(count, FRAME_PIXELS)
+    return {"sensor_id": sensor_id, "seq": seq, "reading_time": reading_times, "data": frames}
+
+
+def check_batching(batch_size, linger, max_payload=None):
+    """
+    Check the batching settings of a ``FramePublisher``.
+
+    Args:
+        batch_size (int): Maximum number of frames per message.
+        linger (float): Maximum time in seconds a frame waits for its batch to fill.
+        max_payload (int, optional): Largest payload in bytes accepted by the broker. Defaults to None (not checked).
+
+    Raises:
+        ValueError: If the batch size is below 1, above ``MAX_BATCH_FRAMES`` or makes messages larger than
+            ``max_payload``, or if the linger time is negative.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    if batch_size > MAX_BATCH_FRAMES:
+        raise ValueError(f"batch_size must be at most {MAX_BATCH_FRAMES}")
+    if max_payload is not None and message_size(batch_size) > max_payload:
+        raise ValueError(f"batch_size {batch_size} makes messages of {message_size(batch_size)} bytes, "
+                         f"larger than the {max_payload} bytes accepted by the broker")
+    if linger < 0:
+        raise ValueError("linger must not be negative")
+
+
+class FramePublisher:
+    """
+    Publishes the frames of a sensor as they are captured, in micro-batches.
+
+    Frames are copied into a preallocated batch, which is published as one
+    message once it holds ``batch_size`` frames or once its first frame has
+    waited ``linger`` seconds, whichever comes first. With a batch size of 1
+    every frame is published immediately.
+    """
+
+    def __init__(self, publish, sensor_id, batch_size=1, linger=0.005, max_payload=None):
+        """
+        Initialize FramePublisher object.
+
+        Args:
+            publish (callable): Coroutine function taking a subject and a payload, such as ``NATSClient.publish``.
+            sensor_id (int): Identifier of the sensor.
+            batch_size (int, optional): Maximum number of frames per message. Defaults to 1.
+            linger (float, optional): Maximum time in seconds a frame waits for its batch to fill. Defaults to 0.005.
+            max_payload (int, optional): Largest payload in bytes accepted by the broker. Defaults to None (not checked).
+
+        Raises:
+            ValueError: If a batching setting is out of range, see ``check_batching()``.
+        """
+        check_batching(batch_size, linger, max_payload)
+        self.publish = publish
+        self.max_payload = max_payload
+        self.sensor_id = sensor_id
+        self.subject = STREAM_SUBJECT.format(sensor_id)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.reading_times = np.empty(batch_size, dtype=np.float64)
+        self.frames = np.empty((batch_size, FRAME_PIXELS), dtype=FRAME_DTYPE)
+        self.count = 0
+        self.next_seq = 0
+        self.timer = None
+        self.linger_task = None
+        self.frames_published = 0
+        self.messages_published = 0
+        self.messages_failed = 0
+
+    async def add(self, reading_time, frame):
+        """
+        Add a frame to the current batch, publishing the batch if it is full.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray or bytes-like): The 64 frame values.
+        """
+        self.reading_times[self.count] = reading_time
+        self.frames[self.count] = frame
+        self.count += 1
+        if self.count >= self.batch_size:
+            await self.flush()
+        elif self.count == 1:
+            # Publish the partial batch if it does not fill up in time
+            self.timer = asyncio.get_running_loop().call_later(self.linger, self._linger_expired)
+
+    def _linger_expired(self):
+        """
+        Publish the partial batch whose first frame waited ``linger`` seconds.
+        """
+        self.timer = None
+        self.linger_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """
+        Publish the frames of the current batch, if any.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.count:
+            return
+        count, seq = self.count, self.next_seq
+        payload = encode_frames(self.sensor_id, seq, self.reading_times[:count], self.frames[:count])
+        # The batch is encoded, so the next frames can be added while publishing
+        self.count = 0
+        self.next_seq += count
+        await self.send(seq, count, payload)
+
+    async def send(self, seq, count, payload):
+        """
+        Publish an encoded batch.
+
+        Args:
+            seq (int): Sequence number of the first frame of the batch.
+            count (int): Number of frames in the batch.
+            payload (bytes): The encoded batch.
+        """
+        try:
+            await self.publish(self.subject, payload)
+        except Exception as e:
+            self.messages_failed += 1
+            logger.warning("Error publishing frames of sensor %s: %s", self.sensor_id, e)
+            return
+        self.frames_published += count
+        self.messages_published += 1
+
+    async def reconfigure(self, batch_size, linger):
+        """
+        Change the batching settings, publishing the current batch first.
+
+        Frames already added keep their order and sequence numbers.
+
+        Args:
+            batch_size (int): Maximum number of frames per message.
+            linger (float): Maximum time in seconds a frame waits for its batch to fill.
+        """
+        check_batching(batch_size, linger, self.max_payload)
+        await self.flush()
+        if batch_size != self.batch_size:
+            self.reading_times = np.empty(batch_size, dtype=np.float64)
+            self.frames = np.empty((batch_size, FRAME_PIXELS), dtype=FRAME_DTYPE)
+            self.batch_size = batch_size
+        self.linger = linger
+
+    def stats(self):
+        """
+        Get the publisher counters.
+
+        Returns:
+            dict: Frames and messages published, and messages that failed to publish.
+        """
+        return {
+            "frames_published": self.frames_published,
+            "messages_published": self.messages_published,
+            "messages_failed": self.messages_failed,
+        }
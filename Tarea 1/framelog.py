@@ -0,0 +1,338 @@
+import bisect
+import logging
+import os
+import struct
+import threading
+import time
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+logger = logging.getLogger(__name__)
+
+# Layout of a record: the reading time, the scheduled time (NaN when unknown) and the frame
+RECORD_DTYPE = np.dtype([
+    ("reading_time", "<f8"),
+    ("scheduled_time", "<f8"),
+    ("data", FRAME_DTYPE, (FRAME_PIXELS,)),
+])
+
+# Fixed part of a record, written with struct in front of the frame bytes
+RECORD_TIMES = struct.Struct("<dd")
+
+# Record count of a segment, stored in its header
+HEADER_COUNT = struct.Struct("<Q")
+
+# Layout of the header at the start of every segment file, padded to 64 bytes
+HEADER_DTYPE = np.dtype({
+    "names": ["magic", "version", "record_size", "capacity", "first_seq", "count", "created"],
+    "formats": ["S8", "<u4", "<u4", "<u8", "<u8", "<u8", "<f8"],
+    "offsets": [0, 8, 12, 16, 24, 32, 40],
+    "itemsize": 64,
+})
+
+# Identifies segment files
+MAGIC = b"FRAMELOG"
+
+# Version of the segment file layout
+VERSION = 1
+
+# Extension of segment files
+SEGMENT_SUFFIX = ".seg"
+
+
+class Segment:
+    """
+    One preallocated, memory-mapped segment file of the frame log of a sensor.
+
+    The file holds a header followed by room for ``capacity`` fixed-width
+    records. The records written so far are exposed as a NumPy structured
+    array over the mapped file, so reading them copies nothing.
+    """
+
+    def __init__(self, path, capacity=None, first_seq=0):
+        """
+        Open a segment file, creating it if ``capacity`` is given.
+
+        Args:
+            path (str): Path of the segment file.
+            capacity (int, optional): Number of records of a new segment. Defaults to None (open an existing segment).
+            first_seq (int, optional): Sequence number of the first record of a new segment. Defaults to 0.
+
+        Raises:
+            ValueError: If an existing file is not a segment of this version.
+        """
+        self.path = path
+        if capacity is not None:
+            # Preallocate the whole file, so that appending never grows it
+            with open(path, "wb") as f:
+                f.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+            self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+            self.header[0] = (MAGIC, VERSION, RECORD_DTYPE.itemsize, capacity, first_seq, 0, time.time())
+        else:
+            self.header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+            if self.header["magic"][0] != MAGIC or self.header["version"][0] != VERSION:
+                raise ValueError(f"{path} is not a frame log segment")
+            if self.header["record_size"][0] != RECORD_DTYPE.itemsize:
+                raise ValueError(f"{path} has records of {self.header['record_size'][0]} bytes, expected {RECORD_DTYPE.itemsize}")
+        self.capacity = int(self.header["capacity"][0])
+        self.first_seq = int(self.header["first_seq"][0])
+        self.count = int(self.header["count"][0])
+        self.created = float(self.header["created"][0])
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode="r+", offset=HEADER_DTYPE.itemsize, shape=(self.capacity,))
+        # Byte views of the file, much cheaper to write a record into than the structured arrays
+        self.buffer = memoryview(self.records.view(np.uint8).reshape(-1))
+        self.header_buffer = memoryview(self.header.view(np.uint8).reshape(-1))
+
+    def is_full(self):
+        """
+        Check whether the segment has no room left.
+        """
+        return self.count >= self.capacity
+
+    def append(self, reading_time, data, scheduled_time):
+        """
+        Write a record after the last one.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes-like): The 64 ``uint16`` frame values.
+            scheduled_time (float): Time the reading was scheduled for, or NaN.
+
+        Returns:
+            int: Sequence number of the record.
+        """
+        offset = self.count * RECORD_DTYPE.itemsize
+        RECORD_TIMES.pack_into(self.buffer, offset, reading_time, scheduled_time)
+        self.buffer[offset + RECORD_TIMES.size:offset + RECORD_DTYPE.itemsize] = memoryview(data).cast("B")
+        # The count is updated last, so a record is only visible once it is complete
+        self.count += 1
+        HEADER_COUNT.pack_into(self.header_buffer, HEADER_DTYPE.fields["count"][1], self.count)
+        return self.first_seq + self.count - 1
+
+    def view(self, start=0, stop=None):
+        """
+        Get a zero-copy view of written records.
+
+        Args:
+            start (int, optional): Index of the first record in the segment. Defaults to 0.
+            stop (int, optional): Index after the last record. Defaults to the number of written records.
+
+        Returns:
+            numpy.ndarray: Structured array of ``RECORD_DTYPE`` over the mapped file.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        return self.records[start:stop]
+
+    def flush(self):
+        """
+        Write the mapped pages back to the file.
+        """
+        self.records.flush()
+        self.header.flush()
+
+
+class SensorLog:
+    """
+    Append-only sequence of the records of one sensor, split in segments.
+
+    Records are numbered from 0 in the order they are appended. A new segment
+    is started when the current one is full, or when it was started more than
+    ``segment_seconds`` ago. Reading times are expected to increase, which is
+    what makes binary search by time possible.
+    """
+
+    def __init__(self, path, segment_records, segment_seconds=None):
+        """
+        Initialize SensorLog object, opening the segments found in its directory.
+
+        Args:
+            path (str): Directory of the segment files of the sensor, created if needed.
+            segment_records (int): Number of records of every new segment.
+            segment_seconds (float, optional): Maximum age in seconds of the segment written to. Defaults to None (roll by size only).
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_records = segment_records
+        self.segment_seconds = segment_seconds
+        names = sorted(name for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+        self.segments = [Segment(os.path.join(path, name)) for name in names]
+        self.first_seqs = [segment.first_seq for segment in self.segments]
+
+    def __len__(self):
+        """
+        Get the number of records of the sensor.
+        """
+        return self.segments[-1].first_seq + self.segments[-1].count if self.segments else 0
+
+    def _roll(self):
+        """
+        Start a new segment after the last one.
+        """
+        if self.segments:
+            self.segments[-1].flush()
+        first_seq = len(self)
+        segment = Segment(os.path.join(self.path, f"{first_seq:020d}{SEGMENT_SUFFIX}"), self.segment_records, first_seq)
+        self.segments.append(segment)
+        self.first_seqs.append(first_seq)
+        logger.debug("Started frame log segment %s", segment.path)
+        return segment
+
+    def append(self, reading_time, data, scheduled_time):
+        """
+        Append a record.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes-like): The 64 ``uint16`` frame values.
+            scheduled_time (float): Time the reading was scheduled for, or NaN.
+
+        Returns:
+            int: Sequence number of the record.
+        """
+        segment = self.segments[-1] if self.segments else None
+        if segment is None or segment.is_full() or (
+                self.segment_seconds and segment.count and time.time() - segment.created >= self.segment_seconds):
+            segment = self._roll()
+        return segment.append(reading_time, data, scheduled_time)
+
+    def get(self, seq):
+        """
+        Get a record by sequence number.
+
+        Args:
+            seq (int): Sequence number of the record.
+
+        Returns:
+            numpy.void: The record, a view of the mapped file.
+
+        Raises:
+            IndexError: If no record has that sequence number.
+        """
+        if seq < 0 or seq >= len(self):
+            raise IndexError(f"No record with sequence number {seq}")
+        segment = self.segments[bisect.bisect_right(self.first_seqs, seq) - 1]
+        return segment.records[seq - segment.first_seq]
+
+    def search(self, timestamp):
+        """
+        Find the first record read at or after a time.
+
+        Args:
+            timestamp (float): Unix timestamp.
+
+        Returns:
+            int: Sequence number of the first record with a reading time not before ``timestamp``, or ``len(self)`` if there is none.
+        """
+        segments = list(self.segments)
+        # First segment whose last record is not before the time, then the record within it
+        index = bisect.bisect_left(segments, timestamp, key=lambda segment: segment.view()["reading_time"][-1] if segment.count else np.inf)
+        if index == len(segments):
+            return len(self)
+        segment = segments[index]
+        return segment.first_seq + int(np.searchsorted(segment.view()["reading_time"], timestamp, side="left"))
+
+    def iter_range(self, start_time, end_time, page_size):
+        """
+        Iterate over the records read in a time range.
+
+        Args:
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+            page_size (int): Maximum number of records per page.
+
+        Yields:
+            numpy.ndarray: Zero-copy structured arrays of ``RECORD_DTYPE``, oldest first.
+        """
+        seq = self.search(start_time)
+        index = max(bisect.bisect_right(self.first_seqs, seq) - 1, 0)
+        for segment in self.segments[index:]:
+            records = segment.view(max(seq - segment.first_seq, 0))
+            # Only the records before the end of the range
+            stop = int(np.searchsorted(records["reading_time"], end_time, side="left"))
+            for i in range(0, stop, page_size):
+                yield records[i:min(i + page_size, stop)]
+            if stop < len(records):
+                return
+
+    def flush(self):
+        """
+        Write the segment being written back to its file.
+        """
+        if self.segments:
+            self.segments[-1].flush()
+
+
+class FrameLog:
+    """
+    Memory-mapped, append-only log of fixed-width frame records.
+
+    Every sensor gets its own directory of preallocated segment files, each
+    holding a 64-byte header and a flat array of 144-byte records (reading
+    time, scheduled time and the 64 ``uint16`` values). Appending a frame is a
+    copy into the mapped file, with no B-tree and no transaction, and scans
+    return NumPy views of the mapped pages.
+
+    Writes go to the page cache immediately and reach the disk when the
+    operating system writes the pages back, or on ``flush()``.
+    """
+
+    def __init__(self, path, segment_bytes=64 * 1024 * 1024, segment_seconds=None):
+        """
+        Initialize FrameLog object.
+
+        Args:
+            path (str): Directory of the frame log, created if needed.
+            segment_bytes (int, optional): Size in bytes of every segment file. Defaults to 64 MiB.
+            segment_seconds (float, optional): Maximum age in seconds of the segment written to. Defaults to None (roll by size only).
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_records = max(1, (segment_bytes - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize)
+        self.segment_seconds = segment_seconds
+        self.sensors = {}
+        self.lock = threading.Lock()
+
+    def sensor(self, sensor_id):
+        """
+        Get the log of a sensor, opening or creating it on first use.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            SensorLog: The log of the sensor.
+        """
+        log = self.sensors.get(sensor_id)
+        if log is None:
+            # Readers on other threads may open the same sensor at the same time
+            with self.lock:
+                log = self.sensors.get(sensor_id)
+                if log is None:
+                    log = self.sensors[sensor_id] = SensorLog(
+                        os.path.join(self.path, f"sensor_{sensor_id}"),
+                        self.segment_records,
+                        self.segment_seconds
+                    )
+        return log
+
+    def append(self, sensor_id, reading_time, data, scheduled_time=None):
+        """
+        Append a frame to the log of a sensor.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            reading_time (float): Time of the reading as a Unix timestamp.
+            data (bytes-like): The 64 ``uint16`` frame values.
+            scheduled_time (float, optional): Time the reading was scheduled for. Defaults to None.
+
+        Returns:
+            int: Sequence number of the frame in the log of its sensor.
+        """
+        return self.sensor(sensor_id).append(reading_time, data, np.nan if scheduled_time is None else scheduled_time)
+
+    def flush(self):
+        """
+        Write the segments being written back to their files.
+        """
+        for log in self.sensors.values():
+            log.flush()
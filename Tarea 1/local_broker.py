@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import random
+
+logger = logging.getLogger(__name__)
+
+# Largest payload accepted by the broker, in bytes
+MAX_PAYLOAD = 8 * 1024 * 1024
+
+
+def subject_matches(pattern, subject):
+    """
+    Check whether a subject matches a subscription subject.
+
+    Args:
+        pattern (list of str): Tokens of the subscription subject, where ``*`` matches one token and ``>`` the rest.
+        subject (list of str): Tokens of the published subject.
+
+    Returns:
+        bool: True if the subject matches.
+    """
+    for index, token in enumerate(pattern):
+        if token == ">":
+            return len(subject) > index
+        if index >= len(subject) or (token != "*" and token != subject[index]):
+            return False
+    return len(pattern) == len(subject)
+
+
+class LocalBroker:
+    """
+    Minimal in-process NATS server, for tests and benchmarks that must run offline.
+
+    It speaks the subset of the NATS client protocol used by this application
+    (``CONNECT``, ``PING``/``PONG``, ``SUB`` with wildcards and queue groups,
+    ``UNSUB`` and ``PUB`` with reply subjects, so request/reply works), which
+    is enough for ``nats.connect()`` to use it in place of a real server. It
+    has no authentication, clustering, headers or JetStream.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """
+        Initialize LocalBroker object.
+
+        Args:
+            host (str, optional): Address to listen on. Defaults to 127.0.0.1.
+            port (int, optional): Port to listen on, 0 for any free port. Defaults to 0.
+        """
+        self.host = host
+        self.port = port
+        self.server = None
+        self.clients = {}
+        self.handlers = set()
+        self.next_client_id = 1
+        self.messages_routed = 0
+
+    @property
+    def url(self):
+        """
+        Get the URL clients connect to.
+        """
+        return f"nats://{self.host}:{self.port}"
+
+    async def start(self):
+        """
+        Start listening for clients.
+
+        Returns:
+            LocalBroker: The broker itself, with ``port`` set to the actual port.
+        """
+        self.server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Local broker listening on %s", self.url)
+        return self
+
+    async def stop(self):
+        """
+        Disconnect every client and stop listening.
+        """
+        if self.server is None:
+            return
+        self.server.close()
+        for writer, _ in list(self.clients.values()):
+            writer.close()
+        # Let the connection handlers see the end of their connection and exit
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+        self.server = None
+
+    async def _handle_client(self, reader, writer):
+        """
+        Serve one client connection until it disconnects.
+
+        Args:
+            reader (asyncio.StreamReader): The connection reader.
+            writer (asyncio.StreamWriter): The connection writer.
+        """
+        client_id = self.next_client_id
+        self.next_client_id += 1
+        handler = asyncio.current_task()
+        self.handlers.add(handler)
+        subscriptions = {}
+        self.clients[client_id] = (writer, subscriptions)
+        info = {
+            "server_id": "local-broker",
+            "server_name": "local-broker",
+            "version": "2.10.0",
+            "proto": 1,
+            "host": self.host,
+            "port": self.port,
+            "max_payload": MAX_PAYLOAD,
+            "client_id": client_id,
+        }
+        writer.write(b"INFO " + json.dumps(info).encode() + b"\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                op, _, args = line.strip().decode().partition(" ")
+                op = op.upper()
+                args = args.split()
+                if op == "PUB":
+                    # PUB <subject> [reply] <size>, followed by the payload
+                    payload = await reader.readexactly(int(args[-1]) + 2)
+                    self._route(args[0], args[1] if len(args) == 3 else None, payload[:-2])
+                elif op == "SUB":
+                    # SUB <subject> [queue group] <sid>
+                    subscriptions[args[-1]] = (args[0].split("."), args[1] if len(args) == 3 else None)
+                elif op == "UNSUB":
+                    subscriptions.pop(args[0], None)
+                elif op == "PING":
+                    writer.write(b"PONG\r\n")
+                elif op in ("CONNECT", "PONG", ""):
+                    pass
+                else:
+                    writer.write(b"-ERR 'Unknown Protocol Operation'\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.clients[client_id]
+            self.handlers.discard(handler)
+            writer.close()
+
+    def _route(self, subject, reply, payload):
+        """
+        Deliver a published message to every matching subscription.
+
+        Members of a queue group share the messages: each message goes to one
+        of them, picked at random.
+
+        Args:
+            subject (str): The published subject.
+            reply (str): The reply subject, or None.
+            payload (bytes): The message payload.
+        """
+        tokens = subject.split(".")
+        groups = {}
+        for writer, subscriptions in self.clients.values():
+            for sid, (pattern, group) in subscriptions.items():
+                if not subject_matches(pattern, tokens):
+                    continue
+                if group is None:
+                    self._send(writer, subject, sid, reply, payload)
+                else:
+                    groups.setdefault(group, []).append((writer, sid))
+        for members in groups.values():
+            writer, sid = random.choice(members)
+            self._send(writer, subject, sid, reply, payload)
+
+    def _send(self, writer, subject, sid, reply, payload):
+        """
+        Write a ``MSG`` to a client.
+
+        Args:
+            writer (asyncio.StreamWriter): The client connection.
+            subject (str): The published subject.
+            sid (str): Identifier of the matching subscription.
+            reply (str): The reply subject, or None.
+            payload (bytes): The message payload.
+        """
+        header = f"MSG {subject} {sid} {reply} {len(payload)}\r\n" if reply else f"MSG {subject} {sid} {len(payload)}\r\n"
+        writer.write(header.encode() + payload + b"\r\n")
+        self.messages_routed += 1
@@ -0,0 +1,113 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Format of every log line
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Names accepted for the log level
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+# Listener writing the queued records, while logging is configured
+_listener = None
+
+# How often sampled hot-path messages are emitted, see LogSampler
+_sample_every = 1
+
+
+def configure_logging(level="INFO", log_file="app.log", max_bytes=10 * 1024 * 1024, backup_count=5, sample_every=1):
+    """
+    Configure the logging of the whole application.
+
+    Every logger propagates to the root logger, whose only handler puts the
+    records on an in-memory queue. A ``QueueListener`` thread takes them off
+    the queue and does the formatting and the writing, to a rotating log file
+    and to the console (INFO and above), so the event loop never waits on a
+    disk write. Calling it again replaces the previous configuration.
+
+    Args:
+        level (str or int, optional): Minimum level of the records logged. Defaults to INFO.
+        log_file (str, optional): Path of the log file, or None to only log to the console. Defaults to ``app.log``.
+        max_bytes (int, optional): Size in bytes at which the log file is rotated, 0 to never rotate. Defaults to 10 MiB.
+        backup_count (int, optional): Number of rotated log files kept. Defaults to 5.
+        sample_every (int, optional): Emit only one in this many sampled hot-path messages. Defaults to 1.
+
+    Returns:
+        logging.handlers.QueueListener: The started listener.
+    """
+    global _listener, _sample_every
+    stop_logging()
+
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    # Handlers run on the listener thread
+    handlers = []
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(max(level, logging.INFO))
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
+
+    # The root logger only enqueues; disabled levels are dropped before any record is built
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(queue.SimpleQueue()))
+    _listener = QueueListener(root.handlers[-1].queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _sample_every = max(1, sample_every)
+    return _listener
+
+
+def stop_logging():
+    """
+    Write the queued records and remove the handlers set up by ``configure_logging()``.
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler) and handler.queue is _listener.queue:
+            root.removeHandler(handler)
+    # Stopping the listener processes the records still in the queue
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+class LogSampler:
+    """
+    Lets through one in every ``every`` calls, to sample per-frame log messages.
+
+    Use it behind a level check so that disabled levels only cost the check::
+
+        if logger.isEnabledFor(logging.DEBUG) and sampler.due():
+            logger.debug(...)
+    """
+
+    def __init__(self, every=None):
+        """
+        Initialize LogSampler object.
+
+        Args:
+            every (int, optional): Sampling period. Defaults to the one given to ``configure_logging()``.
+        """
+        self.every = max(1, every if every is not None else _sample_every)
+        self.calls = 0
+
+    def due(self):
+        """
+        Count a call.
+
+        Returns:
+            bool: True for the first call and then once every ``every`` calls.
+        """
+        due = self.calls % self.every == 0
+        self.calls += 1
+        return due
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+# Default time in seconds between two wake-ups of the lag probe
+DEFAULT_INTERVAL = 0.1
+
+# Default time in seconds the loop may be held before its stack is logged, in debug mode
+DEFAULT_BLOCK_THRESHOLD = 0.1
+
+
+class LoopMonitor:
+    """
+    Health monitor of the asyncio event loop.
+
+    A probe task sleeps for ``interval`` seconds again and again, and records
+    how late the loop wakes it up in a latency histogram: the scheduling delay
+    every other callback and coroutine step of the loop suffers too. A wake-up
+    later than ``block_threshold`` counts as a stall.
+
+    With a ``block_threshold``, a watchdog thread also checks the last wake-up
+    of the probe. When the loop is overdue by more than the threshold, some
+    callback or coroutine step is holding it right now (a synchronous SQLite
+    call, a file write, a CPU-bound loop...), so the watchdog captures the
+    stack of the loop thread and logs it, once per stall, while the culprit is
+    still running.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, block_threshold=None):
+        """
+        Initialize LoopMonitor object.
+
+        Args:
+            interval (float, optional): Time in seconds between two wake-ups of the probe. Defaults to 0.1.
+            block_threshold (float, optional): Time in seconds the loop may be held before its stack is
+                logged. Defaults to None (stalls are counted, but no stack is captured).
+
+        Raises:
+            ValueError: If a setting is out of range.
+        """
+        if interval <= 0:
+            raise ValueError("interval must be greater than 0")
+        if block_threshold is not None and block_threshold <= 0:
+            raise ValueError("block_threshold must be greater than 0")
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.lag = LatencyHistogram()
+        self.stalls = 0
+        self.longest_stall = 0.0
+        self.stacks_captured = 0
+        self.last_stack = None
+        self.beat = None
+        self.task = None
+        self.thread = None
+        self.thread_id = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        """
+        Start the probe on the running loop, and the watchdog thread if there is a ``block_threshold``.
+        """
+        self.thread_id = threading.get_ident()
+        self.beat = time.monotonic()
+        self.stopping.clear()
+        self.task = asyncio.create_task(self._probe())
+        if self.block_threshold is not None:
+            self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self.thread.start()
+
+    async def stop(self):
+        """
+        Stop the probe and the watchdog thread.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+
+    async def _probe(self):
+        """
+        Measure how late the loop wakes up a sleeping task, until cancelled.
+        """
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            # Published before the statistics, so the watchdog never sees a stale wake-up
+            self.beat = now
+            lag = max(now - expected, 0.0)
+            self.lag.record(lag)
+            if self.block_threshold is not None and lag > self.block_threshold:
+                self.stalls += 1
+                self.longest_stall = max(self.longest_stall, lag)
+
+    def _watch(self):
+        """
+        Log the stack of the loop thread whenever the probe is overdue by more than ``block_threshold``.
+
+        Runs on the watchdog thread, until ``stop()``.
+        """
+        reported = None
+        while not self.stopping.wait(self.block_threshold / 2):
+            beat = self.beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue <= self.block_threshold or beat == reported:
+                continue
+            # One report per stall: the probe moves the beat on once the loop is free again
+            reported = beat
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.last_stack = "".join(traceback.format_stack(frame))
+            self.stacks_captured += 1
+            logger.warning("Event loop held for more than %.3fs, by:\n%s", overdue, self.last_stack)
+
+    def stats(self):
+        """
+        Get the loop health statistics.
+
+        Returns:
+            dict: ``lag``: histogram snapshot of the wake-up delays of the probe, the number of ``stalls``
+            above the block threshold, the ``longest_stall`` in seconds, the number of ``stacks_captured``
+            and the ``last_stack`` captured, or None.
+        """
+        return {
+            "lag": self.lag.snapshot(),
+            "stalls": self.stalls,
+            "longest_stall": self.longest_stall,
+            "stacks_captured": self.stacks_captured,
+            "last_stack": self.last_stack,
+        }
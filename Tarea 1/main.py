@@ -1,30 +1,25 @@
 import logging
-from logging.handlers import RotatingFileHandler
 import asyncio
+import logging_setup
 import nats_client_dev
 import database
 import data_capture_module
+import frame_generator
+import anomaly
+import deadband
+import frame_stream
+import collector
+import loop_monitor
+import sensor_application
+import sharding
 import cli
+from partitions import PartitionScheme
 import sys
 import os
+import shutil
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
 
 # Enable debug mode
 DEBUG = True
@@ -34,18 +29,102 @@ async def main():
     Main function to initialize database connection, NATS client, subscribe to NATS
     messages and start the event loop.
     """
+    # Parse command-line arguments
+    args = cli.parse_args(sys.argv[1:])
+
+    # Log from a background thread, so that logging never blocks the event loop
+    logging_setup.configure_logging(
+        args.log_level,
+        args.log_file,
+        max_bytes=args.log_max_bytes,
+        backup_count=args.log_backup_count,
+        sample_every=args.log_sample_every
+    )
+    try:
+        await run(args)
+    finally:
+        # Write any queued log records before exiting
+        logging_setup.stop_logging()
+
+async def run(args):
+    """
+    Run the application with the parsed command-line arguments.
+
+    Args:
+        args (argparse.Namespace): The parsed command-line arguments.
+    """
     logger.debug("Running main function")
     logger.debug("DEBUG mode is enabled")
 
-    # Parse and print command-line arguments
-    args = cli.parse_args(sys.argv[1:])
-    
+    # Print command-line arguments
     args_dict = {key: value for key, value in vars(args).items()}
     logger.debug('==== Arguments ====')
     for key, value in args_dict.items():
         logger.debug(f"{key:<20} {value}")
     logger.debug('===================')
 
+    # Validate the mockup value range before touching the database
+    if args.sensor_type == 'mockup':
+        try:
+            frame_generator.MockupFrameGenerator(args.min_value, args.max_value)
+        except ValueError as e:
+            logger.error(f"Invalid mockup sensor arguments: {e}")
+            return
+
+    # Validate the anomaly detection settings shared by every sensor
+    if args.anomaly_threshold is not None or args.anomaly_hot_value is not None:
+        try:
+            anomaly.check_detection(args.anomaly_threshold, args.anomaly_alpha, args.anomaly_hot_value, args.anomaly_cooldown)
+        except ValueError as e:
+            logger.error(f"Invalid anomaly detection arguments: {e}")
+            return
+
+    # Validate the name of the capture node before connecting anything
+    if args.node_id is not None:
+        try:
+            collector.check_node_id(args.node_id)
+        except ValueError as e:
+            logger.error(f"Invalid collector arguments: {e}")
+            return
+
+    # Validate the storage settings, which the frame log does not all support
+    try:
+        database.check_database_options(args.db_uri, **cli.database_options(args))
+    except ValueError as e:
+        logger.error(f"Invalid storage arguments: {e}")
+        return
+
+    # Validate the database writer settings before the old database is removed
+    try:
+        database.check_writer_options(**cli.writer_options(args))
+    except ValueError as e:
+        logger.error(f"Invalid writer arguments: {e}")
+        return
+
+    # Validate the deadband settings shared by every sensor
+    if args.deadband is not None:
+        try:
+            deadband.check_deadband(args.deadband, args.heartbeat or None)
+        except ValueError as e:
+            logger.error(f"Invalid deadband arguments: {e}")
+            return
+
+    # Validate the live streaming batching shared by every sensor
+    if args.stream:
+        try:
+            frame_stream.check_batching(args.stream_batch_size, args.stream_linger)
+        except ValueError as e:
+            logger.error(f"Invalid live streaming arguments: {e}")
+            return
+
+    # Validate the event loop monitor settings
+    if args.loop_monitor_interval:
+        try:
+            loop_monitor.LoopMonitor(**cli.loop_monitor_options(args))
+        except ValueError as e:
+            logger.error(f"Invalid loop monitor arguments: {e}")
+            return
+
     if DEBUG:
         logger.info('Running in debug mode')
         logger.info('=====================')
@@ -53,50 +132,153 @@ async def main():
 
         logger.debug("Removing old database...")
         try:
-            path_to_database = args.db_uri
-            if os.path.exists(path_to_database):
-                os.remove(path_to_database)
-                logger.info("Removed old database")
-            else:
-                logger.info("No old database found")
+            # Worker processes keep one database each
+            databases = [args.db_uri] + [sharding.shard_path(args.db_uri, shard) for shard in range(args.workers)]
+            for path_to_database in databases:
+                if path_to_database.startswith(database.FRAMELOG_SCHEME):
+                    path_to_database = path_to_database[len(database.FRAMELOG_SCHEME):]
+                if os.path.isdir(path_to_database):
+                    shutil.rmtree(path_to_database)
+                    logger.info("Removed old database %s", path_to_database)
+                elif os.path.exists(path_to_database):
+                    os.remove(path_to_database)
+                    logger.info("Removed old database %s", path_to_database)
+                else:
+                    logger.info("No old database found at %s", path_to_database)
+                if args.partition != 'none':
+                    partitions = PartitionScheme(path_to_database, args.partition)
+                    for key in partitions.existing():
+                        partitions.drop(key)
+                        logger.info("Removed old partition %s", partitions.path(key))
         except Exception as e:
             logger.error(f"Error removing old database: {e}")
 
         logger.debug("Housekeeping tasks complete")
 
 
+    # Report the callbacks holding the event loop in debug mode
+    if DEBUG and args.block_threshold is None:
+        args.block_threshold = loop_monitor.DEFAULT_BLOCK_THRESHOLD
+
+    # Shard the sensors across worker processes, each with its own database
+    if args.workers:
+        logger.debug("Starting %d worker processes", args.workers)
+        await sharding.run_coordinator(args)
+        return
+
+    # Store the readings forwarded by the capture nodes instead of capturing
+    if args.collector:
+        logger.debug("Starting collector")
+        await collector.run_collector(args)
+        return
+
     # Initialize database connection
-    db = database.DatabaseManager(args.db_uri)
+    db = database.open_database(args.db_uri, **cli.database_options(args))
     logger.debug("Initializing database connection")
     db.connect()
+    db.start_writer(**cli.writer_options(args))
+
+    app = sensor_application.SensorApplication(db, cli.sensor_options(args))
+
+    # Measure the scheduling delay of the event loop, shared by every sensor
+    if args.loop_monitor_interval:
+        app.loop_monitor = loop_monitor.LoopMonitor(**cli.loop_monitor_options(args))
+        app.loop_monitor.start()
 
     # Initialize NATS client
     exit_event = asyncio.Event()
 
-    nats_client = nats_client_dev.NATSClient("nats://localhost:4222", db, args, exit_event)
+    nats_client = nats_client_dev.NATSClient("nats://localhost:4222", db, args, exit_event, app)
+    app.sensor_defaults["publish_alerts"] = nats_client.publish
+
+    # Publish the readings of every sensor live through the NATS client
+    if args.stream:
+        app.sensor_defaults.update(
+            publish=nats_client.publish,
+            stream_batch_size=args.stream_batch_size,
+            stream_linger=args.stream_linger
+        )
 
+    # Forward the readings of every sensor to the collector, until it acknowledges them
+    link = None
+    if args.node_id is not None:
+        link = collector.CollectorLink(
+            nats_client.publish,
+            args.node_id,
+            batch_size=args.forward_batch_size,
+            linger=args.forward_linger,
+            ack_timeout=args.ack_timeout,
+            max_unacked=args.max_unacked
+        )
+        app.sensor_defaults["forward"] = link
+
+    error = None
     try:
         # Connect to NATS server
         logger.debug("Connecting to NATS server")
         await nats_client.connect()
     except Exception as e:
         # Log  any errors connecting to the NATS server
-        logger.error(f"Error connecting to NATS server: {e}")
+        error = f"Error connecting to NATS server: {e}"
+    else:
+        # Live messages must fit in the largest payload the server accepts
+        if args.stream:
+            app.sensor_defaults["stream_max_payload"] = nats_client.nc.max_payload
+            try:
+                frame_stream.check_batching(args.stream_batch_size, args.stream_linger, nats_client.nc.max_payload)
+            except ValueError as e:
+                error = f"Invalid live streaming arguments: {e}"
+    if error is not None:
+        logger.error(error)
         # Close the database connection and exit the program
         logger.debug("Closing database connection")
         await nats_client.close()
+        if app.loop_monitor is not None:
+            await app.loop_monitor.stop()
+        db.close()
         return
 
+    # Register the sensors described in the configuration file, once the payload limit of the server is known
+    if args.sensors_config:
+        logger.debug("Loading sensors configuration")
+        app.load_config(args.sensors_config)
+
     # Subscribe to NATS messages for starting and stopping capture
     logger.debug("Subscribing to NATS messages")
     await nats_client.subscribe("test.*", cb=nats_client.message_handler)
+    await nats_client.subscribe_sensors()
+    await nats_client.subscribe("sensors.query", cb=nats_client.query_handler)
+    resend_task = None
+    if link is not None:
+        await nats_client.subscribe(link.ack_subject, cb=link.ack_handler)
+        resend_task = asyncio.create_task(link.resend_loop())
+
+    # Start the sensors configured to capture from the beginning
+    await app.start_application()
+
+    # Publish the metrics of the running sensors periodically
+    metrics_task = None
+    if args.metrics_interval > 0:
+        metrics_task = asyncio.create_task(nats_client.publish_metrics(args.metrics_interval))
 
     # Keep the program running to listen for NATS messages
-    logger.debug("Starting event loop")
-    while not exit_event.is_set():
-        logger.debug("Waiting for NATS messages")
-        await asyncio.sleep(1)
+    logger.debug("Waiting for NATS messages")
+    await exit_event.wait()
+
+    # Stop any running capture and flush pending readings before exiting
+    if metrics_task is not None:
+        metrics_task.cancel()
+    await app.stop_all()
+    if resend_task is not None:
+        resend_task.cancel()
+        # Give the collector a chance to acknowledge the last readings, which are stored locally anyway
+        if not await link.drain(args.ack_timeout):
+            logger.warning("Some readings were not acknowledged by the collector")
+    await nats_client.close()
+    if app.loop_monitor is not None:
+        await app.loop_monitor.stop()
+    logger.debug("Closing database connection")
+    db.close()
 
 if __name__ == "__main__":
-    logger.debug("Starting main function")
     asyncio.run(main())
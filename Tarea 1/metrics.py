@@ -0,0 +1,153 @@
+import bisect
+import time
+
+# Upper bounds in seconds of the latency histogram buckets: four per decade, from 1µs to 10s
+DEFAULT_BOUNDS = tuple(10 ** (exponent / 4) for exponent in range(-24, 5))
+
+# Percentiles included in histogram snapshots
+PERCENTILES = (50, 90, 99)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of durations.
+
+    Recording a sample is a binary search over the bucket bounds and an
+    increment of a preallocated counter, so it costs well under a microsecond
+    and allocates nothing. Percentiles are approximated by the upper bound of
+    the bucket they fall in, which is at most 78% above the exact value with
+    the default bounds.
+
+    Samples may be recorded from one thread while another takes snapshots.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        """
+        Initialize LatencyHistogram object.
+
+        Args:
+            bounds (tuple of float, optional): Increasing upper bounds in seconds of the buckets. Samples above
+                the last bound go to an overflow bucket. Defaults to ``DEFAULT_BOUNDS``.
+        """
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        """
+        Add a sample.
+
+        Args:
+            seconds (float): The measured duration in seconds.
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+        Add the samples of another histogram with the same bounds.
+
+        Args:
+            other (LatencyHistogram): The histogram to add.
+        """
+        if other.bounds != self.bounds:
+            raise ValueError("Histograms with different bounds cannot be merged")
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """
+        Get an upper estimate of a percentile.
+
+        Args:
+            percent (float): The percentile, between 0 and 100.
+
+        Returns:
+            float: Upper bound of the bucket holding the percentile (the maximum for the overflow bucket), or None if there are no samples.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+        Get the state of the histogram.
+
+        Returns:
+            dict: ``count``, ``mean``, ``max``, ``p50``, ``p90`` and ``p99`` in seconds, and ``buckets``: the
+            ``[upper_bound, count]`` pairs of the non-empty buckets (``null`` bound for the overflow bucket).
+        """
+        snapshot = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+        }
+        for percent in PERCENTILES:
+            snapshot[f"p{percent}"] = self.percentile(percent)
+        bounds = self.bounds + (None,)
+        snapshot["buckets"] = [[bounds[index], count] for index, count in enumerate(self.counts) if count]
+        return snapshot
+
+
+class SensorMetrics:
+    """
+    Instrumentation of the capture loop of one sensor.
+
+    Holds one latency histogram per stage of the loop and the throughput
+    counters. It lives as long as the sensor, so it accumulates over every
+    start and stop of the capture.
+    """
+
+    # Stages of the capture loop: scheduler wake-up delay, sensor read, in-memory copy, live publishing and storage hand-off
+    STAGES = ("jitter", "read", "pack", "publish", "enqueue")
+
+    def __init__(self):
+        """
+        Initialize SensorMetrics object.
+        """
+        self.stages = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.started = time.monotonic()
+
+    def record(self, stage, seconds):
+        """
+        Add a latency sample to a stage.
+
+        Args:
+            stage (str): One of ``STAGES``.
+            seconds (float): The measured duration in seconds.
+        """
+        self.stages[stage].record(seconds)
+
+    def snapshot(self):
+        """
+        Get the state of the metrics.
+
+        Returns:
+            dict: The counters, the average capture rate in frames per second since the sensor was created,
+            and the snapshot of every stage histogram under ``stages``.
+        """
+        elapsed = time.monotonic() - self.started
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "bytes_written": self.bytes_written,
+            "frames_per_second": self.frames_captured / elapsed if elapsed > 0 else 0.0,
+            "stages": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+        }
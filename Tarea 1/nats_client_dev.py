@@ -1,33 +1,14 @@
 import asyncio
-from logging.handlers import RotatingFileHandler
+import json
 import nats
-import data_capture_module
+import sensor_application
+import query_protocol
 import logging
-import warnings #type: ignore
-
-# Ignore coroutine warnings (Only raised when closing NATS connection due to strange error)
-warnings.filterwarnings("ignore", category=RuntimeWarning, message="coroutine .* was never awaited")
-warnings.filterwarnings("ignore", message="Enable tracemalloc to get the object allocation traceback")
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-file_handler = logging.FileHandler('app.log')
-file_handler.setLevel(logging.DEBUG)
-
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
-
-file_handler.setFormatter(formatter)
-console_handler.setFormatter(formatter)
 
 class NATSClient:
-    def __init__(self, server, db, args, exit_event):
+    def __init__(self, server, db, args, exit_event, app=None):
         """
         Initialize NATSClient object.
 
@@ -35,6 +16,8 @@ class NATSClient:
             server (str): The NATS server URL.
             db (DatabaseManager): The database manager instance for handling database operations.
             args (argparse.Namespace): Parsed command-line arguments containing configurations.
+            exit_event (asyncio.Event): Event set to signal the main loop to shut down.
+            app (SensorApplication, optional): The application running the sensors. Defaults to a new, empty one.
         """
         self.server = server
         self.nc = None
@@ -42,6 +25,7 @@ class NATSClient:
         self.db = db
         self.args = args
         self.exit_event = exit_event
+        self.app = app if app is not None else sensor_application.SensorApplication(db)
 
     async def connect(self):
         """
@@ -65,20 +49,39 @@ class NATSClient:
         logger.info(f"Awaiting messages...")
         await self.nc.subscribe(subject, cb=cb)
 
+    async def publish(self, subject, payload, reply=""):
+        """
+        Publish a message on a NATS subject.
+
+        Args:
+            subject (str): The subject to publish on.
+            payload (bytes): The message payload.
+            reply (str, optional): Subject the receivers should answer on. Defaults to none.
+        """
+        await self.nc.publish(subject, payload, reply=reply)
+
+    async def subscribe_sensors(self):
+        """
+        Subscribe to the per-sensor control subjects ``sensors.<id>.<command>``.
+        """
+        for command in sensor_application.SensorApplication.COMMANDS:
+            await self.subscribe(f"sensors.*.{command}", cb=self.sensor_handler)
+
     async def close(self):
         """
         Close the NATS connection.
 
         This method terminates the connection to the NATS server, ensuring that
-        any resources are properly released.
+        any resources are properly released. Closing waits for the message
+        handlers to finish, so it must not be called from one of them.
         """
+        if self.nc is None:
+            return
         try:
-            # This should be awaited, but for some reason, when doing so, the loop never closes
             logger.info("Closing NATS connection")
-            asyncio.wait_for(self.nc.close(), timeout=5)
+            await asyncio.wait_for(self.nc.close(), timeout=5)
         except asyncio.TimeoutError:
             logger.warning("Timeout occurred while closing NATS connection")
-        self.exit_event.set()
 
 
     async def message_handler(self, msg):
@@ -92,25 +95,151 @@ class NATSClient:
             - "test.start_capture": Starts data capture if not already running.
             - "test.stop_capture": Stops data capture if it is currently running.
             - "test.shutdown": Signals the main loop to shut down the program.
+
+        The capture commands act on the sensor given on the command line, or on
+        every configured sensor when no sensor type was given on the command line.
         """
         logger.info(f"Received message: {msg.subject} {msg.data.decode()}")
         if msg.subject == "test.start_capture":
+            if not self.args.sensor_type:
+                await self.app.start_all()
+                return
             if not self.data_capture:
-                # Initialize DataCapture object with command-line arguments
-                self.data_capture = data_capture_module.DataCapture(
-                    self.db,
-                    self.args.reading_frequency,
+                # Register the sensor described by the command-line arguments
+                self.data_capture = self.app.add_sensor(
+                    self.args.sensor_id,
                     self.args.sensor_type,
+                    self.args.reading_frequency,
                     self.args.min_value,
-                    self.args.max_value
+                    self.args.max_value,
+                    seed=self.args.seed,
+                    device=self.args.device,
+                    baudrate=self.args.baudrate
                 )
             # Start data capture
             await self.data_capture.start_capture()
         elif msg.subject == "test.stop_capture":
-            if self.data_capture:
+            if not self.args.sensor_type:
+                await self.app.stop_all()
+            elif self.data_capture:
                 # Stop data capture
                 await self.data_capture.stop_capture()
         elif msg.subject == "test.shutdown":
             logger.info("Shutting down...")
-            # Signal the main loop to shut down the program
-            await self.close()
+            # Signal the main loop to shut down the program, which closes the connection
+            self.exit_event.set()
+
+    async def sensor_handler(self, msg):
+        """
+        Handle control messages sent to a single sensor.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+
+        The subject has the form ``sensors.<id>.<command>``, where ``command`` is
+        one of ``SensorApplication.COMMANDS``, possibly behind a prefix such as
+        ``workers.<shard>.`` when forwarded to a worker process. When the message
+        is a request, the state of the sensor (or the error) is sent back as JSON.
+
+        Messages on ``sensors.<id>.metrics`` without a reply subject are the
+        periodic snapshots published by ``publish_metrics()`` and are ignored.
+        """
+        if not msg.reply and msg.subject.endswith(".metrics"):
+            return
+        logger.info(f"Received message: {msg.subject}")
+        try:
+            sensor_id, command = msg.subject.split(".")[-2:]
+            response = await self.app.process_command(int(sensor_id), command, msg.data)
+        except (ValueError, KeyError) as e:
+            logger.warning("Invalid sensor command %s: %s", msg.subject, e)
+            response = {"error": e.args[0] if e.args else str(e)}
+        if msg.reply:
+            await self.nc.publish(msg.reply, json.dumps(response).encode())
+
+    async def publish_metrics(self, interval):
+        """
+        Periodically publish the metrics of every running sensor on ``sensors.<id>.metrics``.
+
+        Args:
+            interval (float): Time in seconds between two snapshots.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for sensor_id, sensor in list(self.app.sensors.items()):
+                if not sensor.is_running():
+                    continue
+                try:
+                    snapshot = self.app.metrics(sensor_id)
+                    await self.nc.publish(f"sensors.{sensor_id}.metrics", json.dumps(snapshot).encode())
+                except Exception as e:
+                    logger.error("Error publishing metrics of sensor %s: %s", sensor_id, e)
+
+    async def query_handler(self, msg):
+        """
+        Answer a time-range query sent as a request to ``sensors.query``.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+
+        The request format is described in ``query_protocol.parse_query_request``.
+        The readings are read in pages on a worker thread, so the event loop never
+        waits on SQLite, and streamed back to the reply subject as a sequence of
+        chunks of at most ``--query-chunk-bytes`` bytes each. The last chunk of the
+        reply is flagged as such; a query with no readings gets a single empty chunk.
+        Rollup queries are served from the ``infrared_rollup`` table, which only
+        holds closed buckets, and ignore ``stride`` and ``limit``. Frame queries
+        return the stored readings only: the readings skipped by a deadband are
+        not rebuilt, see ``DatabaseManager.iter_runs()``.
+        """
+        if not msg.reply:
+            logger.warning("Ignoring query sent without a reply subject")
+            return
+        try:
+            request = query_protocol.parse_query_request(msg.data)
+        except ValueError as e:
+            logger.warning("Invalid query: %s", e)
+            await self.nc.publish(msg.reply, query_protocol.encode_error("json", str(e)))
+            return
+
+        output_format = request["format"]
+        sensor_id = request["sensor_id"]
+        chunk_size = query_protocol.rows_per_chunk(output_format, self.args.query_chunk_bytes, request["kind"])
+        logger.info("Query for %s of sensor %s from %s to %s", request["kind"], sensor_id, request["start"], request["end"])
+        if request["kind"] == "rollup":
+            chunks = self.db.iter_rollups(sensor_id, request["interval"], request["start"], request["end"], chunk_size=chunk_size)
+            empty_chunk = query_protocol.EMPTY_ROLLUP_CHUNK
+
+            def encode(seq, summary, last):
+                return query_protocol.encode_rollup_chunk(output_format, seq, sensor_id, request["interval"], summary, last)
+        else:
+            chunks = self.db.iter_frames(
+                sensor_id,
+                request["start"],
+                request["end"],
+                stride=request["stride"],
+                limit=request["limit"],
+                chunk_size=chunk_size
+            )
+            empty_chunk = query_protocol.EMPTY_CHUNK
+
+            def encode(seq, chunk, last):
+                reading_times, frames = chunk
+                return query_protocol.encode_chunk(output_format, seq, sensor_id, reading_times, frames, last)
+
+        seq = 0
+        try:
+            # Read one chunk ahead so that the last chunk sent can be flagged as such
+            chunk = await asyncio.to_thread(next, chunks, empty_chunk)
+            while True:
+                next_chunk = await asyncio.to_thread(next, chunks, None)
+                await self.nc.publish(msg.reply, encode(seq, chunk, next_chunk is None))
+                seq += 1
+                if next_chunk is None:
+                    break
+                chunk = next_chunk
+        except Exception as e:
+            logger.error("Error answering query: %s", e)
+            await self.nc.publish(msg.reply, query_protocol.encode_error(output_format, str(e)))
+        finally:
+            await asyncio.to_thread(chunks.close)
+        logger.debug("Query answered in %d chunk(s)", seq)
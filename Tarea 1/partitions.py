@@ -0,0 +1,222 @@
+import calendar
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Length in seconds of the supported partition intervals
+PARTITION_INTERVALS = {"hour": 3600, "day": 86400}
+
+# Name format of the partitions of every interval, in UTC
+PARTITION_FORMATS = {"hour": "%Y%m%d%H", "day": "%Y%m%d"}
+
+# Prefix of the schema names partitions are attached under
+SCHEMA_PREFIX = "p_"
+
+# Tables of the readings, which live in the partitions instead of the main database
+PARTITIONED_TABLES = re.compile(r"\b(infrared_data|infrared_chunks)\b")
+
+# Schema-qualified table references to a partition in a SQL statement
+PARTITION_REFERENCE = re.compile(rf"\b({SCHEMA_PREFIX}\d+)\.")
+
+# Files SQLite keeps next to a database in WAL mode
+SQLITE_SIDECARS = ("", "-wal", "-shm")
+
+
+class PartitionScheme:
+    """
+    Naming, lookup and expiry of the time partitions of a database.
+
+    Every partition is a separate SQLite file next to the main database,
+    holding the readings of one hour or one day (in UTC): ``database.db``
+    gets ``database.20240131.db``, ``database.20240201.db`` and so on. A
+    partition is identified by its key, the number of intervals since the
+    Unix epoch, and is attached to connections under the schema
+    ``p_<name>``. Expiring a partition deletes its file, so disk space is
+    given back at once, without any ``DELETE`` or ``VACUUM``.
+    """
+
+    def __init__(self, db_uri, interval="day", retention=None):
+        """
+        Initialize PartitionScheme object.
+
+        Args:
+            db_uri (str): Path of the main database.
+            interval (str, optional): Time covered by a partition, one of ``PARTITION_INTERVALS``. Defaults to ``day``.
+            retention (float, optional): Time in seconds partitions are kept after they end. Defaults to None (forever).
+
+        Raises:
+            ValueError: If the interval is unknown or the retention is not positive.
+        """
+        if interval not in PARTITION_INTERVALS:
+            raise ValueError(f"Unknown partition interval {interval!r}")
+        if retention is not None and retention <= 0:
+            raise ValueError("retention must be greater than 0")
+        root, extension = os.path.splitext(db_uri)
+        self.directory = os.path.dirname(root) or "."
+        self.prefix = os.path.basename(root) + "."
+        self.extension = extension or ".db"
+        self.interval = interval
+        self.seconds = PARTITION_INTERVALS[interval]
+        self.format = PARTITION_FORMATS[interval]
+        self.retention = retention
+        self.queries = {}
+
+    def key(self, timestamp):
+        """
+        Get the key of the partition holding a time.
+
+        Args:
+            timestamp (float): Unix timestamp.
+
+        Returns:
+            int: The partition key.
+        """
+        return int(timestamp // self.seconds)
+
+    def name(self, key):
+        """
+        Get the name of a partition, its start time in UTC.
+        """
+        return time.strftime(self.format, time.gmtime(key * self.seconds))
+
+    def schema(self, key):
+        """
+        Get the schema name a partition is attached under.
+        """
+        return SCHEMA_PREFIX + self.name(key)
+
+    def path(self, key):
+        """
+        Get the path of the file of a partition.
+        """
+        return os.path.join(self.directory, f"{self.prefix}{self.name(key)}{self.extension}")
+
+    def parse_name(self, name):
+        """
+        Get the key of a partition from its name.
+
+        Args:
+            name (str): The partition name, as returned by ``name()``.
+
+        Returns:
+            int: The partition key, or None if the name is not a partition name of this scheme.
+        """
+        try:
+            key = self.key(calendar.timegm(time.strptime(name, self.format)))
+        except ValueError:
+            return None
+        # Names of another interval may parse too, but never back to themselves
+        return key if self.name(key) == name else None
+
+    def query(self, query, key):
+        """
+        Get a SQL statement with its reading tables qualified with the schema of a partition.
+
+        Args:
+            query (str): SQL statement on ``infrared_data`` or ``infrared_chunks``.
+            key (int): The partition key.
+
+        Returns:
+            str: The statement on the tables of the partition.
+        """
+        qualified = self.queries.get((query, key))
+        if qualified is None:
+            qualified = self.queries[(query, key)] = PARTITIONED_TABLES.sub(rf"{self.schema(key)}.\1", query)
+        return qualified
+
+    def referenced_keys(self, query):
+        """
+        Get the partitions a SQL statement returned by ``query()`` writes to.
+
+        Args:
+            query (str): SQL statement.
+
+        Returns:
+            set: The keys of the partitions.
+        """
+        return {self.parse_name(schema[len(SCHEMA_PREFIX):]) for schema in PARTITION_REFERENCE.findall(query)}
+
+    def existing(self):
+        """
+        List the partitions found on disk.
+
+        Returns:
+            list: The keys of the partitions, oldest first.
+        """
+        keys = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith(self.prefix) and file_name.endswith(self.extension):
+                key = self.parse_name(file_name[len(self.prefix):-len(self.extension)])
+                if key is not None:
+                    keys.append(key)
+        return sorted(keys)
+
+    def between(self, start_time, end_time):
+        """
+        List the partitions on disk that may hold readings of a time range.
+
+        Args:
+            start_time (float): Start of the range as a Unix timestamp, included.
+            end_time (float): End of the range as a Unix timestamp, excluded.
+
+        Returns:
+            list: The keys of the partitions, oldest first.
+        """
+        return [key for key in self.existing() if key * self.seconds < end_time and (key + 1) * self.seconds > start_time]
+
+    def is_expired(self, key, now=None):
+        """
+        Check whether a partition ended longer than the retention ago.
+
+        Args:
+            key (int): The partition key.
+            now (float, optional): Current Unix timestamp. Defaults to the current time.
+
+        Returns:
+            bool: True if the partition should be dropped.
+        """
+        if self.retention is None:
+            return False
+        now = time.time() if now is None else now
+        return (key + 1) * self.seconds <= now - self.retention
+
+    def expire(self, now=None):
+        """
+        Delete the files of the expired partitions.
+
+        Connections should detach the partitions first. On platforms that do
+        not allow deleting open files, partitions that are still open are left
+        for the next call.
+
+        Args:
+            now (float, optional): Current Unix timestamp. Defaults to the current time.
+
+        Returns:
+            list: The keys of the deleted partitions.
+        """
+        expired = []
+        for key in self.existing():
+            if not self.is_expired(key, now):
+                break
+            try:
+                self.drop(key)
+            except OSError as e:
+                logger.warning("Could not drop expired partition %s: %s", self.path(key), e)
+                continue
+            logger.info("Dropped expired partition %s", self.path(key))
+            expired.append(key)
+        return expired
+
+    def drop(self, key):
+        """
+        Delete the file of a partition, with the files SQLite keeps next to it.
+
+        Args:
+            key (int): The partition key.
+        """
+        for sidecar in SQLITE_SIDECARS:
+            if os.path.exists(self.path(key) + sidecar):
+                os.remove(self.path(key) + sidecar)
@@ -0,0 +1,297 @@
+import json
+import struct
+import time
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+# Header of a binary reply chunk: sequence number, number of readings (or buckets), flags
+CHUNK_HEADER = struct.Struct('<IIB')
+
+# Flags of a binary reply chunk
+FLAG_LAST = 0x01
+FLAG_ERROR = 0x02
+
+# Output formats accepted by the query service
+FORMATS = ("json", "binary")
+
+# Kinds of data served by the query service: raw readings or rollup summaries
+KINDS = ("frames", "rollup")
+
+# Chunk sent when a query matches no readings
+EMPTY_CHUNK = (np.empty(0, dtype=np.float64), np.empty((0, FRAME_PIXELS), dtype=FRAME_DTYPE))
+
+# Chunk sent when a rollup query matches no buckets
+EMPTY_ROLLUP_CHUNK = {
+    "bucket_start": np.empty(0, dtype=np.float64),
+    "count": np.empty(0, dtype=np.int64),
+    "min": np.empty((0, FRAME_PIXELS), dtype=FRAME_DTYPE),
+    "max": np.empty((0, FRAME_PIXELS), dtype=FRAME_DTYPE),
+    "mean": np.empty((0, FRAME_PIXELS), dtype=np.float64),
+    "std": np.empty((0, FRAME_PIXELS), dtype=np.float64),
+}
+
+# Fields of a rollup summary, in the order of the binary layout, with their data type and number of values per bucket
+ROLLUP_FIELDS = {
+    "bucket_start": (np.float64, 1),
+    "count": (np.int64, 1),
+    "min": (FRAME_DTYPE, FRAME_PIXELS),
+    "max": (FRAME_DTYPE, FRAME_PIXELS),
+    "mean": (np.float64, FRAME_PIXELS),
+    "std": (np.float64, FRAME_PIXELS),
+}
+
+# Approximate size in bytes of one reading in each output format, used to size the chunks
+ROW_SIZES = {
+    ("frames", "json"): 8 + FRAME_PIXELS * 6,
+    ("frames", "binary"): 8 + FRAME_PIXELS * 2,
+    ("rollup", "json"): 16 + FRAME_PIXELS * 50,
+    ("rollup", "binary"): 16 + FRAME_PIXELS * 20,
+}
+
+
+def wire_dtype(dtype):
+    """
+    Get the little-endian variant of a data type, used in the body of binary chunks like in their header.
+
+    Args:
+        dtype (numpy.dtype or type): The data type of the values.
+
+    Returns:
+        numpy.dtype: The same type with a little-endian byte order.
+    """
+    return np.dtype(dtype).newbyteorder('<')
+
+
+def parse_query_request(payload):
+    """
+    Parse a query request sent to ``sensors.query``.
+
+    The payload is a JSON object with the following keys:
+        - ``sensor_id`` (int, required): The sensor to query.
+        - ``start`` / ``end`` (float, optional): Unix timestamps of the time range, end excluded.
+        - ``last`` (float, optional): Query the last given seconds instead of ``start`` and ``end``.
+        - ``stride`` (int, optional): Only return every ``stride``-th reading. Defaults to 1.
+        - ``limit`` (int, optional): Maximum number of readings returned.
+        - ``format`` (str, optional): ``json`` or ``binary``. Defaults to ``json``.
+        - ``kind`` (str, optional): ``frames`` for raw readings or ``rollup`` for per-bucket summaries. Defaults to ``frames``.
+        - ``interval`` (int, required for rollups): Size in seconds of the rollup buckets.
+
+    Args:
+        payload (bytes): The request payload.
+
+    Returns:
+        dict: The validated request.
+
+    Raises:
+        ValueError: If the payload is not a valid request.
+    """
+    try:
+        request = json.loads(payload or b"{}")
+    except ValueError:
+        raise ValueError("Query payload must be a JSON object")
+    if not isinstance(request, dict):
+        raise ValueError("Query payload must be a JSON object")
+
+    try:
+        sensor_id = int(request["sensor_id"])
+        if request.get("last") is not None:
+            end_time = time.time()
+            start_time = end_time - float(request["last"])
+        else:
+            start_time = float(request.get("start", 0.0))
+            end_time = float(request.get("end", time.time()))
+        stride = int(request.get("stride", 1))
+        limit = request.get("limit")
+        limit = int(limit) if limit is not None else None
+        interval = request.get("interval")
+        interval = int(interval) if interval is not None else None
+    except KeyError:
+        raise ValueError("Query requires a sensor_id")
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid query parameter: {e}")
+
+    output_format = request.get("format", "json")
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format {output_format!r}, expected one of {', '.join(FORMATS)}")
+    kind = request.get("kind", "frames")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown kind {kind!r}, expected one of {', '.join(KINDS)}")
+    if kind == "rollup" and interval is None:
+        raise ValueError("Rollup queries require an interval")
+    if stride < 1:
+        raise ValueError("stride must be at least 1")
+    if limit is not None and limit < 0:
+        raise ValueError("limit must not be negative")
+
+    return {
+        "sensor_id": sensor_id,
+        "start": start_time,
+        "end": end_time,
+        "stride": stride,
+        "limit": limit,
+        "format": output_format,
+        "kind": kind,
+        "interval": interval,
+    }
+
+
+def rows_per_chunk(output_format, max_chunk_bytes, kind="frames"):
+    """
+    Get the number of readings (or rollup buckets) that fit in one reply chunk.
+
+    Args:
+        output_format (str): ``json`` or ``binary``.
+        max_chunk_bytes (int): Maximum size of a chunk payload in bytes.
+        kind (str, optional): ``frames`` or ``rollup``. Defaults to ``frames``.
+
+    Returns:
+        int: Number of rows per chunk, at least 1.
+    """
+    return max(1, (max_chunk_bytes - CHUNK_HEADER.size) // ROW_SIZES[(kind, output_format)])
+
+
+def encode_chunk(output_format, seq, sensor_id, reading_times, frames, last):
+    """
+    Encode a chunk of readings as a reply payload.
+
+    Binary chunks hold the header, then every timestamp as ``float64``, then
+    every frame as 64 ``uint16`` values, all little-endian.
+
+    Args:
+        output_format (str): ``json`` or ``binary``.
+        seq (int): Sequence number of the chunk, starting at 0.
+        sensor_id (int): The queried sensor.
+        reading_times (numpy.ndarray): Timestamps of the readings.
+        frames (numpy.ndarray): Readings as an array of shape (count, 64).
+        last (bool): Whether this is the last chunk of the reply.
+
+    Returns:
+        bytes: The encoded payload.
+    """
+    if output_format == "binary":
+        header = CHUNK_HEADER.pack(seq, len(reading_times), FLAG_LAST if last else 0)
+        return b"".join((
+            header,
+            np.ascontiguousarray(reading_times, dtype=wire_dtype(np.float64)).tobytes(),
+            np.ascontiguousarray(frames, dtype=wire_dtype(FRAME_DTYPE)).tobytes(),
+        ))
+    return json.dumps({
+        "seq": seq,
+        "last": last,
+        "sensor_id": sensor_id,
+        "reading_time": reading_times.tolist(),
+        "data": frames.tolist(),
+    }).encode()
+
+
+def encode_rollup_chunk(output_format, seq, sensor_id, interval, summary, last):
+    """
+    Encode a chunk of rollup summaries as a reply payload.
+
+    Binary chunks hold the header, then the bucket starts as ``float64``, the
+    frame counts as ``int64``, the per-pixel minimum and maximum as ``uint16``
+    and the per-pixel mean and standard deviation as ``float64``, each block
+    holding every bucket of the chunk, all little-endian.
+
+    Args:
+        output_format (str): ``json`` or ``binary``.
+        seq (int): Sequence number of the chunk, starting at 0.
+        sensor_id (int): The queried sensor.
+        interval (int): Size in seconds of the buckets.
+        summary (dict): The summaries returned by ``rollup.merge_rollup_rows()``.
+        last (bool): Whether this is the last chunk of the reply.
+
+    Returns:
+        bytes: The encoded payload.
+    """
+    if output_format == "binary":
+        header = CHUNK_HEADER.pack(seq, len(summary["bucket_start"]), FLAG_LAST if last else 0)
+        return b"".join([header] + [
+            np.ascontiguousarray(summary[key], dtype=wire_dtype(dtype)).tobytes() for key, (dtype, _) in ROLLUP_FIELDS.items()
+        ])
+    message = {"seq": seq, "last": last, "sensor_id": sensor_id, "interval": interval}
+    for key in ROLLUP_FIELDS:
+        message[key] = summary[key].tolist()
+    return json.dumps(message).encode()
+
+
+def encode_error(output_format, message):
+    """
+    Encode an error reply. An error reply is always the last chunk.
+
+    Args:
+        output_format (str): ``json`` or ``binary``.
+        message (str): Description of the error.
+
+    Returns:
+        bytes: The encoded payload.
+    """
+    if output_format == "binary":
+        return CHUNK_HEADER.pack(0, 0, FLAG_LAST | FLAG_ERROR) + message.encode()
+    return json.dumps({"seq": 0, "last": True, "error": message}).encode()
+
+
+def decode_chunk(output_format, payload):
+    """
+    Decode a reply chunk, for clients of the query service.
+
+    Args:
+        output_format (str): ``json`` or ``binary``, as sent in the request.
+        payload (bytes): The reply payload.
+
+    Returns:
+        dict: ``seq``, ``last``, ``reading_time`` (numpy array), ``data`` (numpy array of shape (count, 64)) and ``error`` (None unless the query failed).
+    """
+    if output_format == "binary":
+        seq, count, flags = CHUNK_HEADER.unpack_from(payload)
+        body = memoryview(payload)[CHUNK_HEADER.size:]
+        if flags & FLAG_ERROR:
+            return {"seq": seq, "last": True, "reading_time": None, "data": None, "error": bytes(body).decode()}
+        reading_times = np.frombuffer(body, dtype=wire_dtype(np.float64), count=count)
+        frames = np.frombuffer(body, dtype=wire_dtype(FRAME_DTYPE), offset=reading_times.nbytes).reshape(count, FRAME_PIXELS)
+        return {"seq": seq, "last": bool(flags & FLAG_LAST), "reading_time": reading_times, "data": frames, "error": None}
+
+    message = json.loads(payload)
+    if "error" in message:
+        return {"seq": message["seq"], "last": True, "reading_time": None, "data": None, "error": message["error"]}
+    return {
+        "seq": message["seq"],
+        "last": message["last"],
+        "reading_time": np.array(message["reading_time"], dtype=np.float64),
+        "data": np.array(message["data"], dtype=FRAME_DTYPE).reshape(-1, FRAME_PIXELS),
+        "error": None,
+    }
+
+
+def decode_rollup_chunk(output_format, payload):
+    """
+    Decode a reply chunk of a rollup query, for clients of the query service.
+
+    Args:
+        output_format (str): ``json`` or ``binary``, as sent in the request.
+        payload (bytes): The reply payload.
+
+    Returns:
+        dict: ``seq``, ``last``, ``error`` and one array per field of ``ROLLUP_FIELDS``.
+    """
+    if output_format == "binary":
+        seq, count, flags = CHUNK_HEADER.unpack_from(payload)
+        body = memoryview(payload)[CHUNK_HEADER.size:]
+        if flags & FLAG_ERROR:
+            return {"seq": seq, "last": True, "error": bytes(body).decode()}
+        chunk = {"seq": seq, "last": bool(flags & FLAG_LAST), "error": None}
+        offset = 0
+        for key, (dtype, width) in ROLLUP_FIELDS.items():
+            values = np.frombuffer(body, dtype=wire_dtype(dtype), count=count * width, offset=offset)
+            chunk[key] = values.reshape(count, width) if width > 1 else values
+            offset += values.nbytes
+        return chunk
+
+    message = json.loads(payload)
+    if "error" in message:
+        return {"seq": message["seq"], "last": True, "error": message["error"]}
+    chunk = {"seq": message["seq"], "last": message["last"], "error": None}
+    for key, (dtype, width) in ROLLUP_FIELDS.items():
+        values = np.array(message[key], dtype=dtype)
+        chunk[key] = values.reshape(-1, width) if width > 1 else values
+    return chunk
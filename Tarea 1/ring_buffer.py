@@ -0,0 +1,257 @@
+from multiprocessing import shared_memory
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+# Header of a shared ring buffer: frame count, capacity and values per frame
+SHARED_HEADER_DTYPE = np.dtype("<u8")
+
+# Number of header fields of a shared ring buffer
+SHARED_HEADER_FIELDS = 3
+
+# Smallest capacity of a shared ring buffer: readers need a slot the writer is not writing to
+MIN_SHARED_CAPACITY = 2
+
+
+class FrameRingBuffer:
+    """
+    Fixed-capacity, in-memory history of the most recent frames of a sensor.
+
+    Frames live in one preallocated ``uint16`` array of shape (capacity, 64),
+    with a parallel ``float64`` array holding their timestamps. Appending copies
+    the frame into the next slot, overwriting the oldest one once the buffer is
+    full. Reads return ``memoryview`` slices of those arrays, so no data is
+    copied and no Python ints are created.
+
+    The views point at the live storage: consume them before the buffer wraps
+    around, which is always the case when reading from the same event loop that
+    appends the frames.
+    """
+
+    def __init__(self, capacity, width=FRAME_PIXELS):
+        """
+        Initialize FrameRingBuffer object.
+
+        Args:
+            capacity (int): Maximum number of frames kept.
+            width (int, optional): Number of values per frame. Defaults to 64.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, width), dtype=FRAME_DTYPE)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+
+    def __len__(self):
+        """
+        Get the number of frames currently stored.
+        """
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, frame):
+        """
+        Store a frame, overwriting the oldest one if the buffer is full.
+
+        Args:
+            timestamp (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray or bytes-like): The 64 frame values.
+        """
+        slot = self.count % self.capacity
+        self.frames[slot] = frame
+        self.timestamps[slot] = timestamp
+        self.count += 1
+
+    def latest(self):
+        """
+        Get the most recent frame.
+
+        Returns:
+            tuple: The timestamp of the frame and a memoryview of its values, or None if the buffer is empty.
+        """
+        if not self.count:
+            return None
+        slot = (self.count - 1) % self.capacity
+        return float(self.timestamps[slot]), memoryview(self.frames[slot])
+
+    def last(self, n):
+        """
+        Get the ``n`` most recent frames, oldest first.
+
+        The requested frames are contiguous in memory unless they wrap around
+        the end of the buffer, in which case they are split in two segments.
+
+        Args:
+            n (int): Number of frames requested. At most ``len(self)`` are returned.
+
+        Returns:
+            list: One or two ``(timestamps, frames)`` tuples of memoryviews, oldest segment first. Empty if the buffer is empty.
+        """
+        n = min(n, len(self))
+        if n <= 0:
+            return []
+        end = self.count % self.capacity or self.capacity
+        start = end - n
+        if start >= 0:
+            return [(memoryview(self.timestamps[start:end]), memoryview(self.frames[start:end]))]
+        return [
+            (memoryview(self.timestamps[start:]), memoryview(self.frames[start:])),
+            (memoryview(self.timestamps[:end]), memoryview(self.frames[:end])),
+        ]
+
+    def copy_last(self, n):
+        """
+        Get a contiguous copy of the ``n`` most recent frames, oldest first.
+
+        Args:
+            n (int): Number of frames requested. At most ``len(self)`` are returned.
+
+        Returns:
+            tuple: Arrays of shape (k,) with the timestamps and (k, 64) with the frames.
+        """
+        segments = self.last(n)
+        if not segments:
+            return np.empty(0, dtype=np.float64), np.empty((0, self.frames.shape[1]), dtype=FRAME_DTYPE)
+        timestamps = np.concatenate([np.asarray(segment[0]) for segment in segments])
+        frames = np.concatenate([np.asarray(segment[1]) for segment in segments])
+        return timestamps, frames
+
+
+class SharedFrameRingBuffer(FrameRingBuffer):
+    """
+    ``FrameRingBuffer`` in a shared memory block, written by one process and read by others.
+
+    The block holds a header (frame count, capacity and values per frame),
+    then the timestamps and then the frames, so another process attaches to
+    it knowing only its name. The frame count lives in the header and is
+    updated after the frame is copied, so readers never see a slot before it
+    is complete.
+
+    The writer is only known to have left a slot alone while it has appended
+    fewer frames than the capacity minus one since the slot was read, so the
+    buffer holds at least ``MIN_SHARED_CAPACITY`` frames.
+
+    The process that creates the block owns it and must ``unlink()`` it once
+    every process has closed it.
+    """
+
+    def __init__(self, capacity, width=FRAME_PIXELS, name=None):
+        """
+        Initialize SharedFrameRingBuffer object, creating its shared memory block.
+
+        Args:
+            capacity (int): Maximum number of frames kept.
+            width (int, optional): Number of values per frame. Defaults to 64.
+            name (str, optional): Name of an existing block to attach to instead, see ``attach()``. Defaults to None.
+
+        Raises:
+            ValueError: If the capacity is below ``MIN_SHARED_CAPACITY``.
+        """
+        if name is None:
+            if capacity < MIN_SHARED_CAPACITY:
+                raise ValueError(f"capacity must be at least {MIN_SHARED_CAPACITY}")
+            header_size = SHARED_HEADER_FIELDS * SHARED_HEADER_DTYPE.itemsize
+            size = header_size + capacity * (np.dtype(np.float64).itemsize + width * np.dtype(FRAME_DTYPE).itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.header = np.ndarray(SHARED_HEADER_FIELDS, dtype=SHARED_HEADER_DTYPE, buffer=self.shm.buf)
+            self.header[:] = (0, capacity, width)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.header = np.ndarray(SHARED_HEADER_FIELDS, dtype=SHARED_HEADER_DTYPE, buffer=self.shm.buf)
+        self.capacity = int(self.header[1])
+        width = int(self.header[2])
+        offset = self.header.nbytes
+        self.timestamps = np.ndarray(self.capacity, dtype=np.float64, buffer=self.shm.buf, offset=offset)
+        offset += self.timestamps.nbytes
+        self.frames = np.ndarray((self.capacity, width), dtype=FRAME_DTYPE, buffer=self.shm.buf, offset=offset)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to the shared ring buffer created by another process.
+
+        Args:
+            name (str): Name of the shared memory block, see ``name``.
+
+        Returns:
+            SharedFrameRingBuffer: The ring buffer.
+        """
+        return cls(None, name=name)
+
+    @property
+    def name(self):
+        """
+        Get the name of the shared memory block, to attach to it from another process.
+        """
+        return self.shm.name
+
+    @property
+    def count(self):
+        """
+        Get the number of frames appended since the buffer was created.
+        """
+        return int(self.header[0])
+
+    @count.setter
+    def count(self, value):
+        self.header[0] = value
+
+    def latest(self):
+        """
+        Get a copy of the most recent frame.
+
+        Unlike ``FrameRingBuffer.latest()``, the frame is copied, since the
+        writer runs in another process and may overwrite the slot at any time.
+
+        Returns:
+            tuple: The timestamp of the frame and a memoryview of a copy of its values, or None if the buffer is empty.
+        """
+        while True:
+            count = self.count
+            if not count:
+                return None
+            slot = (count - 1) % self.capacity
+            timestamp = float(self.timestamps[slot])
+            frame = self.frames[slot].copy()
+            # The slot is only overwritten once the writer has gone around the whole buffer
+            if self.count - count < self.capacity - 1:
+                return timestamp, memoryview(frame)
+
+    def last(self, n):
+        """
+        Get a copy of the ``n`` most recent frames, oldest first.
+
+        Unlike ``FrameRingBuffer.last()``, the frames are copied, since the
+        writer runs in another process and may overwrite their slots at any
+        time. The copy is taken again if the writer reached the oldest
+        copied slot meanwhile, so at most ``capacity - 1`` frames are returned.
+
+        Args:
+            n (int): Number of frames requested. At most ``min(len(self), capacity - 1)`` are returned.
+
+        Returns:
+            list: One ``(timestamps, frames)`` tuple of memoryviews of the copies. Empty if the buffer is empty.
+        """
+        while True:
+            count = self.count
+            k = min(n, count, self.capacity - 1)
+            if k <= 0:
+                return []
+            slots = np.arange(count - k, count) % self.capacity
+            timestamps = self.timestamps[slots]
+            frames = self.frames[slots]
+            # The oldest copied slot is only overwritten once the writer has gone around the rest of the buffer
+            if self.count - count < self.capacity - k:
+                return [(memoryview(timestamps), memoryview(frames))]
+
+    def close(self):
+        """
+        Detach from the shared memory block.
+        """
+        del self.header, self.timestamps, self.frames
+        self.shm.close()
+
+    def unlink(self):
+        """
+        Free the shared memory block, once every process has closed it.
+        """
+        self.shm.unlink()
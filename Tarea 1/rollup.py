@@ -0,0 +1,130 @@
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+
+class RollupAggregator:
+    """
+    Running per-pixel aggregates of a sensor over fixed time buckets.
+
+    For the bucket currently open, the aggregator keeps the number of frames
+    and the per-pixel minimum, maximum, sum and sum of squares. Every update is
+    a handful of in-place NumPy operations on preallocated arrays. When a frame
+    falls in a later bucket, the open bucket is closed and returned as a row
+    ready to be stored in the ``infrared_rollup`` table.
+    """
+
+    def __init__(self, sensor_id, bucket_seconds):
+        """
+        Initialize RollupAggregator object.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            bucket_seconds (int): Size of the time buckets in seconds.
+        """
+        if bucket_seconds <= 0:
+            raise ValueError("bucket_seconds must be greater than 0")
+        self.sensor_id = sensor_id
+        self.bucket_seconds = bucket_seconds
+        self.bucket_start = None
+        self.count = 0
+        self.min = np.empty(FRAME_PIXELS, dtype=FRAME_DTYPE)
+        self.max = np.empty(FRAME_PIXELS, dtype=FRAME_DTYPE)
+        self.sum = np.zeros(FRAME_PIXELS, dtype=np.int64)
+        self.sum_squares = np.zeros(FRAME_PIXELS, dtype=np.int64)
+        self.squares = np.empty(FRAME_PIXELS, dtype=np.int64)
+
+    def add(self, reading_time, frame):
+        """
+        Add a frame to the aggregates.
+
+        Args:
+            reading_time (float): Time of the reading as a Unix timestamp.
+            frame (numpy.ndarray): The 64 ``uint16`` frame values.
+
+        Returns:
+            tuple: The row of the bucket closed by this frame, or None if the frame falls in the open bucket.
+        """
+        bucket_start = reading_time - reading_time % self.bucket_seconds
+        closed = None
+        if bucket_start != self.bucket_start:
+            closed = self.flush()
+            self.bucket_start = bucket_start
+
+        if self.count:
+            np.minimum(self.min, frame, out=self.min)
+            np.maximum(self.max, frame, out=self.max)
+        else:
+            self.min[:] = frame
+            self.max[:] = frame
+        np.add(self.sum, frame, out=self.sum)
+        np.multiply(frame, frame, out=self.squares, dtype=np.int64)
+        np.add(self.sum_squares, self.squares, out=self.sum_squares)
+        self.count += 1
+        return closed
+
+    def flush(self):
+        """
+        Close the open bucket, even if it is not complete yet.
+
+        Returns:
+            tuple: ``(sensor_id, bucket_seconds, bucket_start, count, min, max, sum, sum_squares)``
+            with the arrays packed as bytes, or None if no frame was added since the last flush.
+        """
+        if not self.count:
+            return None
+        row = (
+            self.sensor_id,
+            self.bucket_seconds,
+            self.bucket_start,
+            self.count,
+            self.min.tobytes(),
+            self.max.tobytes(),
+            self.sum.tobytes(),
+            self.sum_squares.tobytes(),
+        )
+        self.count = 0
+        self.sum.fill(0)
+        self.sum_squares.fill(0)
+        return row
+
+
+def merge_rollup_rows(rows):
+    """
+    Combine stored rollup rows into one summary per bucket.
+
+    A bucket may be stored in several rows, for example when the capture was
+    stopped and restarted within the same bucket. Rows must be sorted by
+    bucket start.
+
+    Args:
+        rows (list): ``(bucket_start, count, min, max, sum, sum_squares)`` tuples as stored in ``infrared_rollup``.
+
+    Returns:
+        dict: Arrays ``bucket_start`` (n,), ``count`` (n,), and ``min``, ``max``,
+        ``mean`` and ``std`` of shape (n, 64).
+    """
+    starts = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    counts = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    minimums = np.frombuffer(b"".join(row[2] for row in rows), dtype=FRAME_DTYPE).reshape(-1, FRAME_PIXELS)
+    maximums = np.frombuffer(b"".join(row[3] for row in rows), dtype=FRAME_DTYPE).reshape(-1, FRAME_PIXELS)
+    sums = np.frombuffer(b"".join(row[4] for row in rows), dtype=np.int64).reshape(-1, FRAME_PIXELS)
+    sum_squares = np.frombuffer(b"".join(row[5] for row in rows), dtype=np.int64).reshape(-1, FRAME_PIXELS)
+
+    # Reduce the rows of every bucket together
+    bucket_starts, first_rows = np.unique(starts, return_index=True)
+    counts = np.add.reduceat(counts, first_rows)
+    minimums = np.minimum.reduceat(minimums, first_rows, axis=0)
+    maximums = np.maximum.reduceat(maximums, first_rows, axis=0)
+    sums = np.add.reduceat(sums, first_rows, axis=0)
+    sum_squares = np.add.reduceat(sum_squares, first_rows, axis=0)
+
+    mean = sums / counts[:, None]
+    variance = np.maximum(sum_squares / counts[:, None] - mean * mean, 0.0)
+    return {
+        "bucket_start": bucket_starts,
+        "count": counts,
+        "min": minimums,
+        "max": maximums,
+        "mean": mean,
+        "std": np.sqrt(variance),
+    }
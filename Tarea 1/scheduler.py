@@ -0,0 +1,130 @@
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TickScheduler:
+    """
+    Deadline-based scheduler for periodic sensor readings.
+
+    Every tick ``n`` is due at ``start + n * period`` on the monotonic clock, so
+    the time spent processing a reading does not push the following ticks back
+    and the schedule never drifts. When the caller falls more than a whole
+    period behind, the overdue ticks are skipped and counted as missed instead
+    of being fired in a burst. Ticks that fire later than ``late_tolerance``
+    after their deadline are counted as late.
+    """
+
+    def __init__(self, period, late_tolerance=None):
+        """
+        Initialize TickScheduler object.
+
+        Args:
+            period (float): Time in seconds between two consecutive ticks.
+            late_tolerance (float, optional): Delay in seconds after which a tick is counted as late. Defaults to 10% of the period.
+        """
+        if period <= 0:
+            raise ValueError("period must be greater than 0")
+        self.period = period
+        self.default_tolerance = late_tolerance is None
+        self.late_tolerance = late_tolerance if late_tolerance is not None else period * 0.1
+        self.start_monotonic = None
+        self.start_wall = None
+        self.next_tick = 0
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.late_ticks = 0
+        self.max_lateness = 0.0
+        self.last_lateness = 0.0
+
+    def start(self):
+        """
+        Anchor the schedule at the current time. The first tick is due immediately.
+        """
+        self.start_monotonic = time.monotonic()
+        self.start_wall = time.time()
+        self.next_tick = 0
+
+    def set_period(self, period):
+        """
+        Change the period without restarting the schedule.
+
+        The deadline of the last tick is kept, so the next tick is due one new
+        period after it and the tick indices go on counting.
+
+        Args:
+            period (float): New time in seconds between two consecutive ticks.
+        """
+        if period <= 0:
+            raise ValueError("period must be greater than 0")
+        if self.start_monotonic is not None:
+            # Move the anchor so that the last tick keeps its deadline under the new period
+            shift = max(self.next_tick - 1, 0) * (self.period - period)
+            self.start_monotonic += shift
+            self.start_wall += shift
+        self.period = period
+        if self.default_tolerance:
+            self.late_tolerance = period * 0.1
+
+    def scheduled_time(self, tick):
+        """
+        Get the wall-clock time at which a tick was due.
+
+        Args:
+            tick (int): The tick index.
+
+        Returns:
+            float: Unix timestamp of the tick deadline.
+        """
+        return self.start_wall + tick * self.period
+
+    async def wait_next(self):
+        """
+        Wait until the next tick is due.
+
+        Returns:
+            tuple: The tick index and its scheduled wall-clock time.
+        """
+        if self.start_monotonic is None:
+            self.start()
+
+        deadline = self.start_monotonic + self.next_tick * self.period
+        now = time.monotonic()
+        if now < deadline:
+            await asyncio.sleep(deadline - now)
+            now = time.monotonic()
+
+        lateness = now - deadline
+        if lateness >= self.period:
+            # Skip the ticks whose deadline already passed instead of firing them late
+            skipped = int(lateness // self.period)
+            self.missed_ticks += skipped
+            self.next_tick += skipped
+            lateness -= skipped * self.period
+            logger.warning("Missed %d tick(s) (%d missed in total)", skipped, self.missed_ticks)
+        if lateness > self.late_tolerance:
+            self.late_ticks += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.last_lateness = lateness
+
+        tick = self.next_tick
+        self.next_tick += 1
+        self.ticks += 1
+        return tick, self.scheduled_time(tick)
+
+    def stats(self):
+        """
+        Get the scheduler counters.
+
+        Returns:
+            dict: Ticks fired, missed and late, and the worst lateness in seconds.
+        """
+        return {
+            "period": self.period,
+            "ticks": self.ticks,
+            "missed_ticks": self.missed_ticks,
+            "late_ticks": self.late_ticks,
+            "max_lateness": self.max_lateness,
+        }
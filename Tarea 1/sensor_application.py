@@ -0,0 +1,344 @@
+import asyncio
+import json
+import logging
+import time
+import argparse #type: ignore
+import data_capture_module
+from database import check_batch_settings
+from cli import parse_period, parse_intervals
+
+logger = logging.getLogger(__name__)
+
+
+# Optional per-sensor settings of the configuration file, with the conversion applied to each
+SENSOR_OPTIONS = {
+    "seed": int,
+    "buffer_capacity": int,
+    "rollup_intervals": parse_intervals,
+    "stream_batch_size": int,
+    "stream_linger": float,
+    "device": str,
+    "baudrate": int,
+    "anomaly_threshold": float,
+    "anomaly_alpha": float,
+    "anomaly_hot_value": int,
+    "anomaly_cooldown": float,
+    "deadband": int,
+    "heartbeat": float,
+}
+
+# Settings of a sensor accepted by the configure command, with the conversion applied to each
+SENSOR_SETTINGS = {
+    "reading_frequency": lambda value: parse_period(str(value)),
+    "min_value": int,
+    "max_value": int,
+    "stream_batch_size": int,
+    "stream_linger": float,
+}
+
+# Settings of the database writer accepted by the configure command, shared by every sensor
+WRITER_SETTINGS = {
+    "batch_size": int,
+    "batch_max_delay": float,
+}
+
+
+def load_sensors_config(path, min_buffer_capacity=1):
+    """
+    Load the list of sensors to run from a JSON file.
+
+    The file holds an object with a ``sensors`` list, where every entry has an
+    integer ``id``, a ``sensor_type``, a ``reading_frequency`` (seconds, or a
+    string with a unit suffix such as ``"100Hz"``) and, for mockup sensors,
+    ``min_value`` and ``max_value``, and for real sensors, a ``device``. An
+    entry with ``"autostart": true`` starts capturing as soon as the
+    application starts. Any of the ``SENSOR_OPTIONS`` may be given to override
+    the application defaults for that sensor.
+
+    Args:
+        path (str): Path to the JSON file.
+        min_buffer_capacity (int, optional): Smallest ``buffer_capacity`` accepted. Defaults to 1.
+
+    Returns:
+        list: One dictionary of settings per sensor.
+
+    Raises:
+        ValueError: If an entry is invalid.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    sensors = []
+    for entry in config.get("sensors", []):
+        try:
+            sensor = {
+                "sensor_id": int(entry["id"]),
+                "sensor_type": entry["sensor_type"],
+                "reading_frequency": parse_period(str(entry["reading_frequency"])),
+                "min_value": entry.get("min_value"),
+                "max_value": entry.get("max_value"),
+                "autostart": bool(entry.get("autostart", False)),
+            }
+            for option, convert in SENSOR_OPTIONS.items():
+                if entry.get(option) is not None:
+                    sensor[option] = convert(entry[option])
+            if sensor.get("buffer_capacity", min_buffer_capacity) < min_buffer_capacity:
+                raise ValueError(f"buffer_capacity must be at least {min_buffer_capacity}")
+        except (KeyError, TypeError, ValueError, argparse.ArgumentTypeError) as e:
+            raise ValueError(f"Invalid sensor entry {entry!r} in {path}: {e}")
+        sensors.append(sensor)
+    return sensors
+
+
+class SensorApplication:
+    """
+    Run many sensors concurrently on a single event loop.
+
+    Every sensor is a ``DataCapture`` with its own frequency and settings,
+    running as an independent asyncio task. All of them write through the
+    same ``DatabaseManager``, so they share one connection and one
+    background writer.
+    """
+
+    # Commands accepted on the ``sensors.<id>.<command>`` subjects
+    COMMANDS = ("start", "stop", "latest", "metrics", "configure")
+
+    def __init__(self, db, sensor_defaults=None):
+        """
+        Initialize SensorApplication object.
+
+        Args:
+            db (DatabaseManager): The object to handle database operations.
+            sensor_defaults (dict, optional): Options passed to every ``DataCapture``, unless overridden per sensor. Defaults to None.
+        """
+        self.db = db
+        self.sensor_defaults = dict(sensor_defaults or {})
+        self.sensors = {}
+        self.autostart = set()
+        # Health monitor of the event loop, included in the metrics when set
+        self.loop_monitor = None
+
+    def add_sensor(self, sensor_id, sensor_type, reading_frequency, min_value=None, max_value=None, autostart=False, **options):
+        """
+        Register a new sensor.
+
+        Args:
+            sensor_id (int): Unique identifier of the sensor.
+            sensor_type (str): Type of sensor to use, either 'mockup' or 'real'.
+            reading_frequency (float): The period in seconds between two sensor readings.
+            min_value (int, optional): Minimum value of generated data if sensor_type is 'mockup'. Defaults to None.
+            max_value (int, optional): Maximum value of generated data if sensor_type is 'mockup'. Defaults to None.
+            autostart (bool, optional): Whether ``start_application()`` starts the sensor. Defaults to False.
+            **options: Other ``DataCapture`` options, such as ``seed`` or ``rollup_intervals``, overriding ``sensor_defaults``.
+
+        Returns:
+            DataCapture: The capture object of the new sensor.
+        """
+        if sensor_id in self.sensors:
+            raise ValueError(f"Sensor {sensor_id} already registered")
+        sensor = data_capture_module.DataCapture(
+            self.db,
+            reading_frequency,
+            sensor_type,
+            min_value,
+            max_value,
+            sensor_id=sensor_id,
+            **{**self.sensor_defaults, **options}
+        )
+        self.sensors[sensor_id] = sensor
+        if autostart:
+            self.autostart.add(sensor_id)
+        logger.info("Registered sensor %s (%s, every %ss)", sensor_id, sensor_type, reading_frequency)
+        return sensor
+
+    def load_config(self, path):
+        """
+        Register every sensor listed in a JSON configuration file.
+
+        Args:
+            path (str): Path to the JSON file, see ``load_sensors_config()``.
+        """
+        for sensor in load_sensors_config(path):
+            self.add_sensor(**sensor)
+
+    def get_sensor(self, sensor_id):
+        """
+        Get the capture object of a sensor.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            DataCapture: The capture object of the sensor.
+
+        Raises:
+            KeyError: If no sensor with that identifier is registered.
+        """
+        try:
+            return self.sensors[sensor_id]
+        except KeyError:
+            raise KeyError(f"Unknown sensor {sensor_id}")
+
+    async def start_application(self):
+        """
+        Start every sensor configured to start automatically.
+        """
+        await asyncio.gather(*(self.sensors[sensor_id].start_capture() for sensor_id in sorted(self.autostart)))
+
+    async def start_all(self):
+        """
+        Start capturing on every registered sensor.
+        """
+        await asyncio.gather(*(sensor.start_capture() for sensor in self.sensors.values()))
+
+    async def stop_all(self):
+        """
+        Stop capturing on every registered sensor.
+        """
+        await asyncio.gather(*(sensor.stop_capture() for sensor in self.sensors.values() if sensor.capture_task))
+
+    def status(self, sensor_id):
+        """
+        Get the state of a sensor.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            dict: Identifier, type, period and whether the sensor is capturing.
+        """
+        sensor = self.get_sensor(sensor_id)
+        return {
+            "sensor_id": sensor.sensor_id,
+            "sensor_type": sensor.sensor_type,
+            "reading_frequency": sensor.reading_frequency,
+            "running": sensor.is_running(),
+        }
+
+    def get_data(self, sensor_id):
+        """
+        Get the latest reading of a sensor from memory, without querying the database.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            dict: Identifier of the sensor, time of the reading and its 64 values. The time and values are None if the sensor has no readings yet.
+        """
+        latest = self.get_sensor(sensor_id).ring_buffer.latest()
+        if latest is None:
+            return {"sensor_id": sensor_id, "reading_time": None, "data": None}
+        reading_time, frame = latest
+        return {"sensor_id": sensor_id, "reading_time": reading_time, "data": frame.tolist()}
+
+    def metrics(self, sensor_id):
+        """
+        Get the performance metrics of a sensor.
+
+        The batch commit latency and the writer queue depth are shared by every
+        sensor, since all of them write through the same background writer.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            dict: Identifier of the sensor, time of the snapshot, the counters and per-stage latency
+            histograms of ``metrics.SensorMetrics``, the scheduler counters, the writer counters and the
+            event loop health of ``loop_monitor.LoopMonitor``.
+        """
+        sensor = self.get_sensor(sensor_id)
+        snapshot = {"sensor_id": sensor_id, "timestamp": time.time()}
+        snapshot.update(sensor.metrics.snapshot())
+        snapshot["buffered_frames"] = len(sensor.ring_buffer)
+        snapshot["scheduler"] = sensor.scheduler.stats() if sensor.scheduler else None
+        snapshot["stream"] = sensor.publisher.stats() if sensor.publisher else None
+        snapshot["driver"] = sensor.driver.parser.stats() if sensor.driver else None
+        snapshot["anomaly"] = sensor.detector.stats() if sensor.detector else None
+        snapshot["deadband"] = sensor.deadband.stats() if sensor.deadband else None
+        snapshot["forward"] = sensor.forwarder.stats() if sensor.forwarder else None
+        snapshot["loop"] = self.loop_monitor.stats() if self.loop_monitor else None
+        writer = self.db.writer
+        if writer is not None:
+            writer_stats = writer.stats()
+            snapshot["stages"]["commit"] = writer_stats.pop("commit")
+            snapshot["queue_depth"] = writer_stats.pop("queue_depth")
+            snapshot["writer"] = writer_stats
+        return snapshot
+
+    async def configure(self, sensor_id, settings):
+        """
+        Change settings of a sensor, and of the database writer, while it runs.
+
+        Every setting is checked before any is applied. Sensor settings take
+        effect at the next tick of the sensor, writer settings at its next batch.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            settings (dict): New values of any of the ``SENSOR_SETTINGS`` and ``WRITER_SETTINGS``.
+
+        Returns:
+            dict: Identifier of the sensor and the settings in effect, including the writer ones when it is running.
+
+        Raises:
+            ValueError: If a setting is unknown or invalid.
+        """
+        sensor = self.get_sensor(sensor_id)
+        if not isinstance(settings, dict):
+            raise ValueError("The configuration must be a JSON object")
+        sensor_settings, writer_settings = {}, {}
+        for name, value in settings.items():
+            if name in SENSOR_SETTINGS:
+                target, convert = sensor_settings, SENSOR_SETTINGS[name]
+            elif name in WRITER_SETTINGS:
+                target, convert = writer_settings, WRITER_SETTINGS[name]
+            else:
+                raise ValueError(f"Unknown setting {name!r}")
+            try:
+                target[name] = convert(value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+                raise ValueError(f"Invalid value of {name}: {e}")
+
+        writer = self.db.writer
+        if writer_settings:
+            if writer is None:
+                raise ValueError("The database writer is not running")
+            check_batch_settings(writer_settings.get("batch_size"), writer_settings.get("batch_max_delay"))
+        config = await sensor.configure(**sensor_settings)
+        if writer_settings:
+            writer.configure(writer_settings.get("batch_size"), writer_settings.get("batch_max_delay"))
+
+        response = {"sensor_id": sensor_id}
+        response.update(config)
+        if writer is not None:
+            response["batch_size"] = writer.batch_size
+            response["batch_max_delay"] = writer.max_delay
+        return response
+
+    async def process_command(self, sensor_id, command, payload=None):
+        """
+        Run a control command on a sensor.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+            command (str): One of ``COMMANDS``.
+            payload (bytes, optional): Body of the command message; for ``configure``, a JSON object
+                of settings (empty to leave them unchanged). Defaults to None.
+
+        Returns:
+            dict: The state of the sensor after running the command, its latest reading for ``latest``,
+            its performance metrics for ``metrics`` or its settings for ``configure``.
+        """
+        sensor = self.get_sensor(sensor_id)
+        if command == "start":
+            await sensor.start_capture()
+        elif command == "stop":
+            await sensor.stop_capture()
+        elif command == "latest":
+            return self.get_data(sensor_id)
+        elif command == "metrics":
+            return self.metrics(sensor_id)
+        elif command == "configure":
+            return await self.configure(sensor_id, json.loads(payload) if payload else {})
+        else:
+            raise ValueError(f"Unknown command {command!r}")
+        return self.status(sensor_id)
@@ -0,0 +1,407 @@
+import asyncio
+import binascii
+import logging
+import os
+import struct
+import numpy as np
+from frame_generator import FRAME_PIXELS, FRAME_DTYPE
+
+try:
+    import termios
+    import tty
+except ImportError:
+    # Not available on Windows, where device paths cannot be used
+    termios = None
+
+logger = logging.getLogger(__name__)
+
+# Marks the start of every frame on the wire
+SYNC_WORD = b"\xaa\x55"
+
+# Header of a frame after the sync word: sequence number
+FRAME_HEADER = struct.Struct("<H")
+
+# Checksum at the end of a frame: CRC-16/CCITT of the header and the values
+FRAME_CRC = struct.Struct("<H")
+
+# Initial value of the CRC-16/CCITT checksum
+CRC_INIT = 0xFFFF
+
+# Byte order of the frame values on the wire
+WIRE_DTYPE = np.dtype("<u2")
+
+# Total size in bytes of a frame on the wire: sync word, header, 64 values and checksum
+FRAME_SIZE = len(SYNC_WORD) + FRAME_HEADER.size + FRAME_PIXELS * WIRE_DTYPE.itemsize + FRAME_CRC.size
+
+# Offsets of the value bytes within a frame
+VALUE_OFFSETS = np.arange(len(SYNC_WORD) + FRAME_HEADER.size, FRAME_SIZE - FRAME_CRC.size)
+
+# Maximum number of bytes read from a device at once
+READ_SIZE = 64 * 1024
+
+
+def encode_frame(seq, frame):
+    """
+    Encode a frame in the wire format of ``FrameParser``, as a sensor sends it.
+
+    Args:
+        seq (int): Sequence number of the frame, wrapping at 65536.
+        frame (numpy.ndarray): The 64 frame values.
+
+    Returns:
+        bytes: The encoded frame.
+    """
+    body = FRAME_HEADER.pack(seq & 0xFFFF) + np.asarray(frame, dtype=WIRE_DTYPE).tobytes()
+    return SYNC_WORD + body + FRAME_CRC.pack(binascii.crc_hqx(body, CRC_INIT))
+
+
+class FrameParser:
+    """
+    Incremental parser of the frames sent by a real sensor.
+
+    Every frame on the wire is made of the sync word ``AA 55``, a
+    little-endian ``uint16`` sequence number, the 64 little-endian ``uint16``
+    values and the little-endian CRC-16/CCITT (initial value ``FFFF``) of the
+    sequence number and values. Bytes may be fed in chunks of any size. When
+    a frame fails its checksum, or bytes arrive that do not start with the
+    sync word, the parser skips ahead to the next sync word, so a corrupted
+    or truncated frame costs that frame only. A frame repeating the sequence
+    number of the previous one is a duplicate, and is dropped.
+
+    The 16-bit sequence numbers are unwrapped into a running frame index,
+    which counts the lost frames too: ``indexes`` holds the index of every
+    frame returned by the last ``feed()``, for ``FrameClock``.
+    """
+
+    def __init__(self):
+        """
+        Initialize FrameParser object.
+        """
+        self.buffer = bytearray()
+        self.next_seq = None
+        self.next_index = 0
+        self.indexes = np.empty(0, dtype=np.int64)
+        self.frames_parsed = 0
+        self.frames_lost = 0
+        self.frames_duplicated = 0
+        self.crc_errors = 0
+        self.bytes_skipped = 0
+
+    def feed(self, data):
+        """
+        Parse the frames completed by new bytes.
+
+        Args:
+            data (bytes-like): Bytes received from the sensor.
+
+        Returns:
+            numpy.ndarray: The complete, valid frames as a ``uint16`` array of shape (count, 64), possibly empty.
+        """
+        buffer = self.buffer
+        buffer += data
+        positions = []
+        indexes = []
+        pos = 0
+        last = len(buffer) - FRAME_SIZE
+        with memoryview(buffer) as view:
+            while pos <= last:
+                if not buffer.startswith(SYNC_WORD, pos):
+                    found = buffer.find(SYNC_WORD, pos)
+                    if found < 0:
+                        # Keep the last byte, which may be the first half of a sync word
+                        found = len(buffer) - 1
+                    self.bytes_skipped += found - pos
+                    pos = found
+                    continue
+                crc, = FRAME_CRC.unpack_from(buffer, pos + FRAME_SIZE - FRAME_CRC.size)
+                if binascii.crc_hqx(view[pos + len(SYNC_WORD):pos + FRAME_SIZE - FRAME_CRC.size], CRC_INIT) != crc:
+                    # Not a frame, or a corrupted one: look for the next sync word after this one
+                    self.crc_errors += 1
+                    self.bytes_skipped += 1
+                    pos += 1
+                    continue
+                seq, = FRAME_HEADER.unpack_from(buffer, pos + len(SYNC_WORD))
+                if self.next_seq is not None and seq == (self.next_seq - 1) & 0xFFFF:
+                    # The same frame sent twice, not a wrap-around of the sequence numbers
+                    self.frames_duplicated += 1
+                    pos += FRAME_SIZE
+                    continue
+                if self.next_seq is not None:
+                    lost = (seq - self.next_seq) & 0xFFFF
+                    self.frames_lost += lost
+                    self.next_index += lost
+                self.next_seq = (seq + 1) & 0xFFFF
+                positions.append(pos)
+                indexes.append(self.next_index)
+                self.next_index += 1
+                pos += FRAME_SIZE
+
+        frames = np.empty((0, FRAME_PIXELS), dtype=FRAME_DTYPE)
+        if positions:
+            # Gather the value bytes of every frame at once, then read them as uint16
+            raw = np.frombuffer(buffer, dtype=np.uint8, count=pos)
+            values = raw[np.array(positions)[:, None] + VALUE_OFFSETS]
+            del raw
+            frames = values.view(WIRE_DTYPE).astype(FRAME_DTYPE, copy=False)
+            self.frames_parsed += len(positions)
+        self.indexes = np.array(indexes, dtype=np.int64)
+        del buffer[:pos]
+        return frames
+
+    def stats(self):
+        """
+        Get the parser counters.
+
+        Returns:
+            dict: Frames parsed, frames lost (gaps in the sequence numbers), duplicated frames dropped,
+            checksum errors and bytes skipped while resynchronizing.
+        """
+        return {
+            "frames_parsed": self.frames_parsed,
+            "frames_lost": self.frames_lost,
+            "frames_duplicated": self.frames_duplicated,
+            "crc_errors": self.crc_errors,
+            "bytes_skipped": self.bytes_skipped,
+        }
+
+
+class FrameClock:
+    """
+    Timestamps of the frames a real sensor pushes at a nominal period.
+
+    Frames arrive in bursts, so the time a burst is read says little about
+    when its frames were taken. The last frame of a burst is given the time
+    the burst was parsed, and the frames before it are spaced back by the
+    nominal period, following their frame indexes, so lost frames leave
+    their gap in time. A burst that would start before the last frame of the
+    previous one, such as a backlog read at once, is spread evenly between
+    that frame and its arrival instead, so times keep increasing.
+    """
+
+    def __init__(self):
+        """
+        Initialize FrameClock object.
+        """
+        self.last_index = None
+        self.last_time = None
+
+    def reset(self):
+        """
+        Forget the frame index of the previous burst, when the connection to the sensor is reopened.
+
+        Its time is kept, so the times of the next frames still come after it.
+        """
+        self.last_index = None
+
+    def times(self, indexes, arrival, period):
+        """
+        Get the reading times of the frames of a burst.
+
+        Args:
+            indexes (numpy.ndarray): Frame indexes of the burst, see ``FrameParser.indexes``.
+            arrival (float): Time the burst was parsed as a Unix timestamp.
+            period (float): Nominal time in seconds between two frames of the sensor.
+
+        Returns:
+            numpy.ndarray: One ``float64`` timestamp per frame, increasing.
+        """
+        times = arrival - (indexes[-1] - indexes) * period
+        if self.last_time is not None and times[0] <= self.last_time:
+            # Without the index of the previous frame, the burst follows it at once
+            last_index = self.last_index if self.last_index is not None else indexes[0] - 1
+            times = self.last_time + (indexes - last_index) * (arrival - self.last_time) / (indexes[-1] - last_index)
+        self.last_index = int(indexes[-1])
+        self.last_time = float(times[-1])
+        return times
+
+
+class SensorDriver:
+    """
+    Base class of the drivers reading frames from a real sensor.
+
+    A driver opens an asyncio stream to the sensor and parses what it reads
+    with a ``FrameParser``. Reads never block the event loop: the loop only
+    wakes the driver up when bytes have arrived. Subclasses implement
+    ``_open()``, which returns the stream reader of the connection. Stream
+    connections keep their writer too, since the transport is closed when
+    the writer is garbage collected.
+    """
+
+    def __init__(self):
+        """
+        Initialize SensorDriver object.
+        """
+        self.parser = FrameParser()
+        self.reader = None
+        self.writer = None
+        self.transport = None
+
+    async def _open(self):
+        """
+        Open the connection to the sensor.
+
+        Returns:
+            asyncio.StreamReader: The reader of the connection.
+        """
+        raise NotImplementedError
+
+    async def open(self):
+        """
+        Open the connection to the sensor, starting the parser afresh.
+        """
+        self.parser.buffer.clear()
+        self.parser.next_seq = None
+        self.reader = await self._open()
+
+    async def read_frames(self):
+        """
+        Wait for the next frames sent by the sensor.
+
+        Returns:
+            numpy.ndarray: One or more frames as a ``uint16`` array of shape (count, 64).
+
+        Raises:
+            EOFError: If the sensor closed the connection.
+        """
+        while True:
+            data = await self.reader.read(READ_SIZE)
+            if not data:
+                raise EOFError("The sensor closed the connection")
+            frames = self.parser.feed(data)
+            if len(frames):
+                return frames
+
+    def close(self):
+        """
+        Close the connection to the sensor.
+        """
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        self.reader = None
+        self.writer = None
+
+
+class TcpDriver(SensorDriver):
+    """
+    Driver of a sensor sending its frames over a TCP connection.
+    """
+
+    def __init__(self, host, port):
+        """
+        Initialize TcpDriver object.
+
+        Args:
+            host (str): Address of the sensor.
+            port (int): Port of the sensor.
+        """
+        super().__init__()
+        self.host = host
+        self.port = port
+
+    async def _open(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.transport = self.writer.transport
+        return reader
+
+
+class UnixDriver(SensorDriver):
+    """
+    Driver of a sensor sending its frames over a Unix domain socket.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize UnixDriver object.
+
+        Args:
+            path (str): Path of the socket.
+        """
+        super().__init__()
+        self.path = path
+
+    async def _open(self):
+        reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.transport = self.writer.transport
+        return reader
+
+
+class SocketDriver(SensorDriver):
+    """
+    Driver of a sensor on an already connected socket, such as one end of a ``socket.socketpair()``.
+    """
+
+    def __init__(self, sock):
+        """
+        Initialize SocketDriver object.
+
+        Args:
+            sock (socket.socket): The connected socket.
+        """
+        super().__init__()
+        self.sock = sock
+
+    async def _open(self):
+        reader, self.writer = await asyncio.open_connection(sock=self.sock)
+        self.transport = self.writer.transport
+        return reader
+
+
+class DeviceDriver(SensorDriver):
+    """
+    Driver of a sensor behind a character device, such as a serial port or a pty.
+
+    Terminals are switched to raw mode, so bytes are delivered as they
+    arrive, and set to ``baudrate`` when one is given.
+    """
+
+    def __init__(self, path, baudrate=None):
+        """
+        Initialize DeviceDriver object.
+
+        Args:
+            path (str): Path of the device.
+            baudrate (int, optional): Speed of the serial port. Defaults to None (unchanged).
+        """
+        super().__init__()
+        self.path = path
+        self.baudrate = baudrate
+
+    async def _open(self):
+        if termios is None:
+            raise OSError("Sensor devices are not supported on this platform")
+        fd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK | os.O_NOCTTY)
+        try:
+            if os.isatty(fd):
+                tty.setraw(fd)
+                if self.baudrate:
+                    attributes = termios.tcgetattr(fd)
+                    attributes[4] = attributes[5] = getattr(termios, f"B{self.baudrate}")
+                    termios.tcsetattr(fd, termios.TCSANOW, attributes)
+            device = os.fdopen(fd, "rb", buffering=0)
+        except (OSError, AttributeError) as e:
+            os.close(fd)
+            raise OSError(f"Cannot configure {self.path}: {e}")
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader(limit=READ_SIZE)
+        self.transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), device)
+        return reader
+
+
+def open_driver(device, baudrate=None):
+    """
+    Create the driver of a real sensor from the description of its device.
+
+    Args:
+        device (str): ``tcp://<host>:<port>``, ``unix://<path>`` or the path of a character device or serial port.
+        baudrate (int, optional): Speed of a serial port. Defaults to None.
+
+    Returns:
+        SensorDriver: The driver, not opened yet.
+    """
+    if device.startswith("tcp://"):
+        host, _, port = device[len("tcp://"):].rpartition(":")
+        return TcpDriver(host, int(port))
+    if device.startswith("unix://"):
+        return UnixDriver(device[len("unix://"):])
+    return DeviceDriver(device, baudrate)
@@ -0,0 +1,468 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import cli
+import database
+import logging_setup
+import query_protocol
+from data_capture_module import DEFAULT_BUFFER_CAPACITY
+from loop_monitor import LoopMonitor
+from nats_client_dev import NATSClient
+from ring_buffer import SharedFrameRingBuffer, MIN_SHARED_CAPACITY
+from sensor_application import SensorApplication, load_sensors_config
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the subjects a worker process listens on
+WORKER_SUBJECT = "workers.{}"
+
+# Commands every worker process answers on ``workers.<shard>.<command>``
+WORKER_COMMANDS = ("start_all", "stop_all", "shutdown")
+
+# Time in seconds a worker process is given to start, to answer a command or to exit
+WORKER_TIMEOUT = 30.0
+
+
+def shard_of(sensor_id, workers):
+    """
+    Get the worker process a sensor runs on.
+
+    Args:
+        sensor_id (int): Identifier of the sensor.
+        workers (int): Number of worker processes.
+
+    Returns:
+        int: The shard of the sensor, between 0 and ``workers - 1``.
+    """
+    return sensor_id % workers
+
+
+def shard_path(path, shard):
+    """
+    Get the path of a file owned by one worker process, such as its database.
+
+    The shard is inserted before the extension, so ``infrared.db`` becomes
+    ``infrared.worker0.db`` and ``framelog://frames`` becomes
+    ``framelog://frames.worker0``.
+
+    Args:
+        path (str): Path or database URI given on the command line.
+        shard (int): The shard of the worker process.
+
+    Returns:
+        str: The path of the worker process.
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker{shard}{extension}"
+
+
+class WorkerClient(NATSClient):
+    """
+    NATS client of a worker process.
+
+    It answers the sensor commands and queries the coordinator forwards to
+    its shard on ``workers.<shard>.sensors.<id>.<command>`` and
+    ``workers.<shard>.query``, replying straight to the original requester,
+    and the commands of the coordinator on ``workers.<shard>.<command>``.
+    """
+
+    def __init__(self, server, db, args, exit_event, app, shard):
+        """
+        Initialize WorkerClient object.
+
+        Args:
+            server (str): The NATS server URL.
+            db (DatabaseManager): The database of the shard.
+            args (argparse.Namespace): Parsed command-line arguments containing configurations.
+            exit_event (asyncio.Event): Event set to signal the worker to shut down.
+            app (SensorApplication): The application running the sensors of the shard.
+            shard (int): The shard of the worker process.
+        """
+        super().__init__(server, db, args, exit_event, app)
+        self.shard = shard
+        self.prefix = WORKER_SUBJECT.format(shard)
+
+    async def subscribe_worker(self):
+        """
+        Subscribe to the subjects of the shard, and wait for the server to have registered them.
+        """
+        await self.subscribe(f"{self.prefix}.sensors.*.*", cb=self.sensor_handler)
+        await self.subscribe(f"{self.prefix}.query", cb=self.query_handler)
+        for command in WORKER_COMMANDS:
+            await self.subscribe(f"{self.prefix}.{command}", cb=self.worker_handler)
+        await self.nc.flush()
+
+    async def worker_handler(self, msg):
+        """
+        Handle the commands of the coordinator, replying with the state of every sensor of the shard.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        command = msg.subject.rsplit(".", 1)[1]
+        logger.info("Worker %s received %s", self.shard, command)
+        if command == "start_all":
+            await self.app.start_all()
+        elif command == "stop_all":
+            await self.app.stop_all()
+        elif command == "shutdown":
+            self.exit_event.set()
+        if msg.reply:
+            response = {"shard": self.shard, "sensors": [self.app.status(sensor_id) for sensor_id in sorted(self.app.sensors)]}
+            await self.nc.publish(msg.reply, json.dumps(response).encode())
+
+
+async def serve_worker(shard, args, sensors, rings, server, ready):
+    """
+    Run the sensors of a shard until the coordinator shuts the worker down.
+
+    Args:
+        shard (int): The shard of the worker process.
+        args (argparse.Namespace): Parsed command-line arguments containing configurations.
+        sensors (list): Settings of the sensors of the shard, as returned by ``load_sensors_config()``.
+        rings (dict): Name of the shared ring buffer of every sensor, by identifier.
+        server (str): The NATS server URL.
+        ready (multiprocessing.Event): Event set once the worker serves its subjects.
+    """
+    # Every worker stores its own sensors in its own database, so workers never contend for a lock
+    db = database.open_database(shard_path(args.db_uri, shard), **cli.database_options(args))
+    db.connect()
+    writer_options = cli.writer_options(args)
+    if args.spill_path:
+        writer_options["spill_path"] = shard_path(args.spill_path, shard)
+    db.start_writer(**writer_options)
+
+    app = SensorApplication(db, cli.sensor_options(args))
+    # Every worker runs its own event loop, so it measures its own
+    if args.loop_monitor_interval:
+        app.loop_monitor = LoopMonitor(**cli.loop_monitor_options(args))
+        app.loop_monitor.start()
+    exit_event = asyncio.Event()
+    client = WorkerClient(server, db, args, exit_event, app, shard)
+    app.sensor_defaults["publish_alerts"] = client.publish
+    if args.stream:
+        app.sensor_defaults.update(
+            publish=client.publish,
+            stream_batch_size=args.stream_batch_size,
+            stream_linger=args.stream_linger
+        )
+    # Recent frames go to shared memory, where the coordinator reads them without asking the worker
+    buffers = [SharedFrameRingBuffer.attach(rings[sensor["sensor_id"]]) for sensor in sensors]
+
+    metrics_task = None
+    try:
+        await client.connect()
+        # Live messages must fit in the largest payload the server accepts
+        if args.stream:
+            app.sensor_defaults["stream_max_payload"] = client.nc.max_payload
+        for sensor, ring_buffer in zip(sensors, buffers):
+            app.add_sensor(**sensor, ring_buffer=ring_buffer)
+        await client.subscribe_worker()
+        ready.set()
+        await app.start_application()
+        if args.metrics_interval > 0:
+            metrics_task = asyncio.create_task(client.publish_metrics(args.metrics_interval))
+        await exit_event.wait()
+    finally:
+        if metrics_task is not None:
+            metrics_task.cancel()
+        await app.stop_all()
+        db.close()
+        if client.nc is not None:
+            await asyncio.wait_for(client.nc.close(), timeout=5)
+        for ring_buffer in buffers:
+            ring_buffer.close()
+        if app.loop_monitor is not None:
+            await app.loop_monitor.stop()
+        logger.info("Worker %s stopped", shard)
+
+
+def run_worker(shard, args, sensors, rings, server, ready):
+    """
+    Entry point of a worker process.
+
+    The worker logs to its own file, next to the one of the coordinator, and
+    ignores Ctrl+C, which the coordinator turns into an orderly shutdown.
+
+    Args:
+        shard (int): The shard of the worker process.
+        args (argparse.Namespace): Parsed command-line arguments containing configurations.
+        sensors (list): Settings of the sensors of the shard.
+        rings (dict): Name of the shared ring buffer of every sensor, by identifier.
+        server (str): The NATS server URL.
+        ready (multiprocessing.Event): Event set once the worker serves its subjects.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging_setup.configure_logging(
+        args.log_level,
+        shard_path(args.log_file, shard) if args.log_file else None,
+        max_bytes=args.log_max_bytes,
+        backup_count=args.log_backup_count,
+        sample_every=args.log_sample_every
+    )
+    try:
+        asyncio.run(serve_worker(shard, args, sensors, rings, server, ready))
+    except Exception as e:
+        logger.error("Worker %s failed: %s", shard, e)
+        raise
+    finally:
+        logging_setup.stop_logging()
+
+
+class WorkerPool:
+    """
+    Worker processes running the sensors of a configuration file, sharded by sensor identifier.
+
+    Sensor ``n`` runs on worker ``n % workers``. The pool creates the shared
+    ring buffer of every sensor before starting the workers, so it owns them
+    and frees them once the workers have exited, even if one of them crashed.
+    Workers are started with ``spawn``, so they do not inherit the event
+    loop, threads or open connections of the coordinator.
+    """
+
+    def __init__(self, args, sensors, workers, server):
+        """
+        Initialize WorkerPool object.
+
+        Args:
+            args (argparse.Namespace): Parsed command-line arguments, passed on to the workers.
+            sensors (list): Settings of every sensor, as returned by ``load_sensors_config()``.
+            workers (int): Number of worker processes.
+            server (str): The NATS server URL.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.args = args
+        self.workers = workers
+        self.server = server
+        self.shards = [[] for _ in range(workers)]
+        for sensor in sensors:
+            self.shards[shard_of(sensor["sensor_id"], workers)].append(sensor)
+        self.rings = {}
+        self.processes = []
+        self.context = multiprocessing.get_context("spawn")
+
+    def shard(self, sensor_id):
+        """
+        Get the worker process running a sensor.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            int: The shard of the sensor.
+
+        Raises:
+            KeyError: If no sensor with that identifier is configured.
+        """
+        if sensor_id not in self.rings:
+            raise KeyError(f"Unknown sensor {sensor_id}")
+        return shard_of(sensor_id, self.workers)
+
+    async def start(self):
+        """
+        Start the worker processes and wait for them to serve their subjects.
+
+        Raises:
+            RuntimeError: If a worker does not start within ``WORKER_TIMEOUT`` seconds.
+        """
+        for sensors in self.shards:
+            for sensor in sensors:
+                capacity = sensor.get("buffer_capacity", DEFAULT_BUFFER_CAPACITY)
+                self.rings[sensor["sensor_id"]] = SharedFrameRingBuffer(capacity)
+
+        events = []
+        for shard, sensors in enumerate(self.shards):
+            ready = self.context.Event()
+            names = {sensor["sensor_id"]: self.rings[sensor["sensor_id"]].name for sensor in sensors}
+            process = self.context.Process(
+                target=run_worker,
+                args=(shard, self.args, sensors, names, self.server, ready),
+                name=f"worker-{shard}",
+                daemon=True
+            )
+            process.start()
+            self.processes.append(process)
+            events.append(ready)
+            logger.info("Started worker %s (pid %s) with sensors %s", shard, process.pid, [sensor["sensor_id"] for sensor in sensors])
+
+        for shard, ready in enumerate(events):
+            if not await asyncio.to_thread(ready.wait, WORKER_TIMEOUT):
+                raise RuntimeError(f"Worker {shard} did not start")
+
+    def get_data(self, sensor_id):
+        """
+        Get the latest reading of a sensor from its shared ring buffer.
+
+        Args:
+            sensor_id (int): Identifier of the sensor.
+
+        Returns:
+            dict: Identifier of the sensor, time of the reading and its 64 values, as ``SensorApplication.get_data()``.
+        """
+        self.shard(sensor_id)
+        latest = self.rings[sensor_id].latest()
+        if latest is None:
+            return {"sensor_id": sensor_id, "reading_time": None, "data": None}
+        reading_time, frame = latest
+        return {"sensor_id": sensor_id, "reading_time": reading_time, "data": frame.tolist()}
+
+    async def stop(self):
+        """
+        Wait for the worker processes to exit, terminating those that do not, and free the shared ring buffers.
+        """
+        for process in self.processes:
+            await asyncio.to_thread(process.join, WORKER_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Terminating worker %s", process.name)
+                process.terminate()
+                await asyncio.to_thread(process.join)
+        self.processes.clear()
+        for ring_buffer in self.rings.values():
+            ring_buffer.close()
+            ring_buffer.unlink()
+        self.rings.clear()
+
+
+class CoordinatorClient(NATSClient):
+    """
+    NATS client of the coordinator process.
+
+    It keeps serving the ``test.*``, ``sensors.<id>.<command>`` and
+    ``sensors.query`` subjects. The latest reading of a sensor is read from
+    shared memory; every other command and query is forwarded to the worker
+    running the sensor, with the reply subject of the requester, so the
+    worker answers it directly and the reply does not go through the
+    coordinator.
+    """
+
+    def __init__(self, server, args, exit_event, pool):
+        """
+        Initialize CoordinatorClient object.
+
+        Args:
+            server (str): The NATS server URL.
+            args (argparse.Namespace): Parsed command-line arguments containing configurations.
+            exit_event (asyncio.Event): Event set to signal the coordinator to shut down.
+            pool (WorkerPool): The worker processes.
+        """
+        super().__init__(server, None, args, exit_event)
+        self.pool = pool
+
+    async def broadcast(self, command):
+        """
+        Send a command to every worker process.
+
+        Args:
+            command (str): One of ``WORKER_COMMANDS``.
+
+        Returns:
+            list: The replies of the workers that answered in time.
+        """
+        async def request(shard):
+            try:
+                msg = await self.nc.request(f"{WORKER_SUBJECT.format(shard)}.{command}", b"", timeout=WORKER_TIMEOUT)
+                return json.loads(msg.data)
+            except Exception as e:
+                logger.error("Worker %s did not answer %s: %s", shard, command, e)
+                return None
+
+        replies = await asyncio.gather(*(request(shard) for shard in range(self.pool.workers)))
+        return [reply for reply in replies if reply is not None]
+
+    async def message_handler(self, msg):
+        """
+        Handle the ``test.*`` subjects, running the capture commands on every worker process.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        logger.info(f"Received message: {msg.subject} {msg.data.decode()}")
+        if msg.subject == "test.start_capture":
+            await self.broadcast("start_all")
+        elif msg.subject == "test.stop_capture":
+            await self.broadcast("stop_all")
+        elif msg.subject == "test.shutdown":
+            logger.info("Shutting down...")
+            self.exit_event.set()
+
+    async def sensor_handler(self, msg):
+        """
+        Answer ``sensors.<id>.latest`` from shared memory, and forward the other commands to the worker of the sensor.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        if not msg.reply and msg.subject.endswith(".metrics"):
+            return
+        try:
+            _, sensor_id, command = msg.subject.split(".")
+            sensor_id = int(sensor_id)
+            shard = self.pool.shard(sensor_id)
+            if command != "latest":
+                await self.nc.publish(f"{WORKER_SUBJECT.format(shard)}.{msg.subject}", msg.data, reply=msg.reply)
+                return
+            response = self.pool.get_data(sensor_id)
+        except (ValueError, KeyError) as e:
+            logger.warning("Invalid sensor command %s: %s", msg.subject, e)
+            response = {"error": e.args[0] if e.args else str(e)}
+        if msg.reply:
+            await self.nc.publish(msg.reply, json.dumps(response).encode())
+
+    async def query_handler(self, msg):
+        """
+        Forward a query to the worker storing the readings of its sensor.
+
+        Args:
+            msg (nats.aio.msg.Msg): The received NATS message object.
+        """
+        if not msg.reply:
+            logger.warning("Ignoring query sent without a reply subject")
+            return
+        try:
+            request = query_protocol.parse_query_request(msg.data)
+            shard = self.pool.shard(request["sensor_id"])
+        except (ValueError, KeyError) as e:
+            logger.warning("Invalid query: %s", e)
+            await self.nc.publish(msg.reply, query_protocol.encode_error("json", e.args[0] if e.args else str(e)))
+            return
+        await self.nc.publish(f"{WORKER_SUBJECT.format(shard)}.query", msg.data, reply=msg.reply)
+
+
+async def run_coordinator(args, server="nats://localhost:4222"):
+    """
+    Run the sensors of ``--sensors-config`` on ``--workers`` worker processes, until shut down.
+
+    Args:
+        args (argparse.Namespace): Parsed command-line arguments containing configurations.
+        server (str, optional): The NATS server URL. Defaults to the local server.
+    """
+    try:
+        # Recent frames go to shared ring buffers, which need room for a reader and a writer
+        sensors = load_sensors_config(args.sensors_config, min_buffer_capacity=MIN_SHARED_CAPACITY)
+    except ValueError as e:
+        logger.error(f"Invalid sensors configuration: {e}")
+        return
+    pool = WorkerPool(args, sensors, args.workers, server)
+    exit_event = asyncio.Event()
+    client = CoordinatorClient(server, args, exit_event, pool)
+    try:
+        await client.connect()
+    except Exception as e:
+        logger.error(f"Error connecting to NATS server: {e}")
+        return
+
+    try:
+        await pool.start()
+        await client.subscribe("test.*", cb=client.message_handler)
+        await client.subscribe_sensors()
+        await client.subscribe("sensors.query", cb=client.query_handler)
+        await exit_event.wait()
+    finally:
+        # Workers stop their sensors and flush their writers before exiting
+        await client.broadcast("shutdown")
+        await pool.stop()
+        await asyncio.wait_for(client.nc.close(), timeout=5)
@@ -1,12 +1,49 @@
 import asyncio
+import os
+import sqlite3
+import struct
+import tempfile
+import time
 import unittest
 from unittest import mock
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, AsyncMock
 from nats_client_dev import NATSClient
 from data_capture_module import DataCapture
-from database import DatabaseManager
-from main import main
-from cli import parse_args
+from database import DatabaseManager, BatchWriter, INSERT_FRAME_QUERY, FrameLogDatabase, open_database
+from main import main, run as run_main
+from cli import parse_args, parse_period, parse_duration
+from scheduler import TickScheduler
+from sensor_application import SensorApplication, load_sensors_config
+import json
+import numpy as np
+from frame_generator import MockupFrameGenerator
+from ring_buffer import FrameRingBuffer, SharedFrameRingBuffer
+import query_protocol
+from rollup import RollupAggregator, merge_rollup_rows
+import frame_codec
+from partitions import PartitionScheme
+import logging
+from logging.handlers import QueueHandler
+import logging_setup
+from metrics import LatencyHistogram
+from loop_monitor import LoopMonitor
+from local_broker import LocalBroker, subject_matches
+import benchmark
+import frame_stream
+from frame_stream import FramePublisher, decode_frames
+from framelog import FrameLog, RECORD_DTYPE, HEADER_DTYPE
+import sensor_drivers
+from sensor_drivers import FrameParser, DeviceDriver, SocketDriver, encode_frame
+import socket
+import sharding
+from anomaly import AnomalyDetector
+from deadband import DeadbandFilter, expand_runs
+import export
+import collector
+import cli
+from frame_stream import encode_frames
+import nats
+import argparse
 import warnings
 
 # Ignore coroutine warnings (Only raised when closing NATS connection due to strange error)
@@ -86,6 +123,102 @@ class TestDataCapture(unittest.TestCase):
         with self.assertRaises(ValueError):
             data_capture.read_data()
 
+    def test_start_capture_validates_range(self):
+        """
+        Tests that start_capture() rejects an inverted value range before
+        the capture loop task is created.
+        """
+        data_capture = DataCapture(None, 1, 'mockup', 100, 50)
+        with self.assertRaises(ValueError):
+            asyncio.run(data_capture.start_capture())
+        self.assertIsNone(data_capture.capture_task)
+
+    def test_seeded_sensors_are_reproducible(self):
+        """
+        Tests that two sensors with the same seed and identifier produce the
+        same frames, and that the identifier gives each sensor its own stream.
+        """
+        first = DataCapture(None, 1, 'mockup', 0, 1000, sensor_id=1, seed=42)
+        second = DataCapture(None, 1, 'mockup', 0, 1000, sensor_id=1, seed=42)
+        other = DataCapture(None, 1, 'mockup', 0, 1000, sensor_id=2, seed=42)
+        frame = first.read_frame()
+        self.assertTrue(np.array_equal(frame, second.read_frame()))
+        self.assertFalse(np.array_equal(frame, other.read_frame()))
+
+    def test_dropped_frames_are_not_counted_as_written(self):
+        """
+        Tests that frames the storage queue drops are counted as dropped and
+        not as written.
+        """
+        db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.side_effect": [True, False, True]})
+        data_capture = DataCapture(db, 0.01, 'mockup', 0, 100)
+
+        async def run():
+            for i in range(3):
+                await data_capture.store_frame(float(i), data_capture.read_frame(), None, time.perf_counter())
+
+        asyncio.run(run())
+        self.assertEqual(data_capture.metrics.bytes_written, 2 * 128)
+        self.assertEqual(data_capture.metrics.frames_dropped, 1)
+
+class TestMockupFrameGenerator(unittest.TestCase):
+    def test_frames_batch(self):
+        """
+        Tests that a batch of frames is a contiguous uint16 array of shape
+        (count, 64) with every value inside the requested range, both ends included.
+        """
+        frames = MockupFrameGenerator(3, 5, seed=0).frames(1000)
+        self.assertEqual(frames.shape, (1000, 64))
+        self.assertEqual(frames.dtype, np.uint16)
+        self.assertTrue(frames.flags['C_CONTIGUOUS'])
+        self.assertEqual(set(np.unique(frames).tolist()), {3, 4, 5})
+
+    def test_invalid_range(self):
+        """
+        Tests that inverted, missing and out of range limits are rejected.
+        """
+        for min_value, max_value in ((10, 5), (None, 5), (-1, 5), (0, 70000)):
+            with self.assertRaises(ValueError):
+                MockupFrameGenerator(min_value, max_value)
+
+class TestFrameRingBuffer(unittest.TestCase):
+    def fill(self, ring_buffer, count):
+        for i in range(count):
+            ring_buffer.append(float(i), np.full(64, i, dtype=np.uint16))
+
+    def test_latest_is_zero_copy(self):
+        """
+        Tests that latest() returns the newest frame as a memoryview of the
+        buffer storage, and None while the buffer is empty.
+        """
+        ring_buffer = FrameRingBuffer(4)
+        self.assertIsNone(ring_buffer.latest())
+        self.fill(ring_buffer, 6)
+        timestamp, frame = ring_buffer.latest()
+        self.assertEqual(timestamp, 5.0)
+        self.assertIsInstance(frame, memoryview)
+        self.assertTrue(np.shares_memory(np.asarray(frame), ring_buffer.frames))
+        self.assertEqual(frame.tolist(), [5] * 64)
+
+    def test_last_wraps_around(self):
+        """
+        Tests that last() returns the most recent frames oldest first, split
+        in two segments when they wrap around the end of the buffer.
+        """
+        ring_buffer = FrameRingBuffer(4)
+        self.fill(ring_buffer, 3)
+        segments = ring_buffer.last(10)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(segments[0][0].tolist(), [0.0, 1.0, 2.0])
+
+        self.fill(ring_buffer, 6)
+        segments = ring_buffer.last(3)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual([t for timestamps, _ in segments for t in timestamps.tolist()], [3.0, 4.0, 5.0])
+        timestamps, frames = ring_buffer.copy_last(4)
+        self.assertEqual(timestamps.tolist(), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(frames[:, 0].tolist(), [2, 3, 4, 5])
+
 class TestCLI(unittest.TestCase):
     @patch('argparse.ArgumentParser')
     def test_parse_args(self, mock_parser):
@@ -110,6 +243,101 @@ class TestCLI(unittest.TestCase):
         # Verify that the sensor_type attribute is set correctly
         self.assertEqual(args.sensor_type, 'mockup')
 
+    def test_writer_applies_backpressure_by_default(self):
+        """
+        Tests that the storage queue makes the sensors wait when it is full
+        unless another overflow policy is chosen.
+        """
+        args = parse_args(['--sensor-type', 'mockup', '--reading-frequency', '1', '--min-value', '1', '--max-value', '2', '--db-uri', 'x.db'])
+        self.assertEqual(args.writer_overflow, 'block')
+
+    def test_invalid_writer_arguments_keep_database(self):
+        """
+        Tests that out of range writer settings are reported before the debug
+        housekeeping removes the old database, instead of failing when the
+        writer starts.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.db')
+            open(db_path, 'w').close()
+            for option, value in (('--batch-size', '0'), ('--batch-max-delay', '-1'), ('--writer-max-pending', '-5')):
+                args = parse_args(['--sensor-type', 'mockup', '--reading-frequency', '1', '--min-value', '1', '--max-value', '2',
+                                   '--db-uri', db_path, option, value])
+                with self.assertLogs('main', logging.ERROR) as logs:
+                    asyncio.run(run_main(args))
+                self.assertIn("Invalid writer arguments", logs.output[0])
+                self.assertTrue(os.path.exists(db_path))
+
+    def test_parse_period(self):
+        """
+        Tests that reading frequencies are accepted as plain seconds or with
+        a s, ms or Hz suffix, and that periods below 1ms are rejected.
+        """
+        self.assertEqual(parse_period('2'), 2.0)
+        self.assertEqual(parse_period('0.5s'), 0.5)
+        self.assertEqual(parse_period('10ms'), 0.01)
+        self.assertEqual(parse_period('100Hz'), 0.01)
+        for value in ('0', '-1', '5000Hz', 'fast'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_period(value)
+
+class TestTickScheduler(unittest.TestCase):
+    def test_ticks_do_not_drift(self):
+        """
+        Tests that processing time between ticks does not delay the
+        following ticks, and that scheduled times are exact multiples of
+        the period from the start.
+        """
+        async def run():
+            scheduler = TickScheduler(0.01)
+            scheduler.start()
+            start = time.monotonic()
+            scheduled = []
+            for _ in range(20):
+                tick, scheduled_time = await scheduler.wait_next()
+                scheduled.append(scheduled_time)
+                time.sleep(0.004)
+            return scheduler, scheduled, time.monotonic() - start
+
+        scheduler, scheduled, elapsed = asyncio.run(run())
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(scheduler.missed_ticks, 0)
+        for i, scheduled_time in enumerate(scheduled):
+            self.assertAlmostEqual(scheduled_time, scheduler.start_wall + i * 0.01)
+
+    def test_missed_ticks_are_counted(self):
+        """
+        Tests that ticks whose deadline passed while the caller was blocked
+        are skipped and counted as missed instead of being fired late.
+        """
+        async def run():
+            scheduler = TickScheduler(0.01)
+            scheduler.start()
+            await scheduler.wait_next()
+            time.sleep(0.055)
+            tick, _ = await scheduler.wait_next()
+            return scheduler, tick
+
+        scheduler, tick = asyncio.run(run())
+        self.assertGreaterEqual(scheduler.missed_ticks, 4)
+        self.assertEqual(tick, scheduler.missed_ticks + 1)
+
+    def test_set_period_keeps_last_deadline(self):
+        """
+        Tests that changing the period keeps the deadline of the last tick,
+        so the next tick is one new period after it and indices go on.
+        """
+        scheduler = TickScheduler(1.0)
+        scheduler.start()
+        scheduler.next_tick = 5
+        last_deadline = scheduler.scheduled_time(4)
+        scheduler.set_period(0.5)
+        self.assertAlmostEqual(scheduler.scheduled_time(4), last_deadline)
+        self.assertAlmostEqual(scheduler.scheduled_time(5), last_deadline + 0.5)
+        self.assertAlmostEqual(scheduler.late_tolerance, 0.05)
+        with self.assertRaises(ValueError):
+            scheduler.set_period(0)
+
 class TestDatabaseManager(unittest.TestCase):
     @patch('sqlite3.connect')
     def test_connect(self, mock_connect):
@@ -147,5 +375,1864 @@ class TestDatabaseManager(unittest.TestCase):
         mock_cursor = mock_connect.return_value.cursor.return_value
         self.assertTrue(mock_cursor.execute.called)
 
+class TestBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def count_rows(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM infrared_data").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_close_flushes_queued_frames(self):
+        """
+        Tests that every frame queued through insert_frame() is committed
+        by the writer thread once the DatabaseManager is closed, and that
+        the connection uses WAL mode.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        journal_mode = db_manager.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+        db_manager.start_writer(batch_size=100, max_delay=10)
+        for i in range(250):
+            db_manager.insert_frame(float(i), b'\x00' * 128)
+        db_manager.close()
+        self.assertEqual(self.count_rows(), 250)
+
+    def test_flush_on_age(self):
+        """
+        Tests that a partial batch is committed once its oldest row
+        reaches the maximum delay, without waiting for the batch to fill.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=1000, max_delay=0.05)
+        db_manager.insert_frame(1.0, b'\x00' * 128)
+        writer = db_manager.writer
+        for _ in range(100):
+            if writer.rows_written:
+                break
+            time.sleep(0.01)
+        self.assertEqual(writer.rows_written, 1)
+        self.assertEqual(self.count_rows(), 1)
+        db_manager.close()
+
+    def test_overflow_policies(self):
+        """
+        Tests that a full queue drops the oldest or the newest row as
+        configured, counting the drops and the high-water mark, and that the
+        block policy only reports the queue as full.
+        """
+        for overflow in ("drop-oldest", "drop-newest", "block"):
+            writer = BatchWriter(self.db_path, max_pending=3, overflow=overflow)
+            results = [writer.submit("INSERT", (i,)) for i in range(5)]
+            queued = [params[0] for _, params in writer.queue]
+            stats = writer.stats()
+            if overflow == "drop-oldest":
+                self.assertEqual(queued, [2, 3, 4])
+                self.assertEqual(stats["rows_dropped"], 2)
+            elif overflow == "drop-newest":
+                self.assertEqual(queued, [0, 1, 2])
+                self.assertEqual(results, [True, True, True, False, False])
+                self.assertEqual(stats["rows_dropped"], 2)
+            else:
+                self.assertEqual(queued, [0, 1, 2, 3, 4])
+                self.assertTrue(writer.is_full())
+            self.assertEqual(stats["high_water_mark"], len(queued))
+            self.assertEqual(writer.is_full(), overflow == "block")
+
+    def test_block_wakes_waiting_producers(self):
+        """
+        Tests that a producer waiting for room in a full queue is woken by
+        the writer thread once it takes rows off the queue.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        writer = BatchWriter(self.db_path, max_delay=0.01, max_pending=2)
+        db_manager.writer = writer
+
+        async def run():
+            for i in range(2):
+                writer.submit(INSERT_FRAME_QUERY, (0, float(i), None, b'\x00' * 128, 0))
+            waiting = asyncio.create_task(db_manager.wait_for_space())
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())
+            writer.start()
+            await asyncio.wait_for(waiting, 1)
+
+        asyncio.run(run())
+        self.assertFalse(writer.is_full())
+        writer.stop()
+        db_manager.close()
+        self.assertEqual(self.count_rows(), 2)
+
+    def test_locked_batches_are_retried_and_requeued(self):
+        """
+        Tests that a batch failing because the database is locked is retried,
+        put back at the head of the queue once the retries run out, and that
+        a batch failing for another reason is counted as dropped, not written.
+        """
+        writer = BatchWriter(self.db_path)
+        locked = sqlite3.OperationalError("database is locked")
+        pending = {INSERT_FRAME_QUERY: [(0, 1.0, None, b'', 0), (0, 2.0, None, b'', 0)]}
+        writer.queue.append((INSERT_FRAME_QUERY, (0, 3.0, None, b'', 0)))
+        with patch('database.WRITE_RETRY_DELAY', 0.001):
+            conn = mock.MagicMock(**{"executemany.side_effect": [locked, locked, None]})
+            self.assertTrue(writer._flush(conn, pending, 2))
+            self.assertEqual(writer.rows_written, 2)
+
+            conn = mock.MagicMock(**{"executemany.side_effect": locked})
+            self.assertFalse(writer._flush(conn, pending, 2))
+            self.assertEqual([params[1] for _, params in writer.queue], [1.0, 2.0, 3.0])
+
+            conn = mock.MagicMock(**{"executemany.side_effect": sqlite3.OperationalError("disk I/O error")})
+            self.assertFalse(writer._flush(conn, pending, 2))
+        stats = writer.stats()
+        self.assertEqual((stats["rows_written"], stats["rows_dropped"], stats["queue_depth"]), (2, 2, 3))
+
+    def test_spilled_rows_are_replayed(self):
+        """
+        Tests that rows overflowing the queue are spilled to a file and
+        written once the writer catches up, and that spilled rows left over
+        when the writer stops are replayed on the next start.
+        """
+        spill_path = os.path.join(self.tmp_dir.name, 'test.spill')
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=10, max_delay=0.01, max_pending=5, overflow="spill", spill_path=spill_path)
+        writer = db_manager.writer
+        # Fill the queue before the thread gets to it by holding its lock
+        with writer.condition:
+            for i in range(50):
+                self.assertTrue(db_manager.insert_frame(float(i), memoryview(np.full(64, i, dtype=np.uint16))))
+        for _ in range(200):
+            if writer.rows_written == 50:
+                break
+            time.sleep(0.01)
+        stats = writer.stats()
+        self.assertEqual((stats["rows_spilled"], stats["rows_replayed"], stats["spill_pending"]), (45, 45, 0))
+        db_manager.close()
+        self.assertFalse(os.path.exists(spill_path))
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT reading_time, data FROM infrared_data ORDER BY reading_time").fetchall()
+        conn.close()
+        self.assertEqual([row[0] for row in rows], [float(i) for i in range(50)])
+        self.assertEqual(rows[49][1], np.full(64, 49, dtype=np.uint16).tobytes())
+
+        # Rows spilled by a writer that never ran are written by the next one
+        writer = BatchWriter(self.db_path, max_pending=1, overflow="spill", spill_path=spill_path)
+        for i in range(3):
+            writer.submit(INSERT_FRAME_QUERY, (0, 100.0 + i, None, b'\x00' * 128, 0))
+        writer.spill.close()
+        writer = BatchWriter(self.db_path, max_delay=0.01, overflow="spill", spill_path=spill_path)
+        self.assertEqual(writer.spill.pending, 2)
+        writer.start()
+        writer.stop()
+        self.assertEqual(self.count_rows(), 52)
+
+    def test_connect_migrates_old_schema(self):
+        """
+        Tests that connecting to a database created by an older version
+        adds the scheduled_time column and keeps the existing rows.
+        """
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE infrared_data (id INTEGER PRIMARY KEY, reading_time REAL, data BLOB)")
+        conn.execute("INSERT INTO infrared_data (reading_time, data) VALUES (1.0, x'00')")
+        conn.commit()
+        conn.close()
+
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.insert_frame(2.0, b'\x00', scheduled_time=1.999)
+        rows = db_manager.conn.execute("SELECT reading_time, scheduled_time FROM infrared_data ORDER BY id").fetchall()
+        db_manager.close()
+        self.assertEqual(rows, [(1.0, None), (2.0, 1.999)])
+
+    def test_invalid_batch_size(self):
+        """
+        Tests that a non-positive batch size is rejected.
+        """
+        with self.assertRaises(ValueError):
+            BatchWriter(self.db_path, batch_size=0)
+
+class TestSensorApplication(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_sensors_config(self):
+        """
+        Tests that the sensors configuration file is parsed into one entry
+        per sensor, with reading frequencies converted to periods.
+        """
+        config_path = os.path.join(self.tmp_dir.name, 'sensors.json')
+        with open(config_path, 'w') as f:
+            json.dump({"sensors": [
+                {"id": 1, "sensor_type": "mockup", "reading_frequency": "100Hz", "min_value": 0, "max_value": 10, "autostart": True},
+                {"id": 2, "sensor_type": "mockup", "reading_frequency": 0.5, "min_value": 5, "max_value": 6},
+            ]}, f)
+        sensors = load_sensors_config(config_path)
+        self.assertEqual([sensor["sensor_id"] for sensor in sensors], [1, 2])
+        self.assertEqual(sensors[0]["reading_frequency"], 0.01)
+        self.assertTrue(sensors[0]["autostart"])
+        self.assertFalse(sensors[1]["autostart"])
+
+    def test_sensors_capture_concurrently(self):
+        """
+        Tests that several sensors capture concurrently on one loop and
+        that every reading is stored with the identifier of its sensor.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=50, max_delay=0.05)
+        app = SensorApplication(db_manager)
+        for sensor_id in (1, 2, 3):
+            app.add_sensor(sensor_id, 'mockup', 0.01, 0, 100)
+
+        async def run():
+            await app.start_all()
+            await asyncio.sleep(0.1)
+            await app.stop_all()
+
+        asyncio.run(run())
+        db_manager.close()
+        latest = app.get_data(1)
+        self.assertEqual(len(latest["data"]), 64)
+
+        conn = sqlite3.connect(self.db_path)
+        counts = dict(conn.execute("SELECT sensor_id, COUNT(*) FROM infrared_data GROUP BY sensor_id").fetchall())
+        blob = conn.execute("SELECT data FROM infrared_data LIMIT 1").fetchone()[0]
+        conn.close()
+        self.assertEqual(len(blob), 128)
+        self.assertTrue(all(0 <= value <= 100 for value in struct.unpack('64H', blob)))
+        self.assertEqual(sorted(counts), [1, 2, 3])
+        for count in counts.values():
+            self.assertGreaterEqual(count, 5)
+        self.assertEqual(app.get_sensor(1).ring_buffer.count, counts[1])
+
+    def test_sensor_handler_replies_with_status(self):
+        """
+        Tests that a request on sensors.<id>.start starts that sensor and
+        replies with its state, and that unknown sensors get an error reply.
+        """
+        app = SensorApplication(Mock(**{"needs_backpressure.return_value": False}))
+        app.add_sensor(7, 'mockup', 1, 0, 100)
+        client = NATSClient("nats://localhost:4222", None, Mock(), asyncio.Event(), app)
+        client.nc = Mock()
+        client.nc.publish = AsyncMock()
+
+        async def run():
+            await client.sensor_handler(Mock(subject="sensors.7.start", reply="inbox.1", data=b""))
+            await client.sensor_handler(Mock(subject="sensors.8.start", reply="inbox.2", data=b""))
+            await app.stop_all()
+
+        asyncio.run(run())
+        replies = [json.loads(call.args[1]) for call in client.nc.publish.call_args_list]
+        self.assertEqual(replies[0]["sensor_id"], 7)
+        self.assertTrue(replies[0]["running"])
+        self.assertIn("error", replies[1])
+
+    def test_configure_running_sensor(self):
+        """
+        Tests that a configure request changes the frequency and range of a
+        running sensor at its next tick without restarting it, changes the
+        writer batching, and replies with the effective settings.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=50, max_delay=0.05)
+        app = SensorApplication(db_manager)
+        sensor = app.add_sensor(1, 'mockup', 0.01, 0, 100, seed=3)
+        client = NATSClient("nats://localhost:4222", db_manager, Mock(), asyncio.Event(), app)
+        client.nc = Mock()
+        client.nc.publish = AsyncMock()
+
+        async def run():
+            await sensor.start_capture()
+            await asyncio.sleep(0.05)
+            task = sensor.capture_task
+            payload = json.dumps({"reading_frequency": "50Hz", "min_value": 1000, "max_value": 1000, "batch_size": 20}).encode()
+            await client.sensor_handler(Mock(subject="sensors.1.configure", reply="inbox.1", data=payload))
+            await asyncio.sleep(0.1)
+            self.assertIs(sensor.capture_task, task)
+            await client.sensor_handler(Mock(subject="sensors.1.configure", reply="inbox.2", data=b'{"min_value": 5, "max_value": 1}'))
+            await app.stop_all()
+
+        asyncio.run(run())
+        db_manager.close()
+        reply, error = [json.loads(call.args[1]) for call in client.nc.publish.call_args_list]
+        self.assertEqual(reply["reading_frequency"], 0.02)
+        self.assertEqual((reply["min_value"], reply["max_value"], reply["batch_size"]), (1000, 1000, 20))
+        self.assertIsNone(reply["stream_batch_size"])
+        self.assertIn("error", error)
+        self.assertEqual(sensor.scheduler.period, 0.02)
+        self.assertEqual(sensor.config()["max_value"], 1000)
+        _, frame = sensor.ring_buffer.latest()
+        self.assertEqual(set(frame.tolist()), {1000})
+
+    def test_configure_rejects_invalid_settings(self):
+        """
+        Tests that unknown settings, invalid values and stream settings on a
+        sensor that does not stream are rejected without changing anything.
+        """
+        app = SensorApplication(Mock(writer=None))
+        sensor = app.add_sensor(1, 'mockup', 1, 0, 100)
+        for settings in ({"colour": 1}, {"reading_frequency": "fast"}, {"stream_linger": 0.1}, {"batch_size": 10}, [1]):
+            with self.assertRaises(ValueError):
+                asyncio.run(app.configure(1, settings))
+        self.assertEqual(sensor.config(), {"reading_frequency": 1, "min_value": 0, "max_value": 100, "stream_batch_size": None, "stream_linger": None})
+        reply = asyncio.run(app.process_command(1, "configure", b'{"max_value": 200}'))
+        self.assertEqual(reply["max_value"], 200)
+
+class TestRollups(unittest.TestCase):
+    def test_aggregates_match_frames(self):
+        """
+        Tests that the rows of closed buckets hold the count, minimum, maximum,
+        sum and sum of squares of the frames of each bucket.
+        """
+        frames = MockupFrameGenerator(0, 65535, seed=1).frames(30)
+        aggregator = RollupAggregator(5, 10)
+        rows = []
+        for i, frame in enumerate(frames):
+            closed = aggregator.add(100.0 + i, frame)
+            if closed is not None:
+                rows.append(closed)
+        rows.append(aggregator.flush())
+        self.assertIsNone(aggregator.flush())
+        self.assertEqual([row[2] for row in rows], [100.0, 110.0, 120.0])
+
+        summary = merge_rollup_rows([row[2:] for row in rows])
+        buckets = frames.reshape(3, 10, 64).astype(np.int64)
+        self.assertEqual(summary["count"].tolist(), [10, 10, 10])
+        self.assertTrue(np.array_equal(summary["min"], buckets.min(axis=1)))
+        self.assertTrue(np.array_equal(summary["max"], buckets.max(axis=1)))
+        self.assertTrue(np.allclose(summary["mean"], buckets.mean(axis=1)))
+        self.assertTrue(np.allclose(summary["std"], buckets.std(axis=1)))
+
+    def test_rows_of_same_bucket_are_merged(self):
+        """
+        Tests that a bucket stored in two rows, as happens when the capture
+        is restarted within a bucket, is summarized as a single bucket.
+        """
+        aggregator = RollupAggregator(1, 60)
+        aggregator.add(0.0, np.full(64, 2, dtype=np.uint16))
+        first = aggregator.flush()
+        aggregator.add(1.0, np.full(64, 4, dtype=np.uint16))
+        aggregator.add(2.0, np.full(64, 6, dtype=np.uint16))
+        second = aggregator.flush()
+        summary = merge_rollup_rows([first[2:], second[2:]])
+        self.assertEqual(summary["count"].tolist(), [3])
+        self.assertEqual(summary["min"][0, 0], 2)
+        self.assertEqual(summary["max"][0, 0], 6)
+        self.assertAlmostEqual(summary["mean"][0, 0], 4.0)
+
+    def test_bucket_spanning_pages_is_merged_once(self):
+        """
+        Tests that a bucket stored in more rows than fit in a page is read
+        back as one complete bucket, along with the buckets around it.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_manager = DatabaseManager(os.path.join(tmp_dir.name, 'rollups.db'))
+        db_manager.connect()
+        aggregator = RollupAggregator(1, 60)
+        # 40 restarts of the capture within the bucket of 60, between the buckets of 0 and 120
+        for reading_time, value in [(0.0, 1)] + [(61.0 + i, i) for i in range(40)] + [(120.0, 5)]:
+            aggregator.add(reading_time, np.full(64, value, dtype=np.uint16))
+            db_manager.insert_rollup(aggregator.flush())
+        chunks = list(db_manager.iter_rollups(1, 60, 0.0, 200.0, chunk_size=16))
+        db_manager.close()
+        tmp_dir.cleanup()
+
+        self.assertEqual(np.concatenate([chunk["bucket_start"] for chunk in chunks]).tolist(), [0.0, 60.0, 120.0])
+        counts = np.concatenate([chunk["count"] for chunk in chunks])
+        self.assertEqual(counts.tolist(), [1, 40, 1])
+        middle = np.concatenate([chunk["max"] for chunk in chunks])[1]
+        self.assertEqual(middle[0], 39)
+
+class TestChunkedStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+        rng = np.random.default_rng(0)
+        # Slowly changing scene: every pixel drifts by a few counts per frame
+        steps = rng.integers(-2, 3, size=(1000, 64))
+        self.frames = (rng.integers(2000, 3000, size=64) + np.cumsum(steps, axis=0)).astype(np.uint16)
+        self.reading_times = 5000.0 + np.arange(1000) * 0.01
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_codec_round_trip(self):
+        """
+        Tests that every encoding and compression combination decodes back to
+        the exact frames and timestamps, including unknown scheduled times.
+        """
+        scheduled_times = np.full(1000, np.nan)
+        for encoding in frame_codec.ENCODINGS:
+            for compression in frame_codec.COMPRESSIONS:
+                codec, payload = frame_codec.encode_chunk(self.reading_times, scheduled_times, self.frames, encoding, compression)
+                reading_times, decoded_scheduled, frames = frame_codec.decode_chunk(codec, payload, 1000)
+                self.assertTrue(np.array_equal(frames, self.frames), codec)
+                self.assertTrue(np.array_equal(reading_times, self.reading_times), codec)
+                self.assertTrue(np.isnan(decoded_scheduled).all(), codec)
+
+    def test_delta_compression_ratio(self):
+        """
+        Tests that delta encoding shrinks a slowly changing scene at least
+        four times below its raw size (128 bytes per frame plus timestamps).
+        """
+        codec, payload = frame_codec.encode_chunk(self.reading_times, self.reading_times, self.frames)
+        self.assertEqual(codec, "delta+zlib")
+        self.assertLess(len(payload) * 4, self.frames.nbytes + 16 * 1000)
+
+    def test_chunked_database_round_trip(self):
+        """
+        Tests that readings stored as chunks through the background writer
+        are decoded transparently by range queries, skipping the chunks
+        outside the range.
+        """
+        db_manager = DatabaseManager(self.db_path, storage_format="chunked", chunk_frames=100)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=10, max_delay=0.05)
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            db_manager.insert_frame(float(reading_time), memoryview(frame), float(reading_time), sensor_id=3)
+        db_manager.insert_frame(9000.0, memoryview(self.frames[0]), sensor_id=3)
+        db_manager.close()
+
+        db_manager = DatabaseManager(self.db_path, storage_format="chunked", chunk_frames=100)
+        db_manager.connect()
+        chunk_count = db_manager.conn.execute("SELECT COUNT(*) FROM infrared_chunks").fetchone()[0]
+        self.assertEqual(chunk_count, 11)
+        chunks = list(db_manager.iter_frames(3, 5002.5, 5007.5, chunk_size=64))
+        db_manager.close()
+        self.assertTrue(all(len(reading_times) <= 64 for reading_times, _ in chunks))
+        reading_times = np.concatenate([chunk[0] for chunk in chunks])
+        frames = np.concatenate([chunk[1] for chunk in chunks])
+        self.assertTrue(np.array_equal(reading_times, self.reading_times[250:750]))
+        self.assertTrue(np.array_equal(frames, self.frames[250:750]))
+
+class TestPartitions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+        self.frame = np.arange(64, dtype=np.uint16)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_partition_names(self):
+        """
+        Tests that partitions are named after their start time in UTC, next
+        to the main database, and that names are parsed back to their keys.
+        """
+        partitions = PartitionScheme(self.db_path, "hour", parse_duration("2d"))
+        key = partitions.key(1700000000.0)
+        self.assertEqual(partitions.name(key), "2023111422")
+        self.assertEqual(partitions.path(key), os.path.join(self.tmp_dir.name, "test.2023111422.db"))
+        self.assertEqual(partitions.parse_name("2023111422"), key)
+        self.assertIsNone(partitions.parse_name("20231114"))
+        self.assertFalse(partitions.is_expired(key, 1700000000.0 + 2 * 86400))
+        self.assertTrue(partitions.is_expired(key, 1700000000.0 + 3 * 86400))
+        with self.assertRaises(ValueError):
+            PartitionScheme(self.db_path, "week")
+
+    def test_queries_span_partitions(self):
+        """
+        Tests that readings are written to the partition of their hour
+        through the writer, and that range queries read across partitions,
+        for both storage formats.
+        """
+        start = 1700000000.0 - 1700000000.0 % 3600
+        reading_times = start + np.arange(0, 3 * 3600, 60.0)
+        for storage_format in ("rows", "chunked"):
+            db_path = os.path.join(self.tmp_dir.name, f'{storage_format}.db')
+            db_manager = DatabaseManager(db_path, storage_format=storage_format, chunk_frames=7, partition="hour")
+            db_manager.connect()
+            db_manager.start_writer(batch_size=16, max_delay=0.05)
+            for reading_time in reading_times:
+                db_manager.insert_frame(float(reading_time), memoryview(self.frame), sensor_id=1)
+            db_manager.close()
+
+            self.assertEqual(len(db_manager.partitions.existing()), 3, storage_format)
+            conn = sqlite3.connect(db_path)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM infrared_data").fetchone()[0], 0)
+            conn.close()
+            chunks = list(db_manager.iter_frames(1, start + 3000, start + 7500, chunk_size=16))
+            times = np.concatenate([chunk[0] for chunk in chunks])
+            self.assertTrue(np.array_equal(times, reading_times[50:125]), storage_format)
+
+    def test_chunks_after_a_pause_are_found(self):
+        """
+        Tests that a chunk never spans more than chunk_max_age of reading
+        times, so the readings taken after a pause of the sensor are found
+        by range queries starting in the next partition.
+        """
+        start = 1700000000.0 - 1700000000.0 % 3600
+        reading_times = np.concatenate((start + np.arange(3500, 3600, 10.0), start + np.arange(3700, 3800, 10.0)))
+        db_manager = DatabaseManager(self.db_path, storage_format="chunked", chunk_frames=100, chunk_max_age=60, partition="hour")
+        db_manager.connect()
+        for reading_time in reading_times:
+            self.assertTrue(db_manager.insert_frame(float(reading_time), memoryview(self.frame), sensor_id=1))
+        db_manager.close()
+        chunks = list(db_manager.iter_frames(1, start + 3700, start + 3800))
+        times = np.concatenate([chunk[0] for chunk in chunks])
+        self.assertTrue(np.array_equal(times, reading_times[10:]))
+
+    def test_retention_drops_partitions(self):
+        """
+        Tests that partitions older than the retention are deleted when a
+        new partition is started, while recent ones are kept.
+        """
+        now = time.time()
+        db_manager = DatabaseManager(self.db_path, partition="day", retention=3 * 86400)
+        db_manager.connect()
+        for days_ago in (10, 2, 1):
+            db_manager.insert_frame(now - days_ago * 86400, memoryview(self.frame))
+        partitions = db_manager.partitions
+        self.assertEqual(partitions.existing(), [partitions.key(now - 2 * 86400), partitions.key(now - 86400)])
+        self.assertFalse(os.path.exists(partitions.path(partitions.key(now - 10 * 86400))))
+        db_manager.close()
+        self.assertEqual(sum(len(chunk[0]) for chunk in db_manager.iter_frames(0, 0, now)), 2)
+
+class TestSensorDrivers(unittest.TestCase):
+    def setUp(self):
+        self.frames = MockupFrameGenerator(0, 65535, seed=4).frames(50)
+        self.stream = b"".join(encode_frame(seq, frame) for seq, frame in enumerate(self.frames))
+
+    def test_parser_resynchronizes(self):
+        """
+        Tests that frames split across arbitrary chunks are parsed, and that
+        garbage, a corrupted frame and a missing frame only cost those frames.
+        """
+        size = sensor_drivers.FRAME_SIZE
+        corrupted = bytearray(self.stream[10 * size:11 * size])
+        corrupted[40] ^= 0xFF
+        stream = (b"\x00\xaa\x55garbage" + self.stream[:10 * size] + bytes(corrupted) + self.stream[11 * size:20 * size]
+                  + self.stream[21 * size:])
+        parser = FrameParser()
+        rng = np.random.default_rng(0)
+        parsed = []
+        position = 0
+        while position < len(stream):
+            step = int(rng.integers(1, 300))
+            parsed.append(parser.feed(stream[position:position + step]))
+            position += step
+        frames = np.concatenate(parsed)
+        expected = np.concatenate([self.frames[:10], self.frames[11:20], self.frames[21:]])
+        self.assertEqual(frames.dtype, np.uint16)
+        self.assertTrue(np.array_equal(frames, expected))
+        stats = parser.stats()
+        self.assertEqual(stats["frames_parsed"], 48)
+        self.assertEqual(stats["frames_lost"], 2)
+        self.assertGreaterEqual(stats["crc_errors"], 2)
+        self.assertEqual(stats["bytes_skipped"], 10 + size)
+
+    def test_parser_drops_repeated_frames(self):
+        """
+        Tests that a frame sent twice is dropped as a duplicate instead of
+        being counted as a wrap-around of 65535 lost frames.
+        """
+        size = sensor_drivers.FRAME_SIZE
+        stream = self.stream[:5 * size] + self.stream[4 * size:5 * size] + self.stream[5 * size:10 * size]
+        parser = FrameParser()
+        frames = parser.feed(stream)
+        self.assertTrue(np.array_equal(frames, self.frames[:10]))
+        stats = parser.stats()
+        self.assertEqual(stats["frames_parsed"], 10)
+        self.assertEqual(stats["frames_lost"], 0)
+        self.assertEqual(stats["frames_duplicated"], 1)
+
+    def test_frame_clock(self):
+        """
+        Tests that the frames of a burst are spaced by the nominal period back
+        from its arrival, leaving the gap of lost frames, and that a backlog
+        is spread after the previous burst so times keep increasing.
+        """
+        size = sensor_drivers.FRAME_SIZE
+        parser = FrameParser()
+        parser.feed(self.stream[:3 * size])
+        self.assertEqual(parser.indexes.tolist(), [0, 1, 2])
+        parser.feed(self.stream[3 * size:4 * size] + self.stream[5 * size:6 * size])
+        self.assertEqual(parser.indexes.tolist(), [3, 5])
+
+        clock = sensor_drivers.FrameClock()
+        self.assertTrue(np.allclose(clock.times(np.array([0, 1, 2]), 10.0, 0.1), [9.8, 9.9, 10.0]))
+        self.assertTrue(np.allclose(clock.times(np.array([3, 5]), 10.25, 0.1), [10.05, 10.25]))
+        self.assertTrue(np.allclose(clock.times(np.array([6, 7, 8, 9]), 10.3, 0.1), [10.2625, 10.275, 10.2875, 10.3]))
+
+    def test_socket_and_pty_drivers(self):
+        """
+        Tests that the drivers read a high-rate burst of frames from the
+        other end of a socketpair and of a pty without blocking the loop.
+        """
+        async def read_all(driver, count):
+            await driver.open()
+            frames = []
+            while sum(len(batch) for batch in frames) < count:
+                frames.append(await driver.read_frames())
+            driver.close()
+            return np.concatenate(frames)
+
+        sensor_end, driver_end = socket.socketpair()
+        sensor_end.sendall(self.stream)
+        frames = asyncio.run(read_all(SocketDriver(driver_end), 50))
+        sensor_end.close()
+        self.assertTrue(np.array_equal(frames, self.frames))
+
+        if sensor_drivers.termios is None:
+            return
+        master, slave = os.openpty()
+        try:
+            driver = DeviceDriver(os.ttyname(slave))
+
+            async def run():
+                task = asyncio.create_task(read_all(driver, 50))
+                await asyncio.sleep(0.01)
+                os.write(master, self.stream)
+                return await asyncio.wait_for(task, 5)
+
+            frames = asyncio.run(run())
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertTrue(np.array_equal(frames, self.frames))
+
+    def test_real_sensor_capture(self):
+        """
+        Tests that a real sensor stores the frames pushed by its device,
+        reconnecting when the device closes the connection.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, 'sensor.sock')
+        db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.return_value": True})
+        capture = DataCapture(db, 0.001, 'real', sensor_id=2, device='unix://' + path)
+        connections = []
+
+        async def emit(reader, writer):
+            connections.append(writer)
+            writer.write(self.stream[:25 * sensor_drivers.FRAME_SIZE] if len(connections) == 1 else self.stream[25 * sensor_drivers.FRAME_SIZE:])
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_unix_server(emit, path)
+            with patch('data_capture_module.RECONNECT_DELAY', 0.01):
+                await capture.start_capture()
+                for _ in range(200):
+                    if db.insert_frame.call_count >= 50:
+                        break
+                    await asyncio.sleep(0.01)
+                await capture.stop_capture()
+            server.close()
+            await server.wait_closed()
+
+        asyncio.run(run())
+        tmp_dir.cleanup()
+        self.assertEqual(db.insert_frame.call_count, 50)
+        self.assertEqual(len(connections), 2)
+        stored = np.frombuffer(b"".join(bytes(call.args[1]) for call in db.insert_frame.call_args_list), dtype=np.uint16).reshape(50, 64)
+        self.assertTrue(np.array_equal(stored, self.frames))
+        self.assertIsNone(db.insert_frame.call_args_list[0].args[2])
+        reading_times = [call.args[0] for call in db.insert_frame.call_args_list]
+        self.assertTrue(all(later > earlier for earlier, later in zip(reading_times, reading_times[1:])))
+        self.assertEqual(capture.metrics.frames_captured, 50)
+        with self.assertRaises(ValueError):
+            asyncio.run(DataCapture(db, 0.001, 'real').start_capture())
+
+class TestSharding(unittest.TestCase):
+    def test_shard_paths(self):
+        """
+        Tests that sensors are spread over the workers by identifier and that
+        every worker gets its own database and log file.
+        """
+        self.assertEqual([sharding.shard_of(sensor_id, 3) for sensor_id in range(6)], [0, 1, 2, 0, 1, 2])
+        self.assertEqual(sharding.shard_path('data/infrared.db', 1), 'data/infrared.worker1.db')
+        self.assertEqual(sharding.shard_path('framelog://frames', 0), 'framelog://frames.worker0')
+        self.assertEqual(sharding.shard_path('app.log', 2), 'app.worker2.log')
+        with self.assertRaises(SystemExit):
+            parse_args(['--sensor-type', 'mockup', '--reading-frequency', '1', '--db-uri', 'x.db', '--workers', '2'])
+
+    def test_shared_ring_buffer(self):
+        """
+        Tests that frames appended through one attachment of a shared ring
+        buffer are read through another, as the coordinator reads them.
+        """
+        ring_buffer = SharedFrameRingBuffer(4)
+        reader = SharedFrameRingBuffer.attach(ring_buffer.name)
+        try:
+            self.assertEqual(reader.capacity, 4)
+            self.assertIsNone(reader.latest())
+            for i in range(6):
+                ring_buffer.append(float(i), np.full(64, i, dtype=np.uint16))
+            self.assertEqual(len(reader), 4)
+            timestamp, frame = reader.latest()
+            self.assertEqual(timestamp, 5.0)
+            self.assertFalse(np.shares_memory(np.asarray(frame), reader.frames))
+            self.assertEqual(set(frame.tolist()), {5})
+            timestamps, frames = reader.copy_last(3)
+            self.assertEqual(timestamps.tolist(), [3.0, 4.0, 5.0])
+            self.assertEqual(frames[:, 0].tolist(), [3, 4, 5])
+            self.assertFalse(np.shares_memory(frames, reader.frames))
+            segments = reader.last(10)
+            self.assertEqual(len(segments), 1)
+            self.assertEqual(np.asarray(segments[0][0]).tolist(), [3.0, 4.0, 5.0])
+            self.assertFalse(np.shares_memory(np.asarray(segments[0][1]), reader.frames))
+            ring_buffer.append(6.0, np.full(64, 6, dtype=np.uint16))
+            self.assertEqual(np.asarray(segments[0][1])[:, 0].tolist(), [3, 4, 5])
+        finally:
+            reader.close()
+            ring_buffer.close()
+            ring_buffer.unlink()
+
+    def test_shared_ring_buffer_smallest_capacity(self):
+        """
+        Tests that the smallest shared ring buffer returns its latest frame
+        without spinning, and that smaller ones are rejected, including in
+        the sensors configuration of the workers.
+        """
+        ring_buffer = SharedFrameRingBuffer(2)
+        try:
+            for i in range(3):
+                ring_buffer.append(float(i), np.full(64, i, dtype=np.uint16))
+                timestamp, frame = ring_buffer.latest()
+                self.assertEqual(timestamp, float(i))
+                self.assertEqual(set(frame.tolist()), {i})
+        finally:
+            ring_buffer.close()
+            ring_buffer.unlink()
+        with self.assertRaises(ValueError):
+            SharedFrameRingBuffer(1)
+        tmp_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(tmp_dir.name, 'sensors.json')
+        with open(config_path, 'w') as f:
+            json.dump({"sensors": [{"id": 1, "sensor_type": "mockup", "reading_frequency": 1, "min_value": 0, "max_value": 10, "buffer_capacity": 1}]}, f)
+        self.assertEqual(load_sensors_config(config_path)[0]["buffer_capacity"], 1)
+        with self.assertRaises(ValueError):
+            load_sensors_config(config_path, min_buffer_capacity=2)
+        tmp_dir.cleanup()
+
+    def test_coordinator_routes_to_workers(self):
+        """
+        Tests that the coordinator serves the latest readings of sensors run by
+        worker processes from shared memory, forwards the other commands to the
+        worker of the sensor, and that every worker stores its own sensors.
+        """
+        tmp_dir = tempfile.TemporaryDirectory()
+        config_path = os.path.join(tmp_dir.name, 'sensors.json')
+        with open(config_path, 'w') as f:
+            json.dump({"sensors": [
+                {"id": sensor_id, "sensor_type": "mockup", "reading_frequency": "100Hz", "min_value": 0, "max_value": 100, "autostart": True}
+                for sensor_id in (1, 2, 3)
+            ]}, f)
+        db_path = os.path.join(tmp_dir.name, 'infrared.db')
+        args = parse_args(['--sensors-config', config_path, '--db-uri', db_path, '--workers', '2', '--batch-max-delay', '0.05',
+                           '--log-file', '', '--metrics-interval', '0', '--rollup-intervals', ''])
+
+        async def request(nc, subject, payload=b""):
+            msg = await nc.request(subject, payload, timeout=5)
+            return json.loads(msg.data)
+
+        async def run():
+            broker = await LocalBroker().start()
+            coordinator = asyncio.create_task(sharding.run_coordinator(args, broker.url))
+            requester = await nats.connect(broker.url)
+            latest = None
+            for _ in range(300):
+                if coordinator.done():
+                    break
+                try:
+                    latest = await requester.request("sensors.3.latest", b"", timeout=0.1)
+                    latest = json.loads(latest.data)
+                    if latest["data"] is not None:
+                        break
+                except nats.errors.NoRespondersError:
+                    pass
+                except nats.errors.TimeoutError:
+                    pass
+                await asyncio.sleep(0.05)
+            stopped = await request(requester, "sensors.2.stop")
+            unknown = await request(requester, "sensors.9.start")
+            await asyncio.sleep(0.2)
+            await requester.publish("test.shutdown", b"")
+            await requester.flush()
+            await asyncio.wait_for(coordinator, 60)
+            await requester.close()
+            await broker.stop()
+            return latest, stopped, unknown
+
+        latest, stopped, unknown = asyncio.run(run())
+        self.assertEqual(latest["sensor_id"], 3)
+        self.assertEqual(len(latest["data"]), 64)
+        self.assertEqual(stopped, {"sensor_id": 2, "sensor_type": "mockup", "reading_frequency": 0.01, "running": False})
+        self.assertIn("error", unknown)
+        stored = {}
+        for shard in range(2):
+            conn = sqlite3.connect(sharding.shard_path(db_path, shard))
+            stored[shard] = {row[0] for row in conn.execute("SELECT DISTINCT sensor_id FROM infrared_data")}
+            conn.close()
+        self.assertEqual(stored, {0: {2}, 1: {1, 3}})
+        tmp_dir.cleanup()
+
+class TestAnomalyDetection(unittest.TestCase):
+    def setUp(self):
+        self.frames = MockupFrameGenerator(20, 40, seed=5).frames(300)
+
+    def test_moving_statistics_and_hot_spot(self):
+        """
+        Tests that the moving per-pixel statistics match their definition,
+        that noise within the usual range is not flagged and that a pixel far
+        from its mean is.
+        """
+        detector = AnomalyDetector(None, 1, threshold=6.0, alpha=0.1)
+        mean = self.frames[0].astype(np.float64)
+        variance = np.zeros(64)
+        for frame in self.frames:
+            self.assertFalse(detector.update(frame).any())
+            diff = frame - mean
+            mean = mean + 0.1 * diff
+            variance = 0.9 * (variance + 0.1 * diff * diff)
+        self.assertTrue(np.allclose(detector.mean, mean))
+        self.assertTrue(np.allclose(detector.variance, variance))
+
+        hot = self.frames[-1].copy()
+        hot[10] = 200
+        flags = detector.update(hot)
+        self.assertEqual(np.flatnonzero(flags).tolist(), [10])
+        self.assertGreater(detector.z[10], 6.0)
+
+    def test_alerts_are_published_with_cooldown(self):
+        """
+        Tests that frames with anomalous pixels publish compact alerts right
+        away, and that alerts within the cooldown are only counted.
+        """
+        publish = AsyncMock()
+        detector = AnomalyDetector(publish, 3, hot_value=50, cooldown=1.0)
+        frame = np.full(64, 30, dtype=np.uint16)
+        frame[[4, 7]] = 60
+
+        async def run():
+            alerts = []
+            for reading_time in (100.0, 100.5, 100.8, 101.2):
+                alerts.append(await detector.add(reading_time, frame))
+            alerts.append(await detector.add(101.3, np.full(64, 30, dtype=np.uint16)))
+            return alerts
+
+        alerts = asyncio.run(run())
+        self.assertEqual([alert is not None for alert in alerts], [True, False, False, True, False])
+        self.assertEqual(publish.await_count, 2)
+        subject, payload = publish.await_args_list[1].args
+        self.assertEqual(subject, "sensors.3.alerts")
+        alert = json.loads(payload)
+        self.assertEqual(alert["pixels"], [4, 7])
+        self.assertEqual(alert["values"], [60, 60])
+        self.assertEqual(alert["suppressed"], 2)
+        self.assertEqual(detector.stats(), {"frames_checked": 5, "frames_flagged": 4, "alerts_published": 2, "alerts_suppressed": 2, "alerts_failed": 0})
+
+    def test_capture_raises_alerts(self):
+        """
+        Tests that a capturing sensor checks every frame and that its detector
+        counters are part of its metrics.
+        """
+        publish = AsyncMock()
+        db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.return_value": True, "writer": None})
+        app = SensorApplication(db, {"anomaly_hot_value": 95, "anomaly_cooldown": 0.0, "publish_alerts": publish})
+        sensor = app.add_sensor(4, 'mockup', 0.002, 0, 100, seed=1)
+
+        async def run():
+            await sensor.start_capture()
+            await asyncio.sleep(0.2)
+            await sensor.stop_capture()
+
+        asyncio.run(run())
+        stats = app.metrics(4)["anomaly"]
+        self.assertEqual(stats["frames_checked"], sensor.metrics.frames_captured)
+        self.assertGreater(stats["alerts_published"], 0)
+        self.assertEqual(publish.await_count, stats["alerts_published"])
+        self.assertEqual(publish.await_args.args[0], "sensors.4.alerts")
+        self.assertIsNone(app.metrics(4)["driver"])
+
+class TestDeadband(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+        # Static scene with a step every 100 readings, read every second
+        self.frames = np.repeat(np.arange(10, dtype=np.uint16) * 50, 100)[:, None] + np.zeros(64, dtype=np.uint16)
+        self.reading_times = 1000.0 + np.arange(1000)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_filter_and_expand_runs(self):
+        """
+        Tests that only the readings moving a pixel past the deadband, or due
+        for a heartbeat, are stored, and that the skipped readings are
+        rebuilt exactly from the run-length counts.
+        """
+        deadband = DeadbandFilter(0, heartbeat=30)
+        stored = []
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            skipped = deadband.check(reading_time, frame)
+            if skipped is not None:
+                stored.append((reading_time, frame.copy(), skipped))
+        stored.append(deadband.flush())
+        self.assertIsNone(deadband.flush())
+        # A step every 100 readings, and a heartbeat every 30 readings of a run
+        self.assertEqual(len(stored), 41)
+        self.assertEqual(deadband.stats(), {"frames_stored": 41, "frames_skipped": 959})
+
+        reading_times, frames = expand_runs(*(np.array(column) for column in zip(*stored)))
+        self.assertTrue(np.array_equal(reading_times, self.reading_times))
+        self.assertTrue(np.array_equal(frames, self.frames))
+
+        # Changes within the deadband are skipped, larger ones are stored
+        deadband = DeadbandFilter(2)
+        self.assertEqual(deadband.check(0.0, np.full(64, 100, dtype=np.uint16)), 0)
+        self.assertIsNone(deadband.check(1.0, np.full(64, 98, dtype=np.uint16)))
+        self.assertEqual(deadband.check(2.0, np.full(64, 103, dtype=np.uint16)), 1)
+        with self.assertRaises(ValueError):
+            DeadbandFilter(-1)
+
+    def test_iter_runs_rebuilds_stored_series(self):
+        """
+        Tests that readings stored with a deadband are read back with every
+        skipped reading, including the runs crossing the bounds of the range.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=50, max_delay=0.05)
+        deadband = DeadbandFilter(0, heartbeat=None)
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            skipped = deadband.check(reading_time, frame)
+            if skipped is not None:
+                db_manager.insert_frame(float(reading_time), memoryview(frame), sensor_id=2, skipped=skipped)
+        reading_time, frame, skipped, scheduled_time = deadband.flush()
+        db_manager.insert_frame(float(reading_time), memoryview(frame), scheduled_time, sensor_id=2, skipped=skipped)
+        db_manager.close()
+
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        self.assertEqual(db_manager.conn.execute("SELECT COUNT(*) FROM infrared_data").fetchone()[0], 11)
+        chunks = list(db_manager.iter_runs(2, 1150.0, 1420.0, chunk_size=2))
+        db_manager.close()
+        reading_times = np.concatenate([chunk[0] for chunk in chunks])
+        frames = np.concatenate([chunk[1] for chunk in chunks])
+        self.assertTrue(np.array_equal(reading_times, self.reading_times[150:420]))
+        self.assertTrue(np.array_equal(frames, self.frames[150:420]))
+
+    def test_skipped_readings_get_their_scheduled_times(self):
+        """
+        Tests that the readings skipped between two stored readings are
+        rebuilt at the scheduled times of their ticks, whatever the jitter
+        of the stored reading times, including across the pages of iter_runs.
+        """
+        rng = np.random.default_rng(3)
+        scheduled_times = self.reading_times
+        reading_times = scheduled_times + rng.uniform(0, 0.2, len(scheduled_times))
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        deadband = DeadbandFilter(0, heartbeat=None)
+        stored = np.zeros(len(reading_times), dtype=bool)
+        for index, (reading_time, scheduled_time, frame) in enumerate(zip(reading_times, scheduled_times, self.frames)):
+            skipped = deadband.check(reading_time, frame, scheduled_time)
+            if skipped is not None:
+                stored[index] = True
+                db_manager.insert_frame(float(reading_time), memoryview(frame), float(scheduled_time), sensor_id=2, skipped=skipped)
+        reading_time, frame, skipped, scheduled_time = deadband.flush()
+        self.assertEqual(scheduled_time, scheduled_times[-1])
+        stored[-1] = True
+        db_manager.insert_frame(float(reading_time), memoryview(frame), float(scheduled_time), sensor_id=2, skipped=skipped)
+
+        expected = np.where(stored, reading_times, scheduled_times)
+        chunks = list(db_manager.iter_runs(2, 1000.0, 2000.0, chunk_size=3))
+        db_manager.close()
+        times = np.concatenate([chunk[0] for chunk in chunks])
+        self.assertTrue(np.array_equal(times, expected))
+        self.assertTrue(np.array_equal(np.concatenate([chunk[1] for chunk in chunks]), self.frames))
+
+    def test_runs_stop_at_schedule_gaps(self):
+        """
+        Tests that a restarted capture, and a run broken by missed ticks,
+        store their next reading instead of counting it as skipped against a
+        reading stored before the gap.
+        """
+        db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.return_value": True, "stores_runs.return_value": True})
+        app = SensorApplication(db, {"deadband": 1000, "heartbeat": None})
+        sensor = app.add_sensor(6, 'mockup', 0.005, 0, 100, seed=1)
+
+        async def run():
+            for _ in range(2):
+                await sensor.start_capture()
+                await asyncio.sleep(0.05)
+                await sensor.stop_capture()
+            await sensor.break_deadband_run()
+            for tick in range(6):
+                await sensor.store_frame(100.0 + tick, sensor.read_frame(), 100.0 + tick, time.perf_counter())
+                if tick == 2:
+                    await sensor.break_deadband_run()
+            sensor.flush_deadband()
+
+        asyncio.run(run())
+        calls = [(call.args[2], call.args[4]) for call in db.insert_frame.call_args_list]
+        # Every capture stores its first reading, and closes its run with the scheduled time of its last reading
+        self.assertEqual(calls[0][1], 0)
+        self.assertIsNotNone(calls[1][0])
+        self.assertEqual(calls[2][1], 0)
+        self.assertEqual(calls[-4:], [(100.0, 0), (102.0, 1), (103.0, 0), (105.0, 1)])
+
+    def test_capture_stores_changes_only(self):
+        """
+        Tests that a capturing sensor with a deadband stores fewer readings
+        than it captures, closes its last run when stopped, and is refused
+        by storage formats without run-length counts.
+        """
+        db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.return_value": True, "stores_runs.return_value": True})
+        app = SensorApplication(db, {"deadband": 100, "heartbeat": 0.05})
+        sensor = app.add_sensor(6, 'mockup', 0.002, 0, 100, seed=1)
+
+        async def run():
+            await sensor.start_capture()
+            await asyncio.sleep(0.2)
+            await sensor.stop_capture()
+
+        asyncio.run(run())
+        stats = app.metrics(6)["deadband"]
+        self.assertEqual(stats["frames_stored"] + stats["frames_skipped"], sensor.metrics.frames_captured)
+        self.assertGreater(stats["frames_skipped"], stats["frames_stored"])
+        self.assertEqual(db.insert_frame.call_count, stats["frames_stored"])
+        skipped = sum(call.args[4] for call in db.insert_frame.call_args_list)
+        self.assertEqual(skipped, stats["frames_skipped"])
+        self.assertEqual(sensor.metrics.snapshot()["bytes_written"], 128 * stats["frames_stored"])
+
+        db.stores_runs.return_value = False
+        with self.assertRaises(ValueError):
+            app.add_sensor(7, 'mockup', 0.002, 0, 100)
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+        self.frames = np.arange(2500 * 64, dtype=np.uint16).reshape(2500, 64)
+        self.reading_times = 1000.0 + np.arange(2500) * 0.5
+        self.db_manager = DatabaseManager(self.db_path)
+        self.db_manager.connect()
+        self.db_manager.start_writer(batch_size=500, max_delay=0.05)
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            self.db_manager.insert_frame(float(reading_time), memoryview(frame), sensor_id=4)
+        self.db_manager.close()
+        self.db_manager.connect()
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_npy_export_is_memory_mappable(self):
+        """
+        Tests that a range exported to .npy in chunks is loaded back as
+        memory-mapped records, with progress reported after every chunk.
+        """
+        path = os.path.join(self.tmp_dir.name, 'frames.npy')
+        progress = []
+        exported = export.export_frames(self.db_manager, 4, 1100.0, 1900.0, path, chunk_size=300,
+                                        progress=lambda count, reading_time: progress.append((count, reading_time)))
+        self.assertEqual(exported, 1600)
+        self.assertEqual(len(progress), 6)
+        self.assertEqual(progress[-1], (1600, 1899.5))
+        records = np.load(path, mmap_mode='r')
+        self.assertIsInstance(records, np.memmap)
+        self.assertTrue(np.array_equal(records["reading_time"], self.reading_times[200:1800]))
+        self.assertTrue(np.array_equal(records["data"], self.frames[200:1800]))
+        del records
+
+    def test_csv_export(self):
+        """
+        Tests that a CSV export has a header line and one line per reading
+        with its time and 64 values.
+        """
+        path = os.path.join(self.tmp_dir.name, 'frames.csv')
+        self.assertEqual(export.export_frames(self.db_manager, 4, 1000.0, 1002.0, path, chunk_size=3), 4)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(lines[0].split(",")[:2], ["reading_time", "pixel_0"])
+        values = np.loadtxt(path, delimiter=",", skiprows=1)
+        self.assertTrue(np.array_equal(values[:, 0], self.reading_times[:4]))
+        self.assertTrue(np.array_equal(values[:, 1:], self.frames[:4]))
+
+    def test_unknown_and_optional_formats(self):
+        """
+        Tests that unknown formats are rejected and that Parquet exports
+        require pyarrow.
+        """
+        with self.assertRaises(ValueError):
+            export.export_frames(self.db_manager, 4, 1000.0, 2000.0, os.path.join(self.tmp_dir.name, 'frames.txt'))
+        path = os.path.join(self.tmp_dir.name, 'frames.parquet')
+        if export.pyarrow is None:
+            with self.assertRaises(ImportError):
+                export.export_frames(self.db_manager, 4, 1000.0, 2000.0, path)
+            return
+        self.assertEqual(export.export_frames(self.db_manager, 4, 1000.0, 1010.0, path), 20)
+        table = export.pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column("data").to_pylist()[3], self.frames[3].tolist())
+
+class TestCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'central.db')
+        self.frames = np.arange(300 * 64, dtype=np.uint16).reshape(300, 64)
+        self.reading_times = 1000.0 + np.arange(300) * 0.01
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def batch(self, sensor_id, seq, start, count, first_unacked, epoch=1):
+        header = collector.FORWARD_HEADER.pack(epoch, first_unacked)
+        return header + encode_frames(sensor_id, seq, self.reading_times[start:start + count], self.frames[start:start + count])
+
+    def stored(self, central_id):
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute("SELECT reading_time, data FROM infrared_data WHERE sensor_id = ? ORDER BY id", (central_id,)).fetchall()
+        conn.close()
+        return np.array([row[0] for row in rows]), np.frombuffer(b"".join(row[1] for row in rows), dtype=np.uint16).reshape(-1, 64)
+
+    def test_store_orders_and_deduplicates(self):
+        """
+        Tests that forwarded batches are stored once, in sequence order per
+        node and sensor, that the nodes are acknowledged after the commit,
+        and that a restarted collector still recognizes resent batches.
+        """
+        async def run():
+            db_manager = DatabaseManager(self.db_path)
+            db_manager.connect()
+            publish = AsyncMock()
+            store = collector.CollectorStore(db_manager, publish, batch_frames=1000, max_delay=0.05)
+            # A batch overtakes a lost one, then the lost one and a duplicate are resent
+            for seq, start in ((100, 0), (120, 20), (100, 0), (110, 10)):
+                store.receive("edge-a", self.batch(1, seq, start, 10, 100), "collector.edge-a.acks")
+            store.receive("edge-b", self.batch(1, 5, 100, 5, 5), "collector.edge-b.acks")
+            await store.flush()
+            acks = {call.args[0]: json.loads(call.args[1]) for call in publish.await_args_list}
+            streams = {(stream["node"], stream["sensor_id"]): stream for stream in store.stats()["streams"]}
+            store.close()
+
+            # After a restart, resent frames are recognized and a gap is given up on after the timeout
+            publish.reset_mock()
+            store = collector.CollectorStore(db_manager, publish, gap_timeout=0.0)
+            store.receive("edge-a", self.batch(1, 115, 15, 20, 115), "collector.edge-a.acks")
+            store.receive("edge-a", self.batch(1, 200, 200, 10, 115), "collector.edge-a.acks")
+            store.check_gaps()
+            await store.flush()
+            restarted = store.stats()["streams"][0]
+            resent_ack = json.loads(publish.await_args.args[1])
+            store.close()
+            db_manager.close()
+            return acks, streams, restarted, resent_ack
+
+        acks, streams, restarted, resent_ack = asyncio.run(run())
+        self.assertEqual(acks["collector.edge-a.acks"], {"sensor_id": 1, "epoch": 1, "next_seq": 130})
+        self.assertEqual(acks["collector.edge-b.acks"], {"sensor_id": 1, "epoch": 1, "next_seq": 10})
+        self.assertEqual(streams[("edge-a", 1)]["frames_duplicated"], 10)
+        self.assertEqual(streams[("edge-b", 1)]["central_id"], 2)
+        self.assertEqual(restarted["frames_duplicated"], 15)
+        self.assertEqual(restarted["frames_lost"], 65)
+        self.assertEqual(resent_ack, {"sensor_id": 1, "epoch": 1, "next_seq": 210})
+
+        reading_times, frames = self.stored(1)
+        expected = np.r_[0:35, 200:210]
+        self.assertTrue(np.array_equal(reading_times, self.reading_times[expected]))
+        self.assertTrue(np.array_equal(frames, self.frames[expected]))
+        self.assertTrue(np.array_equal(self.stored(2)[1], self.frames[100:105]))
+
+    def test_frame_blobs(self):
+        """
+        Tests that a batch is split into the bytes of its frames, all sliced
+        from a single copy of the batch.
+        """
+        frames = self.frames[10:15].astype('<u2')
+        blobs = collector.frame_blobs(frames)
+        self.assertEqual([bytes(blob) for blob in blobs], [frame.tobytes() for frame in frames])
+        self.assertEqual({id(blob.obj) for blob in blobs}, {id(blobs[0].obj)})
+        self.assertEqual(collector.frame_blobs(frames[:0]), [])
+
+    def test_restarted_node_with_lower_seq(self):
+        """
+        Tests that the frames of a restarted node are stored even though its
+        sequence numbers start lower than the stored ones, and that late
+        batches of the previous run are dropped without acknowledgement.
+        """
+        async def run():
+            db_manager = DatabaseManager(self.db_path)
+            db_manager.connect()
+            publish = AsyncMock()
+            store = collector.CollectorStore(db_manager, publish)
+            store.receive("edge-a", self.batch(1, 1000, 0, 10, 1000, epoch=5), "collector.edge-a.acks")
+            # The batch of 1020 waits for the lost batch of 1010, which the restart loses for good
+            store.receive("edge-a", self.batch(1, 1020, 20, 10, 1000, epoch=5), "collector.edge-a.acks")
+            await store.flush()
+            store.receive("edge-a", self.batch(1, 0, 100, 10, 0, epoch=9), "collector.edge-a.acks")
+            await store.flush()
+            ack = json.loads(publish.await_args.args[1])
+            publish.reset_mock()
+            store.receive("edge-a", self.batch(1, 1010, 10, 10, 1000, epoch=5), "collector.edge-a.acks")
+            await store.flush()
+            stream = store.stats()["streams"][0]
+            store.close()
+            db_manager.close()
+            return ack, stream, publish.await_count
+
+        ack, stream, late_acks = asyncio.run(run())
+        self.assertEqual(ack, {"sensor_id": 1, "epoch": 9, "next_seq": 10})
+        self.assertEqual(late_acks, 0)
+        self.assertEqual(stream["epoch"], 9)
+        self.assertEqual(stream["frames_lost"], 10)
+        self.assertEqual(stream["frames_stale"], 10)
+        self.assertTrue(np.array_equal(self.stored(1)[1], self.frames[np.r_[0:10, 100:110]]))
+
+    def test_forwarder_resends_until_acked(self):
+        """
+        Tests that forwarded batches are kept until acknowledged, sent again
+        once the acknowledgement is late, and bounded in number.
+        """
+        publish = AsyncMock()
+        link = collector.CollectorLink(publish, "n1", batch_size=2, linger=1.0, ack_timeout=0.01, max_unacked=3)
+        forwarder = link.forwarder(7)
+        first = forwarder.next_seq
+
+        async def run():
+            for frame in self.frames[:8]:
+                await forwarder.add(0.0, frame)
+            # An acknowledgement meant for a previous run of the node is ignored
+            await link.ack_handler(Mock(data=json.dumps({"sensor_id": 7, "epoch": forwarder.epoch + 1, "next_seq": first + 8}).encode()))
+            await link.ack_handler(Mock(data=json.dumps({"sensor_id": 7, "epoch": forwarder.epoch, "next_seq": first + 6}).encode()))
+            await asyncio.sleep(0.02)
+            await forwarder.resend()
+
+        asyncio.run(run())
+        self.assertEqual(publish.await_count, 5)
+        subject, payload, reply = publish.await_args.args
+        self.assertEqual((subject, reply), ("collector.n1.7.frames", "collector.n1.acks"))
+        self.assertEqual(collector.FORWARD_HEADER.unpack_from(payload), (forwarder.epoch, first + 6))
+        self.assertEqual(decode_frames(payload[collector.FORWARD_HEADER.size:])["seq"], first + 6)
+        stats = forwarder.stats()
+        self.assertEqual(stats["frames_unacked_dropped"], 2)
+        self.assertEqual(stats["frames_acked"], 4)
+        self.assertEqual(stats["frames_unacked"], 2)
+        self.assertEqual(stats["frames_resent"], 2)
+        with self.assertRaises(ValueError):
+            collector.CollectorLink(publish, "bad.node")
+
+    def test_nodes_forward_through_broker(self):
+        """
+        Tests that the frames of capturing sensors on two nodes reach the
+        collector process through the broker, despite lost messages, and are
+        all acknowledged and stored in order.
+        """
+        args = parse_args(['--collector', '--db-uri', self.db_path, '--collector-max-delay', '0.02', '--log-file', ''])
+
+        async def run():
+            broker = await LocalBroker().start()
+            collector_task = asyncio.create_task(collector.run_collector(args, broker.url))
+            sensors = []
+            for node in ("edge-a", "edge-b"):
+                client = NATSClient(broker.url, None, None, asyncio.Event())
+                await client.connect()
+                lost = []
+
+                async def publish(subject, payload, reply="", client=client, lost=lost):
+                    # The first batches are lost on the way
+                    if len(lost) < 2:
+                        lost.append(subject)
+                        return
+                    await client.publish(subject, payload, reply)
+
+                link = collector.CollectorLink(publish, node, batch_size=10, linger=0.01, ack_timeout=0.2)
+                await client.subscribe(link.ack_subject, cb=link.ack_handler)
+                db = Mock(**{"needs_backpressure.return_value": False, "insert_frame.return_value": True})
+                sensor = DataCapture(db, 0.002, 'mockup', 0, 100, sensor_id=3, forward=link)
+                sensors.append((client, link, db, sensor))
+            await asyncio.sleep(0.2)
+            for _, _, _, sensor in sensors:
+                await sensor.start_capture()
+            await asyncio.sleep(0.3)
+            drained = []
+            for client, link, _, sensor in sensors:
+                await sensor.stop_capture()
+                drained.append(await link.drain(10))
+            stats = json.loads((await sensors[0][0].nc.request("collector.streams", b"", timeout=5)).data)
+            await sensors[0][0].nc.publish("test.shutdown", b"")
+            await asyncio.wait_for(collector_task, 10)
+            for client, _, _, _ in sensors:
+                await client.nc.close()
+            await broker.stop()
+            return sensors, drained, stats
+
+        sensors, drained, stats = asyncio.run(run())
+        self.assertEqual(drained, [True, True])
+        self.assertEqual({(stream["node"], stream["sensor_id"]) for stream in stats["streams"]}, {("edge-a", 3), ("edge-b", 3)})
+        conn = sqlite3.connect(self.db_path)
+        central_ids = dict(conn.execute("SELECT node, central_id FROM collector_streams").fetchall())
+        conn.close()
+        for (_, link, db, sensor), node in zip(sensors, ("edge-a", "edge-b")):
+            self.assertGreater(link.forwarders[3].frames_resent, 0)
+            local = np.frombuffer(b"".join(bytes(call.args[1]) for call in db.insert_frame.call_args_list), dtype=np.uint16).reshape(-1, 64)
+            reading_times, frames = self.stored(central_ids[node])
+            self.assertEqual(len(frames), sensor.metrics.frames_captured)
+            self.assertTrue(np.array_equal(frames, local))
+            self.assertTrue(np.all(np.diff(reading_times) >= 0))
+
+class TestFrameLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'framelog')
+        self.frames = np.arange(100 * 64, dtype=np.uint16).reshape(100, 64)
+        self.reading_times = 1000.0 + np.arange(100) * 0.5
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fill(self, frame_log):
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            frame_log.append(7, float(reading_time), memoryview(frame), float(reading_time))
+
+    def test_append_and_lookup(self):
+        """
+        Tests that appended frames get consecutive sequence numbers and are
+        found by sequence number and by time.
+        """
+        frame_log = FrameLog(self.path)
+        self.assertEqual(frame_log.append(7, 1000.0, memoryview(self.frames[0])), 0)
+        self.assertEqual(frame_log.append(7, 1000.5, memoryview(self.frames[1]), 1000.5), 1)
+        log = frame_log.sensor(7)
+        self.assertEqual(len(log), 2)
+        self.assertTrue(np.isnan(log.get(0)["scheduled_time"]))
+        self.assertTrue(np.array_equal(log.get(1)["data"], self.frames[1]))
+        self.assertEqual(log.search(1000.2), 1)
+        self.assertEqual(log.search(2000.0), 2)
+        with self.assertRaises(IndexError):
+            log.get(2)
+
+    def test_segments_roll_and_reopen(self):
+        """
+        Tests that the log rolls over to new segments when they are full,
+        that range scans cross segment boundaries, and that reopening the
+        directory recovers every record.
+        """
+        segment_bytes = HEADER_DTYPE.itemsize + 30 * RECORD_DTYPE.itemsize
+        frame_log = FrameLog(self.path, segment_bytes)
+        self.fill(frame_log)
+        frame_log.flush()
+        self.assertEqual(len(os.listdir(os.path.join(self.path, 'sensor_7'))), 4)
+
+        log = FrameLog(self.path, segment_bytes).sensor(7)
+        self.assertEqual(len(log), 100)
+        self.assertEqual(log.get(65)["reading_time"], self.reading_times[65])
+        pages = list(log.iter_range(1010.0, 1040.0, 16))
+        self.assertTrue(all(len(page) <= 16 for page in pages))
+        records = np.concatenate(pages)
+        self.assertTrue(np.array_equal(records["reading_time"], self.reading_times[20:80]))
+        self.assertTrue(np.array_equal(records["data"], self.frames[20:80]))
+
+    def test_framelog_rejects_unsupported_options(self):
+        """
+        Tests that the frame log refuses the SQLite storage options instead of
+        silently ignoring them, and accepts their default values.
+        """
+        uri = "framelog://" + self.path
+        for options in ({"partition": "day"}, {"retention": 3600.0}, {"storage_format": "chunked"}):
+            with self.assertRaises(ValueError):
+                open_database(uri, **options)
+        args = parse_args(['--sensor-type', 'mockup', '--reading-frequency', '1', '--min-value', '1', '--max-value', '2', '--db-uri', uri])
+        self.assertIsInstance(open_database(uri, **cli.database_options(args)), FrameLogDatabase)
+
+    def test_framelog_database(self):
+        """
+        Tests that a framelog:// URI selects the frame log backend and that
+        range queries read the frames back through ``iter_frames``.
+        """
+        db_manager = open_database("framelog://" + self.path, segment_bytes=4096)
+        self.assertIsInstance(db_manager, FrameLogDatabase)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=10, max_delay=0.05)
+        for reading_time, frame in zip(self.reading_times, self.frames):
+            self.assertTrue(db_manager.insert_frame(float(reading_time), memoryview(frame), sensor_id=7))
+        chunks = list(db_manager.iter_frames(7, 1005.0, 1045.0, stride=2, chunk_size=8))
+        db_manager.close()
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'index.db')))
+        reading_times = np.concatenate([chunk[0] for chunk in chunks])
+        frames = np.concatenate([chunk[1] for chunk in chunks])
+        self.assertTrue(np.array_equal(reading_times, self.reading_times[10:90:2]))
+        self.assertTrue(np.array_equal(frames, self.frames[10:90:2]))
+
+class TestQueryService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+        self.db_manager = DatabaseManager(self.db_path)
+        self.db_manager.connect()
+        for i in range(100):
+            for sensor_id in (1, 2):
+                self.db_manager.insert_frame(1000.0 + i, np.full(64, i, dtype=np.uint16).tobytes(), sensor_id=sensor_id)
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def run_query(self, request, chunk_bytes=2048):
+        """
+        Send a query to NATSClient.query_handler() and decode the reply chunks.
+        """
+        client = NATSClient("nats://localhost:4222", self.db_manager, Mock(query_chunk_bytes=chunk_bytes), asyncio.Event())
+        client.nc = Mock()
+        client.nc.publish = AsyncMock()
+        msg = Mock(subject="sensors.query", reply="inbox.1", data=json.dumps(request).encode())
+        asyncio.run(client.query_handler(msg))
+        output_format = request.get("format", "json")
+        return [query_protocol.decode_chunk(output_format, call.args[1]) for call in client.nc.publish.call_args_list]
+
+    def test_range_query_uses_index(self):
+        """
+        Tests that range queries on a sensor are answered from the
+        (sensor_id, reading_time) index.
+        """
+        plan = self.db_manager.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id, reading_time, data FROM infrared_data "
+            "WHERE sensor_id = 1 AND reading_time < 2000 AND (reading_time, id) > (1000, -1) ORDER BY reading_time, id"
+        ).fetchall()
+        self.assertIn("idx_infrared_data_sensor_time", " ".join(row[-1] for row in plan))
+
+    def test_query_streams_bounded_chunks(self):
+        """
+        Tests that a query is answered in several binary chunks no bigger
+        than the configured size, with only the final chunk flagged as last.
+        """
+        chunks = self.run_query({"sensor_id": 1, "start": 1010, "end": 1090, "format": "binary"})
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual([chunk["last"] for chunk in chunks], [False] * (len(chunks) - 1) + [True])
+        self.assertEqual([chunk["seq"] for chunk in chunks], list(range(len(chunks))))
+        reading_times = np.concatenate([chunk["reading_time"] for chunk in chunks])
+        frames = np.concatenate([chunk["data"] for chunk in chunks])
+        self.assertEqual(reading_times.tolist(), [1000.0 + i for i in range(10, 90)])
+        self.assertEqual(frames[:, 0].tolist(), list(range(10, 90)))
+
+    def test_query_stride_and_limit(self):
+        """
+        Tests that stride and limit are applied to the readings of the range.
+        """
+        chunks = self.run_query({"sensor_id": 2, "start": 1000, "end": 1100, "stride": 7, "limit": 5}, chunk_bytes=1000)
+        reading_times = np.concatenate([chunk["reading_time"] for chunk in chunks])
+        self.assertEqual(reading_times.tolist(), [1000.0, 1007.0, 1014.0, 1021.0, 1028.0])
+
+    def test_rollup_query(self):
+        """
+        Tests that rollup queries are answered from the rollup table, with
+        one summary per bucket.
+        """
+        aggregator = RollupAggregator(1, 60)
+        for i in range(180):
+            closed = aggregator.add(6000.0 + i, np.full(64, i, dtype=np.uint16))
+            if closed is not None:
+                self.db_manager.insert_rollup(closed)
+        self.db_manager.insert_rollup(aggregator.flush())
+
+        client = NATSClient("nats://localhost:4222", self.db_manager, Mock(query_chunk_bytes=4096), asyncio.Event())
+        client.nc = Mock()
+        client.nc.publish = AsyncMock()
+        request = {"sensor_id": 1, "kind": "rollup", "interval": 60, "start": 6000, "end": 6180, "format": "binary"}
+        asyncio.run(client.query_handler(Mock(reply="inbox.1", data=json.dumps(request).encode())))
+        chunks = [query_protocol.decode_rollup_chunk("binary", call.args[1]) for call in client.nc.publish.call_args_list]
+        self.assertTrue(chunks[-1]["last"])
+        starts = np.concatenate([chunk["bucket_start"] for chunk in chunks])
+        means = np.concatenate([chunk["mean"] for chunk in chunks])
+        self.assertEqual(starts.tolist(), [6000.0, 6060.0, 6120.0])
+        self.assertEqual(means[:, 0].tolist(), [29.5, 89.5, 149.5])
+
+    def test_binary_chunks_are_little_endian(self):
+        """
+        Tests that the body of binary chunks is little-endian, like their
+        header, whatever the byte order of the host.
+        """
+        frames = np.array([[0x0102] * 64], dtype=np.uint16)
+        payload = query_protocol.encode_chunk("binary", 0, 1, np.array([1.5]), frames, True)
+        body = payload[query_protocol.CHUNK_HEADER.size:]
+        self.assertEqual(body[:8], struct.pack('<d', 1.5))
+        self.assertEqual(body[8:10], b'\x02\x01')
+        chunk = query_protocol.decode_chunk("binary", payload)
+        self.assertEqual(chunk["data"].tolist(), frames.tolist())
+
+        summary = {key: np.ones((1, width) if width > 1 else 1, dtype=dtype) for key, (dtype, width) in query_protocol.ROLLUP_FIELDS.items()}
+        payload = query_protocol.encode_rollup_chunk("binary", 0, 1, 60, summary, True)
+        body = payload[query_protocol.CHUNK_HEADER.size:]
+        self.assertEqual(body[:16], struct.pack('<dq', 1.0, 1))
+        chunk = query_protocol.decode_rollup_chunk("binary", payload)
+        self.assertEqual(chunk["std"].tolist(), [[1.0] * 64])
+
+    def test_query_errors(self):
+        """
+        Tests that an empty range gets a single empty last chunk, and that an
+        invalid request gets an error reply.
+        """
+        chunks = self.run_query({"sensor_id": 3, "start": 0, "end": 1})
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0]["last"])
+        self.assertEqual(len(chunks[0]["reading_time"]), 0)
+
+        chunks = self.run_query({"start": 0})
+        self.assertEqual(len(chunks), 1)
+        self.assertIsNotNone(chunks[0]["error"])
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_latency_histogram(self):
+        """
+        Tests that samples are counted in fixed buckets and that percentiles
+        are bounded by the upper bound of their bucket.
+        """
+        histogram = LatencyHistogram()
+        for _ in range(90):
+            histogram.record(0.0005)
+        for _ in range(10):
+            histogram.record(0.2)
+        histogram.record(100.0)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 101)
+        self.assertEqual(snapshot["max"], 100.0)
+        self.assertTrue(0.0005 <= snapshot["p50"] < 0.001)
+        self.assertTrue(0.2 <= snapshot["p99"] < 0.36)
+        self.assertEqual(sum(count for _, count in snapshot["buckets"]), 101)
+        # The sample above the last bound lands in the overflow bucket
+        self.assertEqual(snapshot["buckets"][-1], [None, 1])
+
+    def test_sensor_metrics_snapshot(self):
+        """
+        Tests that capturing records every stage of the loop, that the
+        counters match the captured frames and that the snapshot, including
+        the shared writer commit latency, can be sent as JSON.
+        """
+        db_manager = DatabaseManager(self.db_path)
+        db_manager.connect()
+        db_manager.start_writer(batch_size=5, max_delay=0.02)
+        app = SensorApplication(db_manager)
+        sensor = app.add_sensor(1, 'mockup', 0.005, 0, 100)
+
+        async def run():
+            await app.process_command(1, "start")
+            await asyncio.sleep(0.1)
+            await app.process_command(1, "stop")
+
+        asyncio.run(run())
+        snapshot = asyncio.run(app.process_command(1, "metrics"))
+        db_manager.close()
+
+        self.assertEqual(snapshot["frames_captured"], sensor.ring_buffer.count)
+        self.assertEqual(snapshot["bytes_written"], 128 * sensor.ring_buffer.count)
+        self.assertEqual(snapshot["scheduler"]["missed_ticks"], snapshot["frames_dropped"])
+        self.assertEqual(set(snapshot["stages"]), {"jitter", "read", "pack", "publish", "enqueue", "commit"})
+        self.assertEqual(snapshot["stages"]["read"]["count"], snapshot["frames_captured"])
+        self.assertGreater(snapshot["stages"]["commit"]["count"], 0)
+        self.assertEqual(snapshot["queue_depth"], 0)
+        json.dumps(snapshot)
+
+class TestLoopMonitor(unittest.TestCase):
+    def test_blocking_call_is_reported_with_its_stack(self):
+        """
+        Tests that a synchronous call holding the event loop is counted as a
+        stall and that the watchdog logs the stack of the call.
+        """
+        def hold_the_loop():
+            time.sleep(0.3)
+
+        async def run():
+            monitor = LoopMonitor(interval=0.01, block_threshold=0.05)
+            monitor.start()
+            await asyncio.sleep(0.05)
+            hold_the_loop()
+            await asyncio.sleep(0.05)
+            await monitor.stop()
+            return monitor.stats()
+
+        with self.assertLogs("loop_monitor", "WARNING") as logs:
+            stats = asyncio.run(run())
+        self.assertEqual(stats["stalls"], 1)
+        self.assertGreater(stats["longest_stall"], 0.2)
+        self.assertEqual(stats["stacks_captured"], 1)
+        self.assertIn("hold_the_loop", stats["last_stack"])
+        self.assertIn("hold_the_loop", logs.output[0])
+        self.assertGreater(stats["lag"]["count"], 5)
+        self.assertEqual(stats["lag"]["max"], stats["longest_stall"])
+
+    def test_metrics_include_loop_health(self):
+        """
+        Tests that the metrics snapshot of a sensor holds the loop lag
+        statistics, and that invalid settings are rejected.
+        """
+        app = SensorApplication(Mock(writer=None))
+        app.add_sensor(1, 'mockup', 1.0, 0, 10)
+        self.assertIsNone(app.metrics(1)["loop"])
+
+        async def run():
+            app.loop_monitor = LoopMonitor(interval=0.01)
+            app.loop_monitor.start()
+            await asyncio.sleep(0.1)
+            await app.loop_monitor.stop()
+
+        asyncio.run(run())
+        snapshot = app.metrics(1)
+        self.assertGreater(snapshot["loop"]["lag"]["count"], 0)
+        self.assertIsNone(snapshot["loop"]["last_stack"])
+        json.dumps(snapshot)
+        with self.assertRaises(ValueError):
+            LoopMonitor(interval=0)
+        with self.assertRaises(ValueError):
+            LoopMonitor(block_threshold=-1)
+
+    def test_shutdown_closes_connection(self):
+        """
+        Tests that test.shutdown only signals the main loop, and that the
+        connection is then closed, awaited, without hanging.
+        """
+        async def run():
+            broker = await LocalBroker().start()
+            exit_event = asyncio.Event()
+            client = NATSClient(broker.url, None, Mock(sensor_type=None), exit_event, SensorApplication(Mock()))
+            await client.connect()
+            await client.subscribe("test.*", cb=client.message_handler)
+            requester = await nats.connect(broker.url)
+            await requester.publish("test.shutdown", b"")
+            await asyncio.wait_for(exit_event.wait(), 5)
+            await client.close()
+            closed = client.nc.is_closed
+            await requester.close()
+            await broker.stop()
+            return closed
+
+        self.assertTrue(asyncio.run(run()))
+
+class TestBenchmark(unittest.TestCase):
+    def test_subject_matches(self):
+        """
+        Tests the wildcard matching of the local broker.
+        """
+        self.assertTrue(subject_matches("sensors.*.start".split("."), "sensors.3.start".split(".")))
+        self.assertFalse(subject_matches("sensors.*.start".split("."), "sensors.3.stop".split(".")))
+        self.assertTrue(subject_matches("_INBOX.>".split("."), "_INBOX.abc.1".split(".")))
+        self.assertFalse(subject_matches("_INBOX.>".split("."), "_INBOX".split(".")))
+        self.assertFalse(subject_matches("test.*".split("."), "test.a.b".split(".")))
+
+    def test_local_broker_request_reply(self):
+        """
+        Tests that the NATS client connects to the local broker and that a
+        control request is routed to the sensor handler and answered.
+        """
+        async def run():
+            broker = await LocalBroker().start()
+            app = SensorApplication(Mock())
+            app.add_sensor(5, 'mockup', 1.0, 0, 10)
+            client = NATSClient(broker.url, None, Mock(sensor_type=None), asyncio.Event(), app)
+            await client.connect()
+            await client.subscribe_sensors()
+            requester = await nats.connect(broker.url)
+            reply = await requester.request("sensors.5.latest", b"", timeout=1)
+            await requester.close()
+            await client.nc.close()
+            await broker.stop()
+            return json.loads(reply.data)
+
+        self.assertEqual(asyncio.run(run()), {"sensor_id": 5, "reading_time": None, "data": None})
+
+    def test_scenario_and_baseline_comparison(self):
+        """
+        Tests that a short scenario stores every captured frame, and that a
+        drop in throughput beyond the tolerance is reported as a regression.
+        """
+        results = asyncio.run(benchmark.run_scenario(2, 0.01, 50, "rows", 0.2))
+        self.assertGreater(results["frames_captured"], 0)
+        self.assertEqual(results["frames_stored"], results["frames_captured"])
+        self.assertGreater(results["control_requests"], 0)
+
+        # In a process of its own, the peak memory of a scenario is its own
+        isolated = asyncio.run(benchmark.run_isolated(1, 0.01, 50, "rows", 0.1))
+        self.assertEqual(isolated["frames_stored"], isolated["frames_captured"])
+        if benchmark.resource is not None:
+            self.assertLess(isolated["peak_rss_mb"], benchmark.peak_rss_mb() + 1)
+
+        current = {"scenarios": [{"name": "a", "results": {"frames_per_second": 700.0, "cpu_percent": 10.0}}]}
+        baseline = {"scenarios": [{"name": "a", "results": {"frames_per_second": 1000.0, "cpu_percent": 10.5}}]}
+        comparisons = {comparison["result"]: comparison for comparison in benchmark.compare_results(current, baseline, 0.1)}
+        self.assertTrue(comparisons["frames_per_second"]["regression"])
+        self.assertFalse(comparisons["cpu_percent"]["regression"])
+
+class TestFrameStream(unittest.TestCase):
+    def test_publisher_batches_and_linger(self):
+        """
+        Tests that frames are published in full batches, that a partial batch
+        is published once its linger time expires, and that the binary
+        messages decode back to the frames with consecutive sequence numbers.
+        """
+        frames = MockupFrameGenerator(0, 1000, seed=1).frames(7)
+        messages = []
+
+        async def publish(subject, payload):
+            messages.append((subject, payload))
+
+        async def run():
+            publisher = FramePublisher(publish, 4, batch_size=3, linger=0.02)
+            for index, frame in enumerate(frames):
+                await publisher.add(100.0 + index, frame)
+            self.assertEqual(len(messages), 2)
+            await asyncio.sleep(0.05)
+            return publisher
+
+        publisher = asyncio.run(run())
+        self.assertEqual(publisher.stats(), {"frames_published": 7, "messages_published": 3, "messages_failed": 0})
+        decoded = [decode_frames(payload) for _, payload in messages]
+        self.assertEqual({subject for subject, _ in messages}, {"sensors.4.frames"})
+        self.assertEqual([message["seq"] for message in decoded], [0, 3, 6])
+        self.assertEqual(len(messages[0][1]), 14 + 3 * (8 + 128))
+        self.assertTrue(np.array_equal(np.concatenate([message["data"] for message in decoded]), frames))
+        self.assertEqual(np.concatenate([message["reading_time"] for message in decoded]).tolist(), [100.0 + index for index in range(7)])
+
+    def test_publisher_reconfigure(self):
+        """
+        Tests that changing the batch size publishes the current batch first,
+        so frames keep their order and consecutive sequence numbers.
+        """
+        frames = MockupFrameGenerator(0, 1000, seed=2).frames(6)
+        messages = []
+
+        async def publish(subject, payload):
+            messages.append(decode_frames(payload))
+
+        async def run():
+            publisher = FramePublisher(publish, 1, batch_size=4, linger=1)
+            for index in range(2):
+                await publisher.add(float(index), frames[index])
+            await publisher.reconfigure(2, 1)
+            for index in range(2, 6):
+                await publisher.add(float(index), frames[index])
+
+        asyncio.run(run())
+        self.assertEqual([(message["seq"], len(message["data"])) for message in messages], [(0, 2), (2, 2), (4, 2)])
+        self.assertTrue(np.array_equal(np.concatenate([message["data"] for message in messages]), frames))
+
+    def test_batch_size_limits_and_byte_order(self):
+        """
+        Tests that batch sizes beyond the uint16 frame count of the header or
+        beyond the payload limit of the broker are rejected, and that the body
+        of a message is little-endian whatever the byte order of the host.
+        """
+        frame_stream.check_batching(frame_stream.MAX_BATCH_FRAMES, 0)
+        with self.assertRaises(ValueError):
+            frame_stream.check_batching(frame_stream.MAX_BATCH_FRAMES + 1, 0)
+        frame_stream.check_batching(10, 0, max_payload=frame_stream.message_size(10))
+        with self.assertRaises(ValueError):
+            FramePublisher(AsyncMock(), 1, batch_size=11, max_payload=frame_stream.message_size(10))
+
+        frames = np.array([[0x0102] * 64], dtype=np.uint16)
+        payload = frame_stream.encode_frames(1, 0, np.array([1.5]), frames)
+        body = payload[frame_stream.STREAM_HEADER.size:]
+        self.assertEqual(body[:8], struct.pack('<d', 1.5))
+        self.assertEqual(body[8:10], b'\x02\x01')
+        decoded = decode_frames(payload)
+        self.assertEqual(decoded["reading_time"].tolist(), [1.5])
+        self.assertEqual(decoded["data"].tolist(), frames.tolist())
+
+    def test_capture_streams_through_broker(self):
+        """
+        Tests that a capturing sensor publishes its frames live on
+        sensors.<id>.frames and that a subscriber receives every captured
+        frame, as stored in the ring buffer.
+        """
+        async def run():
+            broker = await LocalBroker().start()
+            client = NATSClient(broker.url, None, Mock(), asyncio.Event())
+            await client.connect()
+            consumer = await nats.connect(broker.url)
+            received = []
+
+            async def on_frames(msg):
+                received.append(decode_frames(msg.data))
+
+            await consumer.subscribe("sensors.2.frames", cb=on_frames)
+            await consumer.flush()
+            sensor = DataCapture(Mock(**{"needs_backpressure.return_value": False}), 0.005, 'mockup', 0, 100, sensor_id=2, publish=client.publish, stream_batch_size=4)
+            await sensor.start_capture()
+            await asyncio.sleep(0.1)
+            await sensor.stop_capture()
+            await client.nc.flush()
+            await asyncio.sleep(0.05)
+            await consumer.close()
+            await client.nc.close()
+            await broker.stop()
+            return sensor, received
+
+        sensor, received = asyncio.run(run())
+        frames = np.concatenate([message["data"] for message in received])
+        self.assertEqual(len(frames), sensor.ring_buffer.count)
+        self.assertTrue(np.array_equal(frames, sensor.ring_buffer.copy_last(len(frames))[1]))
+        self.assertEqual(sensor.metrics.stages["publish"].count, sensor.ring_buffer.count)
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, 'test.log')
+        self.root_level = logging.getLogger().level
+
+    def tearDown(self):
+        logging_setup.stop_logging()
+        logging.getLogger().setLevel(self.root_level)
+        self.tmp_dir.cleanup()
+
+    def test_records_written_by_listener(self):
+        """
+        Tests that module loggers go through a single queue handler on the
+        root logger, that enabled records reach the rotating log file once
+        logging is stopped, and that disabled levels are dropped.
+        """
+        logging_setup.configure_logging("INFO", self.log_path, max_bytes=1024, backup_count=2)
+        logging_setup.configure_logging("INFO", self.log_path, max_bytes=1024, backup_count=2)
+        root = logging.getLogger()
+        queue_handlers = [handler for handler in root.handlers if isinstance(handler, QueueHandler)]
+        self.assertEqual(len(queue_handlers), 1)
+
+        logger = logging.getLogger("data_capture_module")
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+        logger.debug("hidden message")
+        for i in range(50):
+            logger.info("visible message %d", i)
+        logging_setup.stop_logging()
+
+        with open(self.log_path) as log_file:
+            content = log_file.read()
+        self.assertIn("visible message 49", content)
+        self.assertNotIn("hidden message", content)
+        # The file was rotated instead of growing past its maximum size
+        self.assertTrue(os.path.exists(self.log_path + ".1"))
+        self.assertNotIn(queue_handlers[0], root.handlers)
+
+    def test_log_sampler(self):
+        """
+        Tests that the sampler lets through the first call and then one in
+        every configured number of calls.
+        """
+        sampler = logging_setup.LogSampler(3)
+        self.assertEqual([sampler.due() for _ in range(7)], [True, False, False, True, False, False, True])
+        logging_setup.configure_logging("INFO", None, sample_every=10)
+        self.assertEqual(logging_setup.LogSampler().every, 10)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file